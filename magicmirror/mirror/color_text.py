@@ -2,24 +2,83 @@
 #
 # Receives text through a Unix pipe and colors it by wrapping each character
 # in ANSI escape characters.
-# One flaw in the update_mirror.py script is that, in order for it to correctly
-# insert text at a specified column while preserving ANSI formatting, each
-# individual character we want to format needs to be formatted separately.
-# Thus, if you want the text "Hello World!" to be green, each letter will
-# be wrapped in its own ANSI escape characters.
-# Read the docstring for the 'break_line_into_characters()' function in
-# update_mirror.py for a more in depth explanation.
-# This is extremely redundant, and it increases the size of term.txt (and
-# therefor the overhead for our little Pi Zero to display the contents of
-# term.txt) by a significant margin (especially if there's a lot of formatted
-# text). However, it's the compromise I've chosen for now.
-# I may revisit it at a later date.
+# Each character gets an escape sequence of its own (followed by a reset), so
+# if you want the text "Hello World!" to be green, each letter is wrapped
+# separately. That used to be the only way update_mirror.py could insert text
+# at a specified column without losing its formatting, and it made term.txt
+# many times bigger than the text on the screen. Neither is true anymore:
+# update_mirror.py and the compositor keep track of the style from one escape
+# sequence to the next (see utilities/sgr_tokenizer.py), and term.txt is
+# written with an escape sequence only where the style changes (see
+# utilities/sgr_encoder.py), whatever the input looked like. So the
+# per-character escape sequences only cost a bit of time in the pipe.
+#
+# With --spans, the colored text is written out in the span format instead
+# (see utilities/spans.py), which update_mirror.py and the compositor can read
+# without parsing any escape sequences at all - that's the cheapest way to
+# hand them colored text:
+#     figlet hello | python color_text.py --spans -f 0 200 0 | \
+#         python mirror_client.py 0 0 30 6
+#
+# Text can be styled too, with --style (as many times as you like):
+#     date | python color_text.py -f 255 200 0 --style bold --style underline
+# The styles are stored as bits in each cell (see utilities/sgr_tokenizer.py),
+# the same as the colors, and term.txt only switches them on and off where
+# they change.
+#
+# If NumPy is installed, gradients are worked out for the whole text box at
+# once (see utilities/gradient_field.py) rather than one character at a time,
+# which makes a full screen gradient more than ten times faster. The output is
+# exactly the same either way.
+#
+# There are a few other kinds of gradient, which are worked out once as a
+# table of colors (see utilities/gradient_tables.py): a blend between any
+# number of colors, in any direction (including radiating out from a point),
+# and a sine wave that cycles between two colors:
+#     figlet hello | python color_text.py multi-gradient \
+#         -c red gold limegreen -d diagonal
+#     figlet hello | python color_text.py sine-gradient -p 12 -d radial
+#
+# With --stream, the text is colored as it comes in and each line is written
+# out as soon as it's done, so a long (or never-ending) stream of text doesn't
+# have to be held in memory, and the next stage of the pipe doesn't have to
+# wait for the end of it:
+#     tail -f ticker.txt | python color_text.py --stream -f 0 200 0
 
+import os
 import sys
+import codecs
 import argparse
-# import math
+from functools import lru_cache
+from itertools import chain, compress, repeat
 from utilities.color_tracker import LinearColorTracker
+from utilities.char_width import CONTINUATION, text_width
 from utilities.color_dict import color_dict
+from utilities.gradient_field import (
+    HAVE_NUMPY,
+    color_ids,
+    style_index,
+    tracker_field,
+)
+from utilities.gradient_tables import DIRECTIONS, gradient_map
+from utilities.sgr_tokenizer import (
+    DEFAULT_COLOR,
+    STYLE_NAMES,
+    code_points,
+    palette_color,
+    parse_styles,
+    rgb_color,
+    style_params,
+)
+from utilities.spans import cells_to_spans, encode_spans, iter_span_lines
+from utilities.timing import stage
+
+RESET = '\033[0m'
+
+# The 256-color lookup table only has 256 entries, so the parameters for each
+# one are worked out ahead of time
+_LOOKUP_FOREGROUND = tuple(f'38;5;{n};' for n in range(256))
+_LOOKUP_BACKGROUND = tuple(f'48;5;{n};' for n in range(256))
 
 def format_rgb(
         char: str,
@@ -28,7 +87,8 @@ def format_rgb(
         bf: int = 0,
         rb: int = 0,
         gb: int = 0,
-        bb: int = 0):
+        bb: int = 0,
+        attrs: int = 0):
     """ Input:
             char: str - the character we want to format.
             rf: int - the red component of the foreground
@@ -37,13 +97,41 @@ def format_rgb(
             rb: int - the red component of the background
             gb: int - the green component of the background
             bb: int - the blue component of the background
+            attrs: int - the style (bold, underline, etc.) as attribute bits
+                (see utilities/sgr_tokenizer.py)
         Output:
             formatted_string: str - a string wrapped with ASNI escape sequences
                 that will cause 'char' to be represented with foreground and
                 background colors specified by rf,gf,bf and rb,gb,bb
                 respectively
     """
+    # This is the character we're coloring, as well as an escape sequence to
+    # reset the terminal's behavior back to normal (otherwise the foreground/
+    # backgroung colors would be applied to all the text from here on)
+    return rgb_sgr(rf, gf, bf, rb, gb, bb, attrs) + char + RESET
+
+# Most text only uses a handful of colors (one, if it's a solid color), so
+# each escape sequence is built once and then looked up. A gradient can have a
+# lot of them, which is why the cache has a limit.
+@lru_cache(maxsize=4096)
+def rgb_sgr(
+        rf: int = 0,
+        gf: int = 0,
+        bf: int = 0,
+        rb: int = 0,
+        gb: int = 0,
+        bb: int = 0,
+        attrs: int = 0):
+    """ Input:
+            rf, gf, bf, rb, gb, bb, attrs: the same as for format_rgb()
+        Output:
+            the escape sequence format_rgb() puts in front of the character.
+            Calls with the same arguments return the same (cached) string.
+    """
     formatted_string = '\033['
+    # The style goes first, i.e. '1;4;' for bold and underlined
+    if attrs:
+        formatted_string += style_params(0, 0, attrs) + ';'
     # This specifies the color for the foreground (i.e., the color of the text)
     # as a set of RGB colors.
     # The default foreground is white, so my original, naive idea for cutting
@@ -57,17 +145,13 @@ def format_rgb(
         formatted_string += f'48;2;{rb};{gb};{bb};'
     # This removes the last semicolon from formatted_string.
     # It's just something we need to do so the ANSI sequences will be understood
-    formatted_string = formatted_string[:-1]
-    # This is the character we're coloring, as well as an escape sequence to
-    # reset the terminal's behavior back to normal (otherwise the foreground/
-    # backgroung colors would be applied to all the text from here on)
-    formatted_string += f'm{char}\033[0m'
-    return formatted_string
+    return formatted_string[:-1] + 'm'
 
 def format_by_lookup(
         char: str,
         foreground: int = None,
-        background: int = None):
+        background: int = None,
+        attrs: int = 0):
     """ Input:
             char: str - the character we want to format
             foreground: int - a number indicating a color in the system's
@@ -76,34 +160,73 @@ def format_by_lookup(
             background: int - a number indicating a color in the system's
                 256-color lookup table.
                 Specifies color to be applied to background.
+            attrs: int - the style (bold, underline, etc.) as attribute bits
         Output:
             formatted_string: str - a string wrapped with ASNI escape sequences
                 that will cause 'char' to be represented with foreground and
                 background colors specified by 'foreground' and 'background'
                 respectively.
     """
+    # This is the character we're coloring, as well as an escape sequence to
+    # reset the terminal's behavior back to normal (otherwise the foreground/
+    # backgroung colors would be applied to all the text from here on)
+    return lookup_sgr(foreground, background, attrs) + char + RESET
+
+@lru_cache(maxsize=4096)
+def lookup_sgr(
+        foreground: int = None,
+        background: int = None,
+        attrs: int = 0):
+    """ Input:
+            foreground, background, attrs: the same as for format_by_lookup()
+        Output:
+            the escape sequence format_by_lookup() puts in front of the
+            character. Calls with the same arguments return the same (cached)
+            string.
+    """
     formatted_string = '\033['
+    if attrs:
+        formatted_string += style_params(0, 0, attrs) + ';'
     # This sets the foreground color (i.e., the color of the text)
     if foreground:
-        formatted_string += f'38;5;{foreground};'
+        formatted_string += _lookup_params(foreground)
     # This sets the background color
     if background:
-        formatted_string += f'48;5;{background};'
+        formatted_string += _lookup_params(background, background=True)
     # This removes the last semicolon from formatted_string.
     # It's just something we need to do so the ANSI sequences will be understood
-    formatted_string = formatted_string[:-1]
+    return formatted_string[:-1] + 'm'
 
-    # This is the character we're coloring, as well as an escape sequence to
-    # reset the terminal's behavior back to normal (otherwise the foreground/
-    # backgroung colors would be applied to all the text from here on)
-    formatted_string += f'm{char}\033[0m'
-    return formatted_string
+def _lookup_params(color: int, background: bool = False) -> str:
+    """ Returns the parameters (and a semicolon) that set a color from the
+    256-color lookup table
+    """
+    table = _LOOKUP_BACKGROUND if background else _LOOKUP_FOREGROUND
+    if isinstance(color, int) and 0 <= color < 256:
+        return table[color]
+    # Not something the table has - format it the long way
+    return f'{48 if background else 38};5;{color};'
+
+def wrap_line(sgr: str, line: str) -> str:
+    """ Input:
+            sgr: str - an escape sequence (i.e. from rgb_sgr())
+            line: str - a line of text
+        Output:
+            the line, with each character wrapped in 'sgr' and a reset - the
+            same thing you'd get from formatting each character separately,
+            but built with a single join()
+    """
+    if not line:
+        return ''
+    return sgr + (RESET + sgr).join(line) + RESET
 
 def color_text(
         mode: str,
         text: str,
         foreground: tuple or int = None,
-        background: tuple or int = None):
+        background: tuple or int = None,
+        attrs: int = 0,
+        spans: bool = False):
     """ Input:
             mode: str - either 'rgb' or 'color_lookup'
             text: str - the text we want to format
@@ -114,6 +237,10 @@ def color_text(
                 lookup table (if mode is 'color_lookup)
             background: tuple of ints or int - the color we want to apply to the
                 background.
+            attrs: int - the style (bold, underline, etc.) as attribute bits
+                (see parse_styles() in utilities/sgr_tokenizer.py)
+            spans: bool - if True, the text is returned in the span format
+                (see utilities/spans.py) rather than as ANSI formatted text
         Output:
             formatted_text: str - the text specified by 'text', formatted with
                 the foreground and/or background colors specified by the user.
@@ -123,32 +250,102 @@ def color_text(
     values passed to update_mirror.py, but it might cause problems if you're
     writing other functions and you don't expect the behavior.
     """
-    formatted_text = ''
+    if spans:
+        return encode_spans(
+            color_cells(mode, text, foreground, background, attrs))
+    # Every character gets the same escape sequence, so we only need to
+    # build it once
     # RGB mode
     if mode == 'rgb':
         rf, gf, bf = tuple(foreground) if foreground else (0, 0, 0)
         rb, gb, bb = tuple(background) if background else (0, 0, 0)
-        for line in text.split('\n'):
-            for char in line:
-                formatted_text += format_rgb(char, rf, gf, bf, rb, gb, bb)
-            formatted_text += '\n'
+        sgr = rgb_sgr(rf, gf, bf, rb, gb, bb, attrs)
     # Color lookup mode
     elif mode == 'color_lookup':
-        for line in text.split('\n'):
-            for char in line:
-                if isinstance(foreground, list):
-                    foreground = foreground[0]
-                if isinstance(background, list):
-                    background = background[0]
-                formatted_text += format_by_lookup(char, foreground, background)
-            formatted_text += '\n'
+        if isinstance(foreground, list):
+            foreground = foreground[0]
+        if isinstance(background, list):
+            background = background[0]
+        sgr = lookup_sgr(foreground, background, attrs)
+    else:
+        return ''
+    return ''.join([wrap_line(sgr, line) + '\n' for line in text.split('\n')])
 
-    return formatted_text
+def color_cells(
+        mode: str,
+        text: str,
+        foreground: tuple or int = None,
+        background: tuple or int = None,
+        attrs: int = 0):
+    """ Input:
+            mode, text, foreground, background, attrs: the same as for
+                color_text()
+        Output:
+            rows: list of lists of cells - the text, with the same colors
+                color_text() would give it, as cells (see
+                utilities/sgr_tokenizer.py) rather than escape sequences
+    """
+    if mode == 'rgb':
+        # Like format_rgb(), the foreground is always set, but a black
+        # background is left as the default
+        fg = rgb_color(*(tuple(foreground) if foreground else (0, 0, 0)))
+        bg = rgb_color(*background) if background and any(background) \
+            else DEFAULT_COLOR
+    elif mode == 'color_lookup':
+        if isinstance(foreground, list):
+            foreground = foreground[0]
+        if isinstance(background, list):
+            background = background[0]
+        fg = palette_color(foreground) if foreground else DEFAULT_COLOR
+        bg = palette_color(background) if background else DEFAULT_COLOR
+    else:
+        return []
+    return [[(code_point, fg, bg, attrs) for code_point in code_points(line)]
+            for line in text.split('\n')]
+
+def apply_gradient_cells(
+        text: str,
+        foreground: LinearColorTracker,
+        background: LinearColorTracker,
+        attrs: int = 0
+        ):
+    """ Input:
+            text, foreground, background, attrs: the same as for
+                apply_gradient()
+        Output:
+            rows: list of lists of cells - the text, with the gradient
+                applied, as cells rather than escape sequences
+    """
+    if HAVE_NUMPY:
+        lines = [list(code_points(line)) for line in text.split('\n')]
+        fg_ids, bg_ids = gradient_color_ids(
+            foreground, background, max(map(len, lines)), len(lines))
+        # zip() stops at the end of each line
+        return [list(zip(line, fg_row, bg_row, repeat(attrs)))
+                for line, fg_row, bg_row
+                in zip(lines, fg_ids.tolist(), bg_ids.tolist())]
+    rows = []
+    for line in text.split('\n'):
+        row = []
+        for code_point in code_points(line):
+            fg = foreground.__next__()
+            bg = background.__next__()
+            row.append((
+                code_point,
+                rgb_color(*fg),
+                rgb_color(*bg) if any(bg) else DEFAULT_COLOR,
+                attrs,
+            ))
+        foreground.newline()
+        background.newline()
+        rows.append(row)
+    return rows
 
 def apply_gradient(
         text: str,
         foreground: LinearColorTracker,
-        background: LinearColorTracker
+        background: LinearColorTracker,
+        attrs: int = 0
         ):
     """ Input:
             text: str - the text we want to apply formatting to.
@@ -158,23 +355,165 @@ def apply_gradient(
                 magnitude within valid range.
             backgorund: LinearColorTracker - the color tracker that's handling
                 the background.
+            attrs: int - the style (bold, underline, etc.) as attribute bits
         Output:
             formatted_text: str - the text specified by 'text', formatted with
                 the foreground and/or background that move through the color
                 gradient provided by the user
     """
-    formatted_text = ''
+    if HAVE_NUMPY:
+        return apply_gradient_field(text, foreground, background, attrs)
+    out = []
+    append = out.append
     for line in text.split('\n'):
-        for char in line:
-            formatted_text += format_rgb(
-                char,
-                *foreground.__next__(),
-                *background.__next__(),
-                )
+        # The gradient moves one step per column, so a wide character's second
+        # column still takes a step (to keep it lined up with the other rows)
+        for code_point in code_points(line):
+            fg = foreground.__next__()
+            bg = background.__next__()
+            if code_point == CONTINUATION:
+                continue
+            append(rgb_sgr(*fg, *bg, attrs))
+            append(chr(code_point))
+            append(RESET)
         foreground.newline()
         background.newline()
-        formatted_text += '\n'
-    return formatted_text
+        append('\n')
+    return ''.join(out)
+
+def gradient_color_ids(
+        foreground: LinearColorTracker,
+        background: LinearColorTracker,
+        width: int,
+        height: int):
+    """ Input:
+            foreground, background: LinearColorTracker - the gradients
+            width, height: ints - the size of the text box (in columns and rows)
+        Output:
+            (fg_ids, bg_ids): 2D arrays of color ids (height x width) - the
+                colors stepping the trackers through the text box would give.
+                Black backgrounds are left as the default color, like
+                format_rgb() does. Needs NumPy (see utilities/gradient_field.py).
+
+    The trackers are moved on past the text box afterwards, the same as if
+    we'd stepped through it, so the next block carries on where this one left
+    off.
+    """
+    fg_ids = color_ids(*tracker_field(foreground, width, height))
+    bg_ids = color_ids(*tracker_field(background, width, height),
+                       background=True)
+    foreground.skip_rows(height)
+    background.skip_rows(height)
+    return fg_ids, bg_ids
+
+def apply_gradient_field(
+        text: str,
+        foreground: LinearColorTracker,
+        background: LinearColorTracker,
+        attrs: int = 0
+        ):
+    """ Does the same thing as apply_gradient(), with the colors worked out
+    all at once by NumPy (see utilities/gradient_field.py).
+    A gradient only has so many different colors in it, so each escape
+    sequence is only built once, and the text is put together from those with
+    join() rather than one format_rgb() call per character.
+    """
+    lines = text.split('\n')
+    columns = [list(code_points(line)) for line in lines]
+    fg_ids, bg_ids = gradient_color_ids(
+        foreground, background, max(map(len, columns)), len(lines))
+    styles, index = style_index(fg_ids, bg_ids)
+    sequences = [
+        rgb_sgr((fg >> 16) & 255, (fg >> 8) & 255, fg & 255,
+                (bg >> 16) & 255, (bg >> 8) & 255, bg & 255, attrs)
+        for fg, bg in styles]
+    return join_indexed_rows(lines, columns, index, sequences)
+
+def join_indexed_rows(lines: list, columns: list, index, sequences: list):
+    """ Input:
+            lines: list of str - the lines of text
+            columns: list of lists of ints - the code points of each line's
+                cells (see code_points())
+            index: iterable of lists of ints - for each cell, which escape
+                sequence it gets
+            sequences: list of str - the escape sequences
+        Output:
+            the text, with each character wrapped in its escape sequence and a
+            reset, and a newline after each line (like apply_gradient())
+    """
+    out = []
+    for line, line_columns, index_row in zip(lines, columns, index):
+        prefixes = map(sequences.__getitem__, index_row)
+        if line.isascii():
+            chars = line
+        else:
+            # A wide character's continuation cell takes a step of the
+            # gradient, but isn't written out
+            written = [code_point != CONTINUATION
+                       for code_point in line_columns]
+            prefixes = compress(prefixes, written)
+            chars = map(chr, compress(line_columns, written))
+        out.extend(chain.from_iterable(zip(prefixes, chars, repeat(RESET))))
+        out.append('\n')
+    return ''.join(out)
+
+def table_gradient(
+        text: str,
+        kind: str,
+        colors: list,
+        direction: str = 'horizontal',
+        width: int = None,
+        height: int = None,
+        period: int = None,
+        offset: float = 0,
+        center: tuple = None,
+        background: tuple = None,
+        attrs: int = 0,
+        spans: bool = False
+        ):
+    """ Input:
+            text: str - the text we want to apply formatting to.
+            kind: str - 'stops' for a blend between any number of colors, or
+                'sine' for a sine wave between two colors
+            colors: list of tuples of 3 ints - the colors (see
+                utilities/gradient_tables.py)
+            direction: str - which way the gradient goes: 'horizontal',
+                'vertical', 'diagonal', 'reverse-diagonal', or 'radial'
+            width, height: ints - the size of the box the gradient is spread
+                over. Defaults to the size of the text box.
+            period, offset: the period (in columns or rows) and offset of a
+                sine gradient
+            center: tuple of 2 numbers - the (column, row) of the center of a
+                radial gradient. Defaults to the middle of the box.
+            background: tuple of 3 ints - the background color (the same for
+                every character)
+            attrs: int - the style (bold, underline, etc.) as attribute bits
+            spans: bool - if True, the text is returned in the span format
+                (see utilities/spans.py) rather than as ANSI formatted text
+        Output:
+            returns the text with the gradient applied to the foreground
+
+    The gradient is worked out once as a table of colors, and a grid saying
+    which entry of the table each cell gets (both are cached), so each
+    character just looks its color up.
+    """
+    lines = text.split('\n')
+    columns = [list(code_points(line)) for line in lines]
+    width = max(width or 0, max(map(len, columns)))
+    height = max(height or 0, len(lines))
+    table, grid = gradient_map(
+        kind, direction, tuple(tuple(color) for color in colors), width,
+        height, period, offset, tuple(center) if center else None)
+    background = tuple(background) if background else (0, 0, 0)
+    if spans:
+        fg_ids = [rgb_color(*color) for color in table]
+        bg = rgb_color(*background) if any(background) else DEFAULT_COLOR
+        return encode_spans([
+            list(zip(line_columns, map(fg_ids.__getitem__, grid_row),
+                     repeat(bg), repeat(attrs)))
+            for line_columns, grid_row in zip(columns, grid)])
+    sequences = [rgb_sgr(*color, *background, attrs) for color in table]
+    return join_indexed_rows(lines, columns, grid, sequences)
 
 def gradient(
         text,
@@ -188,7 +527,9 @@ def gradient(
         foreground_max_val: tuple = None,
         background_min_val: tuple = None,
         background_max_val: tuple = None,
-        bounce: bool = False
+        bounce: bool = False,
+        attrs: int = 0,
+        spans: bool = False
         ):
     """ Input:
             text: str - the text we want to apply formatting to.
@@ -225,11 +566,60 @@ def gradient(
                 the color component will "bounce off the wall", and the
                 magnitude of the color component will begin to move in the
                 opposite direction
+            attrs: int - the style (bold, underline, etc.) as attribute bits
+            spans: bool - if True, the text is returned in the span format
+                (see utilities/spans.py) rather than as ANSI formatted text
         Output:
             returns the text with the gradient specified applied to the
             foreground and/or the background, in the horizontal and/or vertical
             direction.
     """
+    foreground_gradient, background_gradient = gradient_trackers(
+        foreground,
+        background,
+        h_foreground_increment,
+        v_foreground_increment,
+        h_background_increment,
+        v_background_increment,
+        foreground_min_val,
+        foreground_max_val,
+        background_min_val,
+        background_max_val,
+        bounce
+    )
+    if spans:
+        return encode_spans(apply_gradient_cells(
+            text,
+            foreground_gradient,
+            background_gradient,
+            attrs
+        ))
+    formatted_text = apply_gradient(
+        text,
+        foreground_gradient,
+        background_gradient,
+        attrs
+    )
+    return formatted_text
+
+def gradient_trackers(
+        foreground: tuple = None,
+        background: tuple = None,
+        h_foreground_increment: tuple = None,
+        v_foreground_increment: tuple = None,
+        h_background_increment: tuple = None,
+        v_background_increment: tuple = None,
+        foreground_min_val: tuple = None,
+        foreground_max_val: tuple = None,
+        background_min_val: tuple = None,
+        background_max_val: tuple = None,
+        bounce: bool = False):
+    """ Input:
+            the same as for gradient()
+        Output:
+            (foreground_gradient, background_gradient): the LinearColorTrackers
+                for the foreground and the background
+    """
     foreground_gradient = LinearColorTracker(
         foreground,
         h_foreground_increment,
@@ -246,75 +636,189 @@ def gradient(
         background_max_val,
         bounce
     )
-    formatted_text = apply_gradient(
-        text,
-        foreground_gradient,
-        background_gradient
-    )
-    return formatted_text
+    return foreground_gradient, background_gradient
+
+def iter_lines(stream):
+    """ Input:
+            stream: a file object (like sys.stdin), or any iterable of lines
+        Output:
+            yields the lines of text, without their newlines, as they're read.
+            These are the same lines text.split('\\n') would give for the whole
+            stream (so a stream that ends with a newline ends with an empty
+            line).
+    """
+    ends_with_newline = True
+    for line in stream:
+        ends_with_newline = line.endswith('\n')
+        yield line[:-1] if ends_with_newline else line
+    if ends_with_newline:
+        yield ''
+
+def iter_line_blocks(stream, chunk_size: int = 65536):
+    """ Input:
+            stream: a file object (like sys.stdin)
+            chunk_size: int - the most bytes to read at once
+        Output:
+            yields lists of lines (the same lines as iter_lines()), as many at
+            a time as have come in so far.
+
+    A pipe hands over whatever's been written to it, up to chunk_size bytes,
+    so when the text comes in slowly (a ticker, say) every line is passed on
+    as soon as it arrives, and when it comes in all at once (a big file) the
+    lines come out in big blocks, which are a lot quicker to format than one
+    line at a time. Either way, only one chunk (plus the line it ends in the
+    middle of) is held in memory.
+    """
+    try:
+        fd = stream.fileno()
+    except (AttributeError, OSError):
+        # Not a real file (a StringIO, say), so just go line by line
+        for line in iter_lines(stream):
+            yield [line]
+        return
+    # Decode the same way stream.read() would. A character can be split
+    # between two chunks, so the decoder holds on to the first half of it.
+    decoder = codecs.getincrementaldecoder(stream.encoding)(stream.errors)
+    partial = ''
+    while True:
+        chunk = os.read(fd, chunk_size)
+        lines = (partial + decoder.decode(chunk, final=not chunk)).split('\n')
+        if not chunk:
+            # Whatever's left is the last line ('' if the text ended with a
+            # newline)
+            yield lines
+            return
+        # The last line isn't finished yet
+        partial = lines.pop()
+        if lines:
+            yield lines
+
+def stream_formatted(blocks, format_block, spans: bool = False):
+    """ Input:
+            blocks: iterable of lists of str - the lines of text, a few at a
+                time (see iter_line_blocks())
+            format_block: function - formats some lines of text (joined with
+                newlines). Returns them as ANSI formatted text (with a newline
+                at the end), or, if 'spans' is True, as a list of rows of cells
+                (like color_cells()).
+            spans: bool - if True, the output is in the span format (see
+                utilities/spans.py)
+        Output:
+            yields the formatted text a block at a time, as the blocks come
+            in. Joined together, it's the same thing formatting all the lines
+            at once would give, but only one block is ever held in memory.
+
+    Anything that keeps track of where it is (like a gradient) just needs to
+    carry on from one call of format_block() to the next.
+    """
+    if not spans:
+        for lines in blocks:
+            yield format_block('\n'.join(lines))
+        return
+    span_lines = iter_span_lines(
+        cells_to_spans(cells)
+        for lines in blocks for cells in format_block('\n'.join(lines)))
+    # The header comes first, and every row after it goes on its own line
+    yield next(span_lines)
+    for span_line in span_lines:
+        yield '\n' + span_line
+
+def simple_gradient_increments(
+        color_1: tuple,
+        color_2: tuple,
+        width: int,
+        height: int,
+        horiz_only: bool = False,
+        vert_only: bool = False):
+    """ Input:
+            color_1, color_2: tuples of 3 ints - the colors in the upper left
+                and lower right corners of the text box
+            width, height: ints - the size of the text box
+            horiz_only, vert_only: bools - if one of them is set, the gradient
+                only goes across (or down) the text box
+        Output:
+            (h_fg_inc, v_fg_inc): the horizontal and vertical increments that
+                get from color_1 to color_2 (see gradient())
+    """
+    c1, c2 = color_1, color_2
+    if horiz_only:
+        h_fg_inc = tuple([((j-i)/(width-1)) for i, j in zip(c1, c2)])
+        v_fg_inc = (0, 0, 0)
+    elif vert_only:
+        h_fg_inc = (0, 0, 0)
+        v_fg_inc = tuple([((j-i)/(height-1)) for i, j in zip(c1, c2)])
+    else:
+        h_fg_inc = tuple([.5*((j-i)/(width-1)) for i, j in zip(c1, c2)])
+        v_fg_inc = tuple([.5*((j-i)/(height-1)) for i, j in zip(c1, c2)])
+    return h_fg_inc, v_fg_inc
+
+def block_formatter(args, attrs: int = 0):
+    """ Input:
+            args: the parsed command line arguments
+            attrs: int - the style, as attribute bits
+        Output:
+            a function that formats one block of lines at a time, for
+            --stream (see stream_formatted()), or None if this kind of
+            formatting needs the size of the whole text box - which we can't
+            know until we've read all of it.
+    """
+    if not args.grad:
+        mode = 'color_lookup' if args.color_lookup else 'rgb'
+        format_block = color_cells if args.spans else color_text
+        return lambda text: format_block(
+            mode, text, args.foreground, args.background, attrs)
+    if args.grad in ['gradient', 'grad', 'g']:
+        foreground, background = gradient_trackers(
+            args.foreground,
+            args.background,
+            args.h_foreground_increment,
+            args.v_foreground_increment,
+            args.h_background_increment,
+            args.v_background_increment,
+            args.fg_min_values,
+            args.fg_max_values,
+            args.bg_min_values,
+            args.bg_max_values,
+            args.bounce
+        )
+    elif args.grad in ['simple-gradient', 'simple_gradient', 'sg', 's'] \
+            and args.width and args.height and not args.reverse_diagonal:
+        c1 = color_dict[args.color_1]
+        h_fg_inc, v_fg_inc = simple_gradient_increments(
+            c1, color_dict[args.color_2], args.width, args.height,
+            args.horiz_only, args.vert_only)
+        foreground, background = gradient_trackers(
+            c1, h_foreground_increment=h_fg_inc,
+            v_foreground_increment=v_fg_inc, bounce=args.bounce)
+    else:
+        return None
+    # The trackers carry on from one block to the next
+    apply = apply_gradient_cells if args.spans else apply_gradient
+    return lambda text: apply(text, foreground, background, attrs)
 
 def get_textbox_size(text):
     """returns the dimensions of the textbox"""
     l = text.split('\n')
-    return  max([len(i) for i in l]), len(l)
-##
-# I may come back to this at some point, but I don't think the returns are
-# worth the additional complexity
-##
-# def cycle_gradient(step, period, min_value, max_value, offset):
-#     """ Input:
-#             step: int - the current step of the row or column (depending on
-#                 whether this is being used for a vertical or horizontal
-#                 gradient)
-#             period: int - the number of steps before we finish one complete
-#                 cycle of the sine wave.
-#             min_value: int - the minimum value allowed for 'out'
-#             max_value: int - the maximum value allowed for 'out'
-#             offset: int or float - the amount, in units of pi/2, by which the
-#                 sine wave we're generating should be shifted to the left. Some
-#                 sample values:
-#                     offset = 0:
-#                         - step=0:           out=max_value       out heading down
-#                         - step=(period/2):  out=min_value       out heading up
-#                         - step=(period):    out=max_value       out heading down
-#                     offset = 1:
-#                         - step=0:           out=max_value/2     out heading down
-#                         - step=(period/2):  out=max_value/2     out heading up
-#                     offset = 2:
-#                         - step=0:           out=min_value       out heading up
-#                         - step=(period/2):  out=max_value       out heading down
-#                     offset = 3:
-#                         - step=0:           out=max_value/2     out heading up
-#                         - step=(period/2):  out=max_value/2     out heading down
-#         Output:
-#             out: int - the value of a sine wave with a period of 'period' steps,
-#                 whose values fall between 'max_value' and 'min_value', for
-#                 step = 'step'
-#     """
-#     period_term = (math.pi*2*(1/period))
-#     h_offset = (math.pi/2)*(offset+1)
-#     amplitude = ((max_value - min_value)/2)
-#     v_offset = ((max_value + min_value)/2)
-
-#     out = int((math.sin((period_term * step) + h_offset))*amplitude + v_offset)
-#     return out
+    return  max([text_width(i) for i in l]), len(l)
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     # In the future I might make it possible to specify rgb_mode for background
     # and color_lookup mode for foreground (or vice versus), but for now it's
     # one or the other
-    # TODO: add styling options (bold, italics, etc.)
-    # parser.add_argument(
-    #     '-s',
-    #     '--style',
-    #     action='append',
-    #     dest='style_list',
-    #     type='int',
-    #     help='''
-    #     What style should be applied
-    #     '''
-    # )
+    parser.add_argument(
+        '-s',
+        '--style',
+        action='append',
+        dest='style_list',
+        choices=list(STYLE_NAMES),
+        default=[],
+        help='''
+        A style to apply to the text: bold, dim, italic, underline, blink,
+        reverse, hidden, or strike. Can be given more than once,
+        i.e. --style bold --style underline
+        '''
+    )
     parser.add_argument(
         '-c',
         '--color-lookup',
@@ -349,6 +853,30 @@ if __name__ == "__main__":
         dest='background',
         nargs=3,
         type=int)
+    parser.add_argument(
+        '-u',
+        '--stream',
+        action='store_true',
+        help='''
+        Color the text as it comes in, writing each line out as soon as it's
+        been read, rather than reading all of it first. The output is the same
+        either way, but this uses the same (small) amount of memory no matter
+        how much text there is. The gradients that need the size of the whole
+        text box (simple-gradient without --width and --height, and the
+        gradients worked out as color tables) still read all of it first.
+        '''
+    )
+    parser.add_argument(
+        '-S',
+        '--spans',
+        action='store_true',
+        help='''
+        Write the colored text in the span format (see utilities/spans.py)
+        instead of wrapping each character in ANSI escape sequences.
+        update_mirror.py, mirror_client.py, and the compositor all accept it,
+        and it's a lot quicker for them to read.
+        '''
+    )
     subparsers = parser.add_subparsers(dest='grad')
 
     ##################
@@ -517,18 +1045,17 @@ if __name__ == "__main__":
         the bottom edge. 
         '''
     )
-    # TODO: 
-    # preset.add_argument(
-    #     '-rd',
-    #     '--reverse-diagonal',
-    #     dest='reverse_diagonal',
-    #     action='store_true',
-    #     help='''
-    #     Instead of applying a gradient from the top left to the bottom right of
-    #     the text box, the gradient will be applied from the top right to the
-    #     bottom left
-    #     '''
-    # )
+    preset.add_argument(
+        '-rd',
+        '--reverse-diagonal',
+        dest='reverse_diagonal',
+        action='store_true',
+        help='''
+        Instead of applying a gradient from the top left to the bottom right of
+        the text box, the gradient will be applied from the top right to the
+        bottom left
+        '''
+    )
     preset.add_argument(
         '-w',
         '--width',
@@ -584,61 +1111,236 @@ if __name__ == "__main__":
         the color component will begin to move in the opposite direction.
         '''
     )
+
+    ########################
+    # Gradients worked out ahead of time as color tables
+    # (see utilities/gradient_tables.py)
+    multi = subparsers.add_parser(
+        'multi-gradient',
+        aliases=['mg', 'm'],
+        help='''
+        Blends between any number of colors, spread out evenly over the text
+        box, in any direction.
+        '''
+    )
+    multi.add_argument(
+        '-c',
+        '--colors',
+        dest='colors',
+        nargs='+',
+        choices=list(color_dict.keys()),
+        metavar='COLOR',
+        help='''
+        The colors to blend between, in order. The text starts at the first
+        one and ends at the last one (for a radial gradient, the first one is
+        in the center).
+        ''',
+        default=['limegreen', 'mediumblue']
+    )
+    sine = subparsers.add_parser(
+        'sine-gradient',
+        aliases=['sine'],
+        help='''
+        Cycles back and forth between two colors, following a sine wave.
+        '''
+    )
+    sine.add_argument(
+        '-c1',
+        '--color-1',
+        dest='color_1',
+        type=str,
+        choices=list(color_dict.keys()),
+        help='''
+        The first color, which the wave starts at (unless it's offset).
+        ''',
+        default='limegreen'
+    )
+    sine.add_argument(
+        '-c2',
+        '--color-2',
+        dest='color_2',
+        type=str,
+        choices=list(color_dict.keys()),
+        help='''
+        The second color, which the wave reaches halfway through each period.
+        ''',
+        default='mediumblue'
+    )
+    sine.add_argument(
+        '-p',
+        '--period',
+        dest='period',
+        type=int,
+        help='''
+        The number of columns (or rows, or steps out from the center) it takes
+        for the wave to come back to where it started.
+        ''',
+        default=20
+    )
+    sine.add_argument(
+        '-o',
+        '--offset',
+        dest='offset',
+        type=float,
+        help='''
+        Shifts the wave to the left, in quarters of a period. 1 starts halfway
+        between the two colors heading towards color-2, 2 starts at color-2,
+        and so on.
+        ''',
+        default=0
+    )
+    for table_parser in (multi, sine):
+        table_parser.add_argument(
+            '-d',
+            '--direction',
+            dest='direction',
+            choices=DIRECTIONS,
+            help='''
+            Which way the gradient goes. 'diagonal' goes from the top left to
+            the bottom right, 'reverse-diagonal' from the top right to the
+            bottom left, and 'radial' goes out in circles from --center.
+            ''',
+            default='horizontal'
+        )
+        table_parser.add_argument(
+            '--center',
+            dest='center',
+            nargs=2,
+            type=float,
+            metavar=('COLUMN', 'ROW'),
+            help='''
+            The center of a radial gradient. Defaults to the middle of the
+            text box.
+            '''
+        )
+        table_parser.add_argument(
+            '-w',
+            '--width',
+            dest='width',
+            type=int,
+            help='''
+            The width of the box the gradient is spread over. Defaults to the
+            width of the text box.
+            '''
+        )
+        table_parser.add_argument(
+            '-hg',
+            '--height',
+            dest='height',
+            type=int,
+            help='''
+            The height of the box the gradient is spread over. Defaults to the
+            height of the text box.
+            '''
+        )
     args = parser.parse_args()
     # print('\n', '-'*20, '\n', args)
+    attrs = parse_styles(args.style_list)
    
-    intext = sys.stdin.read()
-    if args.grad:
-        if args.grad in ['gradient', 'grad', 'g']:
-            ftext = gradient(
-                intext,
-                args.foreground,
-                args.background,
-                args.h_foreground_increment,
-                args.v_foreground_increment,
-                args.h_background_increment,
-                args.v_background_increment,
-                args.fg_min_values,
-                args.fg_max_values,
-                args.bg_min_values,
-                args.bg_max_values,
-                args.bounce
-            )
-        elif args.grad in ['simple_gradient', 'sg', 's']:
-            c1 = color_dict[args.color_1]
-            c2 = color_dict[args.color_2]
-            text_dims = get_textbox_size(intext)
-            if not args.width:
-                width = text_dims[0]
-            else:
-                width = args.width
-            if not args.height:
-                height = text_dims[1]
-            else:
-                height = args.height
-
-            if args.horiz_only:
-                h_fg_inc = tuple([((j-i)/(width-1)) for i, j in zip(c1, c2)])
-                v_fg_inc = (0, 0, 0)
-            elif args.vert_only:
-                h_fg_inc = (0, 0, 0)
-                v_fg_inc = tuple([((j-i)/(height-1)) for i, j in zip(c1, c2)])
-            else:
-                h_fg_inc = tuple([.5*((j-i)/(width-1)) for i, j in zip(c1, c2)])
-                v_fg_inc = tuple([.5*((j-i)/(height-1)) for i, j in zip(c1, c2)])
+    format_block = block_formatter(args, attrs) if args.stream else None
+    if format_block:
+        # Each block of lines goes downstream as soon as it's colored
+        with stage('color_text.stream') as timer:
+            bytes_out = 0
+            for piece in stream_formatted(
+                    iter_line_blocks(sys.stdin), format_block, args.spans):
+                sys.stdout.write(piece)
+                sys.stdout.flush()
+                bytes_out += len(piece)
+            timer.count(bytes_out=bytes_out)
+    else:
+        with stage('color_text.read') as timer:
+            intext = sys.stdin.read()
+            timer.count(bytes_in=len(intext))
+        with stage('color_text.format', chars=len(intext)):
+            if args.grad:
+                if args.grad in ['gradient', 'grad', 'g']:
+                    ftext = gradient(
+                        intext,
+                        args.foreground,
+                        args.background,
+                        args.h_foreground_increment,
+                        args.v_foreground_increment,
+                        args.h_background_increment,
+                        args.v_background_increment,
+                        args.fg_min_values,
+                        args.fg_max_values,
+                        args.bg_min_values,
+                        args.bg_max_values,
+                        args.bounce,
+                        attrs=attrs,
+                        spans=args.spans
+                    )
+                elif args.grad in ['simple-gradient', 'simple_gradient', 'sg', 's']:
+                    c1 = color_dict[args.color_1]
+                    c2 = color_dict[args.color_2]
+                    text_dims = get_textbox_size(intext)
+                    if not args.width:
+                        width = text_dims[0]
+                    else:
+                        width = args.width
+                    if not args.height:
+                        height = text_dims[1]
+                    else:
+                        height = args.height
 
-            ftext = gradient(
-                text=intext,
-                foreground=c1,
-                h_foreground_increment=h_fg_inc,
-                v_foreground_increment=v_fg_inc,
-                bounce=args.bounce
-            )
+                    if args.reverse_diagonal:
+                        # A linear tracker always starts at the left, so this one
+                        # is done with a color table instead
+                        ftext = table_gradient(
+                            intext, 'stops', [c1, c2], 'reverse-diagonal',
+                            width, height, attrs=attrs, spans=args.spans)
+                    else:
+                        h_fg_inc, v_fg_inc = simple_gradient_increments(
+                            c1, c2, width, height, args.horiz_only,
+                            args.vert_only)
+                        ftext = gradient(
+                            text=intext,
+                            foreground=c1,
+                            h_foreground_increment=h_fg_inc,
+                            v_foreground_increment=v_fg_inc,
+                            bounce=args.bounce,
+                            attrs=attrs,
+                            spans=args.spans
+                        )
+                elif args.grad in ['multi-gradient', 'mg', 'm']:
+                    ftext = table_gradient(
+                        intext,
+                        'stops',
+                        [color_dict[color] for color in args.colors],
+                        args.direction,
+                        args.width,
+                        args.height,
+                        center=args.center,
+                        background=args.background,
+                        attrs=attrs,
+                        spans=args.spans
+                    )
+                elif args.grad in ['sine-gradient', 'sine']:
+                    if args.period < 1:
+                        parser.error('--period must be at least 1')
+                    ftext = table_gradient(
+                        intext,
+                        'sine',
+                        [color_dict[args.color_1], color_dict[args.color_2]],
+                        args.direction,
+                        args.width,
+                        args.height,
+                        args.period,
+                        args.offset,
+                        args.center,
+                        background=args.background,
+                        attrs=attrs,
+                        spans=args.spans
+                    )
 
 
-    elif not args.color_lookup:
-        ftext = color_text('rgb', intext, args.foreground, args.background)
-    else:
-        ftext = color_text('color_lookup', intext,
-                            args.foreground, args.background)
-    sys.stdout.write(ftext)
+            elif not args.color_lookup:
+                ftext = color_text('rgb', intext, args.foreground, args.background,
+                                   attrs=attrs, spans=args.spans)
+            else:
+                ftext = color_text('color_lookup', intext,
+                                    args.foreground, args.background,
+                                    attrs=attrs, spans=args.spans)
+        with stage('color_text.write', bytes_out=len(ftext)):
+            sys.stdout.write(ftext)
@@ -0,0 +1,561 @@
+# !/bin/python
+# A long-running process that keeps the state of the screen in memory and
+# accepts text blocks over a Unix socket.
+#
+# Without it, every cron job pipes its output to update_mirror.py, which means
+# starting up a fresh Python interpreter, opening the cell grid, and rendering
+# term.txt for every region, every time. On a Pi Zero the interpreter start up
+# alone takes several hundred milliseconds.
+# With the compositor running, the cron jobs pipe their output to
+# mirror_client.py instead, which just writes the text block to the socket.
+#
+# Updates are handled one at a time, in the order they arrive, so two cron
+# jobs that fire at the same moment can't step on each other's toes.
+#
+# Updates that would write exactly the same text block to a region as last
+# time are skipped (see utilities/region_hashes.py), so term.txt isn't touched
+# and the renderer isn't woken up. Send a "stats" header line to see how many
+# updates were skipped (or use 'python mirror_stats.py regions').
+#
+# Each config section gets its own layer, and layers can overlap - the ones
+# with a higher z-index are drawn on top, and they can have transparent cells
+# that let the layers underneath show through (see utilities/layers.py).
+#
+# Config sections can also write their text blocks to files of their own in
+# term.txt.shards instead of using the socket (see utilities/shards.py). The
+# compositor watches that directory, and merges a shard into the screen as
+# soon as it changes. Shards that haven't changed aren't read again.
+#
+# When the terminal is resized, the renderer asks the compositor to resize the
+# screen. Since the compositor still has the last text block of every layer,
+# it can put them all back in place on the new screen straight away, without
+# re-running any of the cron jobs.
+#
+# The last text block of every layer is saved to term.txt.state (see
+# utilities/screen_state.py). Started with --restore (which is how
+# start_mirror.sh starts it), the compositor puts those layers back on the
+# screen, dimmed to show they're out of date, until the cron jobs refresh them.
+#
+# example:
+#     python compositor.py &
+#     echo 'some text\nnice text' | python mirror_client.py 1 2 9 2
+import os
+import sys
+import json
+import select
+import signal
+import argparse
+import socketserver
+from mirror_client import get_socket_path
+from urllib.parse import unquote
+from update_mirror import (
+    get_term_file_path,
+    publish_grid_row_set,
+    read_batch,
+    render_term_file,
+)
+from utilities.atomic_file import publish_lock
+from utilities.cell_grid import CellGrid, get_grid_path
+from utilities.inotify import (
+    IN_CLOSE_WRITE,
+    IN_DELETE,
+    IN_MOVED_FROM,
+    IN_MOVED_TO,
+    Inotify,
+    inotify_available,
+)
+from utilities.layers import LayerStack
+from utilities.region_hashes import RegionHashes
+from utilities.screen_state import (
+    get_state_path,
+    load_state,
+    mark_stale,
+    save_state,
+)
+from utilities.shards import ShardSet, get_shard_dir
+from utilities.sgr_tokenizer import BLANK_CELL, DIM
+from utilities.spans import tokenize_block
+from utilities.timing import stage
+
+# If we can't use inotify to find out when a shard changes, we check the
+# shard directory this often (in seconds)
+SHARD_POLL_INTERVAL = 1
+
+
+class Compositor:
+    """ Holds the cell grid open, and applies text blocks to it.
+
+    Each text block belongs to a layer (see utilities/layers.py) - usually
+    the config section it came from. The layers are stacked up by z-index,
+    and the part of the screen a block covers is re-composited and copied into
+    the grid whenever that block changes.
+    """
+    def __init__(self, term_file_path: str = None, restore: bool = False):
+        """ Input:
+                term_file_path: str - the path of term.txt. The cell grid is
+                    expected to be next to it (make_term_file.py takes care of
+                    that).
+                restore: bool - if True, the layers saved the last time the
+                    compositor ran are put back on the screen (see restore())
+        """
+        self.term_file_path = term_file_path or get_term_file_path()
+        self.grid = CellGrid.open(get_grid_path(self.term_file_path))
+        self.region_hashes = RegionHashes(self.term_file_path)
+        self.shards = ShardSet(get_shard_dir(self.term_file_path))
+        self.state_path = get_state_path(self.term_file_path)
+        # The last text block of each layer, in the order they were updated,
+        # which is what gets saved to the state file
+        self.blocks = {}
+        # Whatever's already on the screen goes at the bottom of the stack
+        with self.grid.lock(0, 0, self.grid.width, self.grid.height,
+                            exclusive=False):
+            self.layers = LayerStack(self.grid.read_rows())
+        if restore:
+            self.restore()
+
+    def update(self, text: str, column: int, row: int, width: int,
+               height: int, layer: str = None, z: int = 0,
+               transparent: str = None):
+        """ Input:
+                text: str - the block of text to insert
+                column: int - the column of the upper left corner of the block
+                row: int - the row of the upper left corner of the block
+                width: int - the width of the text box in columns
+                height: int - the height of the text box in rows
+                layer: str - the name of the layer the block belongs to.
+                    Defaults to a layer of its own, named after the region.
+                z: int - the layer's z-index. Higher is closer to the top.
+                transparent: str - which of the layer's cells are transparent
+                    (see utilities/layers.py)
+            Output:
+                Copies the text block into the grid, and re-renders the rows of
+                term.txt that it covers. Returns False if the update was
+                skipped because that text block is already there.
+        """
+        return self.update_blocks([{
+            'text': text,
+            'column': column,
+            'row': row,
+            'width': width,
+            'height': height,
+            'layer': layer,
+            'z': z,
+            'transparent': transparent,
+        }]) > 0
+
+    def update_blocks(self, blocks):
+        """ Input:
+                blocks: iterable of dicts - text blocks with the keys 'text',
+                    'column', 'row', 'width' and 'height' (see
+                    update_mirror.insert_text_blocks()), and optionally 'layer',
+                    'z', and 'transparent' (see update())
+            Output:
+                Copies all of the text blocks into the grid, then re-renders
+                the rows they cover, rewriting term.txt only once. Blocks that
+                are already on the screen are skipped. Returns the number of
+                blocks that were applied.
+        """
+        changed_rows = set()
+        applied = 0
+        for block in blocks:
+            column, row = block['column'], block['row']
+            width, height = block['width'], block['height']
+            region = (column, row, width, height)
+            layer = block.get('layer') or 'region {} {} {} {}'.format(*region)
+            z = int(block.get('z') or 0)
+            transparent = block.get('transparent')
+            # The same text in a different layer (or with a different z-index)
+            # isn't the same update
+            signature = f'{layer}\0{z}\0{transparent}\0{block["text"]}'
+            if self.region_hashes.unchanged(region, signature):
+                continue
+            with stage('update.tokenize', blocks=1, cells=width*height):
+                cells = tokenize_block(block['text'], width, height)
+            dirty = self.layers.set_layer(layer, region, cells, z, transparent)
+            self._composite(dirty)
+            self.region_hashes.record(region, signature)
+            changed_rows.update(range(dirty[1], dirty[1] + dirty[3]))
+            # Moved to the end, since it's now the most recently updated
+            self.blocks.pop(layer, None)
+            self.blocks[layer] = {
+                'layer': layer, 'column': column, 'row': row, 'width': width,
+                'height': height, 'z': z, 'transparent': transparent,
+                'text': block['text'],
+            }
+            applied += 1
+        self._publish(changed_rows)
+        if applied:
+            self._save_state()
+        return applied
+
+    def remove_layers(self, names) -> int:
+        """ Input:
+                names: iterable of str - the names of the layers to remove
+            Output:
+                Takes the layers off the screen (whatever was underneath them
+                shows through again), and re-renders the rows they covered.
+                Returns the number of layers that were removed.
+        """
+        changed_rows = set()
+        removed = 0
+        for name in names:
+            dirty = self.layers.remove_layer(name)
+            if dirty is None:
+                continue
+            self._composite(dirty)
+            self.region_hashes.forget(dirty)
+            changed_rows.update(range(dirty[1], dirty[1] + dirty[3]))
+            self.blocks.pop(name, None)
+            removed += 1
+        self._publish(changed_rows)
+        if removed:
+            self._save_state()
+        return removed
+
+    def restore(self) -> int:
+        """ Output:
+                Puts back the layers that were saved to the state file the
+                last time the compositor ran, dimmed to show that they're out
+                of date. Each one stays dimmed until its layer is updated.
+                Returns the number of layers restored.
+
+        The layers go on top of whatever's in the grid now, which is normally
+        the dimmed last frame (see make_term_file.py --restore), and each one
+        replaces the part of that frame it covers. But a client that couldn't
+        reach us yet may already have written a fresh text block with
+        update_mirror.py, and we don't want to cover that up with an old one -
+        so a layer isn't restored if its layer has already been updated, or if
+        there's fresh (undimmed) text where it would go.
+
+        The layers aren't recorded in the region hashes, so an update with
+        the same text as before still gets applied (and un-dims the layer).
+        """
+        blocks = load_state(self.state_path)
+        if not blocks:
+            return 0
+        width, height = self.grid.width, self.grid.height
+        restored = {}
+        dirty_rects = []
+        # Nothing else can write to the grid between us looking at it and
+        # putting the layers back
+        with self.grid.lock(0, 0, width, height):
+            if not self.layers.layers:
+                # Pick up anything written since we first read the grid
+                self.layers.base = self.grid.read_rows()
+            for block in blocks:
+                try:
+                    layer = block['layer']
+                    region = (block['column'], block['row'], block['width'],
+                              block['height'])
+                    if layer in self.blocks or self._refreshed(region):
+                        continue
+                    cells = tokenize_block(block['text'], *region[2:])
+                    # The layer takes the place of its part of the old frame,
+                    # rather than going on top of it - otherwise the old
+                    # frame shows through its transparent cells, even after
+                    # the layer has been updated
+                    self.layers.clear_base(region)
+                    dirty = self.layers.set_layer(
+                        layer, region, mark_stale(cells),
+                        int(block['z'] or 0), block['transparent'])
+                except (KeyError, TypeError, ValueError) as e:
+                    sys.stderr.write(f'compositor: could not restore a layer: '
+                                     f'{e!r}\n')
+                    continue
+                restored[layer] = block
+                dirty_rects.append(dirty)
+            for dirty in dirty_rects:
+                self.grid.write_block(dirty[0], dirty[1],
+                                      self.layers.flatten(dirty))
+        # The restored layers are older than any that have been updated
+        self.blocks = {**restored, **self.blocks}
+        self._publish({row for dirty in dirty_rects
+                       for row in range(dirty[1], dirty[1] + dirty[3])})
+        return len(restored)
+
+    def _refreshed(self, region: tuple) -> bool:
+        """ Returns True if any part of the (column, row, width, height)
+        region of the base has fresh text in it - i.e. a cell that isn't
+        dimmed (see restore())
+        """
+        column, row, width, height = self.layers.clip(region)
+        for cells in self.layers.base[row:row + height]:
+            for cell in cells[column:column + width]:
+                if not cell[3] & DIM and cell != BLANK_CELL:
+                    return True
+        return False
+
+    def _save_state(self):
+        """ Saves the last text block of every layer (see
+        utilities/screen_state.py)
+        """
+        with stage('compositor.save_state', layers=len(self.blocks)):
+            save_state(self.state_path, list(self.blocks.values()))
+
+    def merge_shards(self) -> int:
+        """ Output:
+                Applies any shards that were written (or deleted) since the
+                last time we looked (see utilities/shards.py), publishing
+                term.txt once for all of them. Returns the number of shards
+                that changed the screen.
+        """
+        with stage('compositor.scan_shards') as timer:
+            changed, removed = self.shards.scan()
+            timer.count(changed=len(changed), removed=len(removed))
+        blocks = []
+        for layer, data in changed.items():
+            header, _, text = data.decode('utf-8', errors='replace') \
+                .partition('\n')
+            try:
+                column, row, width, height, options = parse_header(header)
+            except ValueError as e:
+                sys.stderr.write(f'compositor: bad shard {layer!r}: {e}\n')
+                continue
+            # The shard's file name is what makes it unique, so that's the
+            # name of its layer
+            options['layer'] = layer
+            blocks.append(dict(options, text=text, column=column, row=row,
+                               width=width, height=height))
+        return self.update_blocks(blocks) + self.remove_layers(removed)
+
+    def resize(self, width: int, height: int) -> bool:
+        """ Input:
+                width: int - the new width of the screen (in columns)
+                height: int - the new height of the screen (in rows)
+            Output:
+                Replaces the cell grid with one of the new size, re-places
+                every layer on it from the last text block it sent, and
+                renders a new term.txt. Nothing has to be re-run. Returns
+                False if the screen was already that size.
+        """
+        if (width, height) == (self.grid.width, self.grid.height):
+            return False
+        if width < 1 or height < 1:
+            raise ValueError(f'Invalid screen size {width}x{height}')
+        with stage('compositor.resize', cells=width*height):
+            self.layers.resize(width, height)
+            frame = self.layers.flatten((0, 0, width, height))
+            with publish_lock(self.term_file_path):
+                self.grid.close()
+                self.grid = CellGrid.replace(
+                    get_grid_path(self.term_file_path), width, height, frame)
+                render_term_file(self.grid, self.term_file_path)
+            # Every region has to be written again, even if its text block
+            # hasn't changed, in case it's been moved back onto the screen
+            self.region_hashes.clear()
+            self.region_hashes.published()
+        return True
+
+    def _composite(self, dirty: tuple):
+        """ Stacks up the layers over the 'dirty' (column, row, width, height)
+        rectangle, and copies the result into the grid
+        """
+        with stage('compositor.composite', cells=dirty[2]*dirty[3]):
+            frame = self.layers.flatten(dirty)
+        # update_mirror.py might be writing to the grid too (if a client
+        # fell back to it while the compositor was starting up, for example)
+        with self.grid.lock(*dirty):
+            self.grid.write_block(dirty[0], dirty[1], frame)
+
+    def _publish(self, changed_rows: set):
+        """ Re-renders the rows of term.txt that changed (if any did)
+        """
+        if changed_rows:
+            publish_grid_row_set(self.grid, self.term_file_path, changed_rows)
+            self.region_hashes.published()
+
+    def stats(self) -> dict:
+        """ Returns counts of the updates that were applied and skipped
+        """
+        return self.region_hashes.stats()
+
+    def close(self):
+        """ Closes the cell grid
+        """
+        self.grid.close()
+
+def parse_header(header: str):
+    """ Input:
+            header: str - the header line of an update: "column row width
+                height", optionally followed by any of "layer=<name>",
+                "z=<z-index>", and "transparent=<setting>". The values are
+                URL-encoded (so a layer name can have spaces in it).
+        Output:
+            (column, row, width, height, options): the region, and a dict
+                containing the options. Raises a ValueError if the header
+                doesn't make sense.
+    """
+    parts = header.split()
+    if len(parts) < 4:
+        raise ValueError('expected a "column row width height" header')
+    column, row, width, height = (int(i) for i in parts[:4])
+    options = {}
+    for part in parts[4:]:
+        key, _, value = part.partition('=')
+        if key not in ('layer', 'z', 'transparent'):
+            raise ValueError(f'unknown option {key!r}')
+        options[key] = unquote(value)
+    if 'z' in options:
+        options['z'] = int(options['z'])
+    return column, row, width, height, options
+
+class UpdateHandler(socketserver.StreamRequestHandler):
+    """ Handles a single connection. The client sends a header line containing
+    "column row width height", followed by the text block, and then closes its
+    end of the connection. We reply with "ok" or "error: <reason>".
+    The header can also say which layer the block belongs to (see
+    parse_header()).
+
+    If the header line is just "batch", the rest of the request is a batch of
+    text blocks, one JSON object per line (the same format update_mirror.py
+    --batch takes), and they're all applied at once.
+
+    If the header line is "resize <width> <height>", the screen is resized
+    (see Compositor.resize()). The renderer sends this when the terminal is
+    resized.
+
+    If the header line is "stats", we reply with a JSON object containing the
+    number of updates that were applied and skipped (see Compositor.stats()).
+    """
+    def handle(self):
+        header = self.rfile.readline().decode('utf-8', errors='replace')
+        text = self.rfile.read().decode('utf-8', errors='replace')
+        compositor = self.server.compositor
+        if header.strip() == 'stats':
+            self.wfile.write(json.dumps(compositor.stats()).encode() + b'\n')
+            return
+        if header.startswith('resize'):
+            try:
+                _, width, height = header.split()
+                width, height = int(width), int(height)
+            except ValueError:
+                self.wfile.write(b'error: expected "resize <width> <height>"\n')
+                return
+            apply = lambda: compositor.resize(width, height)
+        elif header.strip() == 'batch':
+            try:
+                blocks = list(read_batch(text.splitlines()))
+            except ValueError as e:
+                self.wfile.write(f'error: {e}\n'.encode())
+                return
+            apply = lambda: compositor.update_blocks(blocks)
+        else:
+            try:
+                column, row, width, height, options = parse_header(header)
+            except ValueError as e:
+                self.wfile.write(f'error: {e}\n'.encode())
+                return
+            apply = lambda: compositor.update(
+                text, column, row, width, height, **options)
+        try:
+            with stage('compositor.update') as timer:
+                timer.count(applied=int(apply()))
+        except Exception as e:
+            # One bad update shouldn't take down the compositor
+            sys.stderr.write(f'compositor: update failed: {e!r}\n')
+            self.wfile.write(f'error: {e}\n'.encode())
+            return
+        self.wfile.write(b'ok\n')
+
+class CompositorServer(socketserver.UnixStreamServer):
+    """ A Unix socket server that hands updates to a Compositor
+    """
+    def __init__(self, socket_path: str, compositor: Compositor):
+        self.compositor = compositor
+        # A socket file left over from a compositor that didn't shut down
+        # cleanly would stop us from binding
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        super().__init__(socket_path, UpdateHandler)
+
+    def server_close(self):
+        super().server_close()
+        if os.path.exists(self.server_address):
+            os.unlink(self.server_address)
+
+    def service_actions(self):
+        """ Called by serve_forever() every time around its loop, which is
+        where we check for new shards when we can't use inotify
+        """
+        merge_shards(self.compositor)
+
+def merge_shards(compositor: Compositor):
+    """ Merges any shards that changed, without letting a bad one take down
+    the compositor
+    """
+    try:
+        compositor.merge_shards()
+    except Exception as e:
+        sys.stderr.write(f'compositor: merging shards failed: {e!r}\n')
+
+def serve_with_inotify(server: CompositorServer, shard_dir: str):
+    """ Input:
+            server: CompositorServer - the server to run
+            shard_dir: str - the shard directory to watch
+        Output:
+            Handles requests on the socket, and merges the shards as soon as
+            one of them changes, forever. While nothing's happening, we're
+            just waiting on the socket and the inotify file descriptor, so we
+            use no CPU at all.
+    """
+    os.makedirs(shard_dir, exist_ok=True)
+    with Inotify() as notify:
+        notify.add_watch(shard_dir, IN_CLOSE_WRITE | IN_MOVED_TO
+                         | IN_MOVED_FROM | IN_DELETE)
+        # In case a shard changed before the watch was set up
+        merge_shards(server.compositor)
+        while True:
+            ready, _, _ = select.select([server, notify.fd], [], [])
+            if server in ready:
+                server.handle_request()
+            if notify.fd in ready and notify.read_events(0):
+                merge_shards(server.compositor)
+
+def serve(socket_path: str = None, term_file_path: str = None,
+          restore: bool = False):
+    """ Input:
+            socket_path: str - where the compositor should listen. Defaults to
+                the value returned by mirror_client.get_socket_path()
+            term_file_path: str - the path of term.txt
+            restore: bool - whether to put back the layers that were on the
+                screen the last time the compositor ran
+        Output:
+            Runs the compositor until it's interrupted or sent SIGTERM
+    """
+    # SIGTERM (i.e. from 'kill') should clean up the same way Ctrl-C does
+    signal.signal(signal.SIGTERM, lambda *args: sys.exit(0))
+    compositor = Compositor(term_file_path, restore)
+    server = CompositorServer(socket_path or get_socket_path(), compositor)
+    try:
+        if inotify_available():
+            serve_with_inotify(server, compositor.shards.shard_dir)
+        else:
+            server.serve_forever(poll_interval=SHARD_POLL_INTERVAL)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        compositor.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '-s',
+        '--socket',
+        dest='socket_path',
+        help='''
+        The path of the Unix socket the compositor should listen on. Defaults
+        to compositor.sock in the same directory as this script.
+        '''
+    )
+    parser.add_argument(
+        '-r',
+        '--restore',
+        action='store_true',
+        help='''
+        Put back the regions that were on the screen the last time the
+        compositor ran, dimmed until they're refreshed
+        '''
+    )
+    args = parser.parse_args()
+    serve(args.socket_path, restore=args.restore)
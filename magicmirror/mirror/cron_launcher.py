@@ -4,10 +4,14 @@ user crontab file.
 The cron_launcher() function then adds or updates each entry to the user
 crontab file.
 """
+import shlex
 import subprocess
 import configparser
 from update_mirror import get_project_dir
 
+# Config sections that hold settings, rather than cron jobs
+SETTINGS_SECTIONS = ('environment', 'display')
+
 def main():
     config = read_config()
     replace_crontab(config)
@@ -93,7 +97,7 @@ def command_formatter(config):
     command_text += '# !/bin/bash\n'
     for section_name in sections:
         section = dict(config[section_name])
-        if section_name == 'environment':
+        if section_name in SETTINGS_SECTIONS:
             continue
         if section.get('run_at_startup', 'true').lower() != 'true':
             continue
@@ -101,9 +105,11 @@ def command_formatter(config):
         # Any '%' symbols in the command need to be backslash escaped if they're
         # going to be run by cron. We need to undo that in order to run the
         # command here.
-        section['command'] = command.replace('\%', '%')
+        section['command'] = command.replace('\\%', '%')
 
         # command_text should be a command that we can run
+        section['layer_options'] = layer_options(
+            section_name, section, use_shards(config))
         command_text += template.format(**section)
     return command_text
 
@@ -122,7 +128,12 @@ def cron_formatter(config):
         if section_name == 'environment':
             crontab += environment_formatter(section)
             continue
-        crontab += template.format(**dict(section))
+        if section_name in SETTINGS_SECTIONS:
+            continue
+        section = dict(section)
+        section['layer_options'] = layer_options(
+            section_name, section, use_shards(config), as_crontab=True)
+        crontab += template.format(**section)
     return crontab
 
 def assemble_template(as_crontab = True):
@@ -137,18 +148,62 @@ def assemble_template(as_crontab = True):
     """
     # We need to use absolute paths if we want to be sure that cron will do its
     # job reliably, so this is just getting the absolute path to the
-    # update_mirror.py script.
+    # mirror_client.py script.
+    # mirror_client.py hands the text off to the compositor (or falls back to
+    # update_mirror.py if the compositor isn't running). It only needs the
+    # standard library, so we can use 'python -S' to skip importing the site
+    # module, which shaves a bit more off the start up time.
     project_dir = get_project_dir()
     script_path = project_dir.joinpath(
-        'magicmirror', 'mirror', 'update_mirror.py')
+        'magicmirror', 'mirror', 'mirror_client.py')
     template = ''
     if as_crontab:
         template += '{timing} '
     template += '{command} | '
-    template += f'python {script_path} '
+    template += f'python -S {script_path} '
+    template += '{layer_options}'
     template += '{box_column} {box_row} {box_width} {box_height}\n'
     return template
 
+def use_shards(config):
+    """ Returns True if the 'shards' setting in the [display] section of the
+    config file is turned on (see utilities/shards.py)
+    """
+    return config.getboolean('display', 'shards', fallback=False)
+
+def layer_options(section_name, section, shards=False, as_crontab=False):
+    """ Input:
+            section_name: str - the name of the config section
+            section: dict - the config section
+            shards: bool - whether the section should write its text block to
+                a shard rather than sending it to the compositor
+            as_crontab: bool - whether the options are going in the crontab
+                file (rather than command.sh)
+        Output:
+            options: str - the mirror_client.py options that put the section's
+                text block in its own layer (see utilities/layers.py), with its
+                z-index and transparency if they're set
+    """
+    quote = cron_quote if as_crontab else shlex.quote
+    options = '--shard ' if shards else ''
+    options += f'--layer {quote(section_name)} '
+    if section.get('z_index'):
+        options += f'--z {int(section["z_index"])} '
+    if section.get('transparent'):
+        options += f'--transparent {quote(section["transparent"])} '
+    return options
+
+def cron_quote(value):
+    """ Input:
+            value: str - a value to put in a crontab command
+        Output:
+            the value quoted for the shell, with any '%' symbols backslash
+            escaped. cron treats an unescaped '%' as the end of the command
+            (everything after it is sent to the command's stdin instead), and
+            it does that before the shell ever sees the quotes.
+    """
+    return shlex.quote(value).replace('%', '\\%')
+
 def environment_formatter(section):
     """ Input:
             section: configparser.Section - the 'environment' configparser
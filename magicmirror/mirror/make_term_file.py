@@ -1,33 +1,105 @@
 import os
-from update_mirror import get_script_dir
+import argparse
+from update_mirror import get_term_file_path, render_term_file
+from utilities.atomic_file import publish_lock
+from utilities.cell_grid import CellGrid, get_grid_path
+from utilities.color_depth import save_probed_color_depth
+from utilities.screen_state import mark_stale
+from utilities.shards import clear_shards, get_shard_dir
 
-def make_term_file():
+def make_term_file(term_width=None, term_height=None, term_file_path=None,
+                   restore=False):
     """ Input:
-            None
+            term_width: int - the width of the screen in columns. Defaults to
+                the width of the terminal.
+            term_height: int - the height of the screen in rows. Defaults to
+                the height of the terminal.
+            term_file_path: str - where to put term.txt. Defaults to the value
+                returned by get_term_file_path()
+            restore: bool - if True, and there's a cell grid left over from
+                last time, the screen starts out with what was on it then
+                (dimmed, since it's out of date) rather than blank
         Output:
             Creates or overwrites a file with enough whitespace characters to
             completely fill the terminal.
     This does the following:
         - Gets the terminal width and height (in columns and rows)
-        - Opens a file in the same directory as this script named "term.txt"
-        - Fills the file with spaces, such that there are term_height lines,
-          each of which is term_width long.
+        - Creates a blank cell grid (or, with 'restore', one holding the last
+          frame, cropped or padded to fit) (see utilities/cell_grid.py) named
+          "term.grid" in the same directory as this script. This holds the
+          state of the screen.
+        - Renders the grid to a file in the same directory named "term.txt".
+          This fills the file with spaces, such that there are term_height
+          lines, each of which is term_width long.
+        - Works out how many colors the terminal can display, and saves that
+          next to term.txt (see utilities/color_depth.py). This is the only
+          time we can tell, since the cron jobs don't run in the terminal.
+        - Deletes any shards left over from last time (see
+          utilities/shards.py), since they belong to the old screen.
     """
     # Width/height are in columns/lines
-    term_width, term_height = os.get_terminal_size()
-    # This makes a string that should completely cover the terminal if you print
-    # it out.
-    # Equivalent to:
-    #   display_text = ''
-    #   for y in range(term_height):
-    #       for x in range(term_width):
-    #           display_text += ' '
-    #       display_text += '\n'
-    display_text = '\n'.join([' '*term_width for i in range(term_height)])
-    script_dir = get_script_dir()
-    term_file_path = os.path.join(script_dir, 'term.txt')
-    with open(term_file_path, 'w+') as f:
-        f.write(display_text)
+    if term_width is None or term_height is None:
+        term_width, term_height = os.get_terminal_size()
+    term_file_path = term_file_path or get_term_file_path()
+    grid_path = get_grid_path(term_file_path)
+    save_probed_color_depth(term_file_path)
+    clear_shards(get_shard_dir(term_file_path))
+    with publish_lock(term_file_path):
+        rows = read_last_frame(grid_path) if restore else None
+        if rows:
+            grid = CellGrid.replace(grid_path, term_width, term_height,
+                                    mark_stale(rows))
+        else:
+            grid = CellGrid.create(grid_path, term_width, term_height)
+        with grid:
+            render_term_file(grid, term_file_path)
+
+def read_last_frame(grid_path):
+    """ Input:
+            grid_path: str - the path of the cell grid
+        Output:
+            rows: list of lists of cells - what was on the screen the last
+                time the mirror ran, or None if there's no usable grid
+    """
+    try:
+        with CellGrid.open(grid_path, writable=False) as grid:
+            return grid.read_rows()
+    except (FileNotFoundError, ValueError):
+        return None
+
+def resize_term_file(term_width, term_height, term_file_path=None):
+    """ Input:
+            term_width: int - the new width of the screen in columns
+            term_height: int - the new height of the screen in rows
+            term_file_path: str - the path of term.txt. Defaults to the value
+                returned by get_term_file_path()
+        Output:
+            Resizes the cell grid and term.txt, keeping whatever's on the
+            screen (cropped, or padded with blank cells). This is what
+            happens when the terminal is resized and the compositor isn't
+            running - the compositor does a better job, since it knows where
+            each region goes (see Compositor.resize()).
+    """
+    term_file_path = term_file_path or get_term_file_path()
+    grid_path = get_grid_path(term_file_path)
+    with publish_lock(term_file_path):
+        with CellGrid.open(grid_path) as grid:
+            with grid.lock(0, 0, grid.width, grid.height, exclusive=False):
+                rows = grid.read_rows()
+        with CellGrid.replace(grid_path, term_width, term_height,
+                              rows) as grid:
+            render_term_file(grid, term_file_path)
 
 if __name__ == "__main__":
-    make_term_file()
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '-r',
+        '--restore',
+        action='store_true',
+        help='''
+        Start with whatever was on the screen the last time the mirror ran
+        (dimmed until it's refreshed), rather than a blank screen
+        '''
+    )
+    args = parser.parse_args()
+    make_term_file(restore=args.restore)
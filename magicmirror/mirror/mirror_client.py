@@ -0,0 +1,231 @@
+# !/bin/python
+# A drop-in replacement for update_mirror.py that hands the text block off to
+# the compositor (see compositor.py) instead of editing term.txt itself.
+#
+# example:
+#     echo 'some text\nnice text' | python mirror_client.py 1 2 9 2
+#
+# This is deliberately tiny - it only imports a couple of standard library
+# modules, and all it does is write the text block to a Unix socket. The
+# compositor already has the screen in memory, so it's the one that does the
+# actual work.
+# If the compositor isn't running, this falls back to doing the update itself
+# with update_mirror.py, so nothing breaks if the compositor has died.
+#
+# The protocol is simple enough that you don't strictly need this script. The
+# first line is "column row width height", and everything after that (up to
+# EOF) is the text block. So this also works:
+#     { echo 1 2 9 2; echo 'some text'; } | socat - UNIX-CONNECT:compositor.sock
+#
+# The header can also name the layer the text block belongs to, its z-index,
+# and which of its cells are transparent (see utilities/layers.py):
+#     python mirror_client.py --layer clock --z 1 --transparent spaces 0 12 74 11
+# which sends the header "0 12 74 11 layer=clock z=1 transparent=spaces".
+# If the compositor isn't running, these are ignored.
+#
+# Or, with --shard, the text block is written to a file of its own (a shard)
+# instead, which the compositor picks up (see utilities/shards.py). Each
+# config section gets its own shard, so writers never wait for each other:
+#     python mirror_client.py --shard --layer clock 0 12 74 11
+# Unlike updates sent over the socket, shards don't fall back to
+# update_mirror.py - they're applied when the compositor starts up.
+#
+# If the first line is "batch" instead, the rest is a batch of text blocks in
+# the same format update_mirror.py --batch takes (one JSON object per line):
+#     python mirror_client.py --batch < blocks.jsonl
+import os
+import sys
+import socket
+from urllib.parse import quote
+
+# The options that say which layer a text block belongs to
+LAYER_OPTIONS = ('layer', 'z', 'transparent')
+
+
+def get_socket_path():
+    """ Returns the path of the compositor's Unix socket, which lives in the
+    same directory as this script.
+    """
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    return os.path.join(script_dir, 'compositor.sock')
+
+def send_update(text, column, row, width, height, socket_path=None,
+                **layer_options):
+    """ Input:
+            text: bytes - the block of text we want to insert. Lines are
+                separated by newline characters.
+            column: int - the column of the upper left corner of the text box
+            row: int - the row of the upper left corner of the text box
+            width: int - the width of the text box in columns
+            height: int - the height of the text box in rows
+            socket_path: str - the compositor's socket. Defaults to the value
+                returned by get_socket_path()
+            layer_options: layer (str), z (int), and transparent (str) - which
+                layer the text block belongs to (see utilities/layers.py)
+        Output:
+            Sends the text block to the compositor, and waits for it to be
+            applied. Raises an OSError if the compositor can't be reached, and
+            a RuntimeError if it didn't like the update.
+    """
+    header = format_header(column, row, width, height, **layer_options)
+    send_request(header + text, socket_path)
+
+def write_shard(text, column, row, width, height, term_file_path=None,
+                **layer_options):
+    """ Input:
+            text, column, row, width, height, layer_options: the same as
+                send_update(). The layer defaults to one named after the
+                region.
+            term_file_path: str - the path of term.txt. Defaults to term.txt
+                in the same directory as this script.
+        Output:
+            Writes the text block to the layer's own shard file (see
+            utilities/shards.py), for the compositor to pick up. Nothing else
+            writes that file, so we never have to wait for anybody.
+    """
+    from utilities.shards import get_shard_dir, write_shard as write
+    if term_file_path is None:
+        script_dir = os.path.dirname(os.path.abspath(__file__))
+        term_file_path = os.path.join(script_dir, 'term.txt')
+    layer = layer_options.get('layer') or \
+        f'region {column} {row} {width} {height}'
+    header = format_header(column, row, width, height, **layer_options)
+    write(get_shard_dir(term_file_path), layer, header + text)
+
+def format_header(column, row, width, height, **layer_options):
+    """ Returns the header line of an update (see compositor.parse_header()),
+    as bytes
+    """
+    header = f'{column} {row} {width} {height}'
+    for key in LAYER_OPTIONS:
+        if layer_options.get(key) is not None:
+            header += f' {key}={quote(str(layer_options[key]), safe="")}'
+    return (header + '\n').encode()
+
+def send_batch(blocks, socket_path=None):
+    """ Input:
+            blocks: bytes - text blocks, one JSON object per line (see
+                update_mirror.read_batch())
+            socket_path: str - the compositor's socket. Defaults to the value
+                returned by get_socket_path()
+        Output:
+            Sends the whole batch to the compositor, and waits for it to be
+            applied. Raises the same exceptions as send_update().
+    """
+    send_request(b'batch\n' + blocks, socket_path)
+
+def send_resize(width, height, socket_path=None):
+    """ Input:
+            width: int - the new width of the screen in columns
+            height: int - the new height of the screen in rows
+            socket_path: str - the compositor's socket. Defaults to the value
+                returned by get_socket_path()
+        Output:
+            Asks the compositor to resize the screen, and waits for it to be
+            done. Raises the same exceptions as send_update().
+    """
+    send_request(f'resize {width} {height}\n'.encode(), socket_path)
+
+def get_stats(socket_path=None):
+    """ Input:
+            socket_path: str - the compositor's socket. Defaults to the value
+                returned by get_socket_path()
+        Output:
+            stats: dict - how many updates the compositor has applied, and how
+                many it skipped because they wouldn't have changed anything
+    """
+    import json
+    return json.loads(_exchange(b'stats\n', socket_path))
+
+def send_request(request, socket_path=None):
+    """ Input:
+            request: bytes - the header line followed by the body
+            socket_path: str - the compositor's socket
+        Output:
+            Sends the request to the compositor and checks its reply
+    """
+    reply = _exchange(request, socket_path)
+    if not reply.startswith(b'ok'):
+        raise RuntimeError(reply.decode(errors='replace').strip())
+
+def _exchange(request, socket_path=None):
+    """ Sends a request to the compositor and returns its reply (as bytes)
+    """
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(socket_path or get_socket_path())
+        sock.sendall(request)
+        # Closing our end tells the compositor that's the end of the text
+        sock.shutdown(socket.SHUT_WR)
+        reply = b''
+        while True:
+            chunk = sock.recv(4096)
+            if not chunk:
+                break
+            reply += chunk
+    return reply
+
+def parse_layer_options(argv):
+    """ Input:
+            argv: list of str - the command line arguments
+        Output:
+            (options, remaining): a dict containing any --layer, --z, and
+                --transparent options, and the rest of the arguments
+    """
+    options = {}
+    remaining = []
+    args = iter(argv)
+    for arg in args:
+        if arg.startswith('--') and arg[2:] in LAYER_OPTIONS:
+            value = next(args, None)
+            if value is None:
+                raise ValueError(f'{arg} needs a value')
+            options[arg[2:]] = value
+        else:
+            remaining.append(arg)
+    return options, remaining
+
+def main(argv):
+    """ Input:
+            argv: list of str - column, row, width, and height (the same
+                arguments update_mirror.py takes), or just --batch. The
+                column, row, width, and height can be preceded by --layer,
+                --z, and --transparent, and by --shard to write the text block
+                to a shard instead of sending it to the compositor.
+    """
+    if argv == ['--batch']:
+        blocks = sys.stdin.buffer.read()
+        try:
+            send_batch(blocks)
+        except (FileNotFoundError, ConnectionRefusedError):
+            # The compositor isn't running, so we do it the slow way
+            from update_mirror import insert_text_blocks, read_batch
+            insert_text_blocks(read_batch(
+                blocks.decode('utf-8', errors='replace').splitlines()))
+        return 0
+    shard = '--shard' in argv
+    if shard:
+        argv = [arg for arg in argv if arg != '--shard']
+    try:
+        layer_options, argv = parse_layer_options(argv)
+        column, row, width, height = (int(arg) for arg in argv)
+    except ValueError:
+        sys.stderr.write(
+            'usage: mirror_client.py [--shard] [--layer NAME] [--z Z] '
+            '[--transparent T] column row width height\n'
+            '       mirror_client.py --batch\n')
+        return 2
+    text = sys.stdin.buffer.read()
+    if shard:
+        write_shard(text, column, row, width, height, **layer_options)
+        return 0
+    try:
+        send_update(text, column, row, width, height, **layer_options)
+    except (FileNotFoundError, ConnectionRefusedError):
+        # The compositor isn't running, so we do it the slow way
+        from update_mirror import insert_text_block
+        insert_text_block(
+            text.decode('utf-8', errors='replace'), column, row, width, height)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,140 @@
+# !/bin/python
+# Prints some statistics about the state of the mirror.
+#
+# example:
+#     python mirror_stats.py encoding
+#     python mirror_stats.py regions
+#     python mirror_stats.py timings
+import os
+import sys
+import argparse
+from mirror_client import get_stats
+from update_mirror import get_term_file_path
+from utilities.cell_grid import CellGrid, get_grid_path
+from utilities.color_depth import get_color_depth
+from utilities.sgr_encoder import encoding_savings
+from utilities.sgr_tokenizer import tokenize_text
+from utilities.timing import get_log_path, read_timings, summarize_timings
+
+
+def read_screen(term_file_path: str) -> list:
+    """ Returns the current state of the screen as a list of rows of cells.
+    Reads the cell grid if there is one, otherwise parses term.txt.
+    """
+    grid_path = get_grid_path(term_file_path)
+    if os.path.exists(grid_path):
+        with CellGrid.open(grid_path, writable=False) as grid:
+            return grid.read_rows()
+    with open(term_file_path, encoding='utf-8') as f:
+        return tokenize_text(f.read())
+
+def encoding_report(term_file_path: str) -> str:
+    """ Input:
+            term_file_path: str - the path of term.txt
+        Output:
+            report: str - how many bytes it takes to encode the screen with
+                every cell wrapped in its own escape sequence vs. with the
+                minimal encoder, and how big term.txt actually is.
+    """
+    rows = read_screen(term_file_path)
+    color_depth = get_color_depth(term_file_path)
+    per_cell, minimal = encoding_savings(rows, color_depth)
+    saved = per_cell - minimal
+    percent = 100*saved/per_cell if per_cell else 0
+    cells = sum(len(cells) for cells in rows)
+    return '\n'.join([
+        f'cells:              {cells}',
+        f'color depth:        {color_depth}',
+        f'term.txt:           {os.path.getsize(term_file_path)} bytes',
+        f'per-cell encoding:  {per_cell} bytes',
+        f'minimal encoding:   {minimal} bytes',
+        f'saved:              {saved} bytes ({percent:.1f}%)',
+    ]) + '\n'
+
+def regions_report(socket_path: str = None) -> str:
+    """ Input:
+            socket_path: str - the compositor's socket
+        Output:
+            report: str - how many updates the compositor has applied, and how
+                many it skipped because the text block was already on the
+                screen
+    """
+    stats = get_stats(socket_path)
+    total = stats['applied'] + stats['skipped']
+    percent = 100*stats['skipped']/total if total else 0
+    return '\n'.join([
+        f'updates:            {total}',
+        f'applied:            {stats["applied"]}',
+        f'skipped:            {stats["skipped"]} ({percent:.1f}%)',
+        f'regions tracked:    {stats["regions"]}',
+    ]) + '\n'
+
+def timings_report(log_path: str) -> str:
+    """ Input:
+            log_path: str - the path of the timing log (see utilities/timing.py)
+        Output:
+            report: str - a table with the number of times each stage ran, the
+                median, 95th percentile, and max time it took, and the average
+                counts (bytes, cells, etc.) that were logged with it
+    """
+    summary = summarize_timings(read_timings(log_path))
+    lines = [f'{"stage":24} {"count":>6} {"p50 ms":>9} {"p95 ms":>9} '
+             f'{"max ms":>9}  averages']
+    for name in sorted(summary):
+        stats = summary[name]
+        averages = ', '.join(f'{key}={value:.0f}'
+                             for key, value in sorted(stats['averages'].items()))
+        lines.append(
+            f'{name:24} {stats["count"]:6} {stats["p50"]*1000:9.2f} '
+            f'{stats["p95"]*1000:9.2f} {stats["max"]*1000:9.2f}  {averages}')
+    return '\n'.join(lines) + '\n'
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest='report', required=True)
+    subparsers.add_parser(
+        'encoding',
+        help='''
+        Compares the size of the screen when every cell is wrapped in its own
+        escape sequence (the way color_text.py does it) with the size when
+        escape sequences are only emitted when the style changes (the way
+        term.txt is written).
+        '''
+    )
+    subparsers.add_parser(
+        'regions',
+        help='''
+        Asks the compositor how many updates it has applied, and how many it
+        skipped because they would have written the same text to a region
+        that was already there.
+        '''
+    )
+    timings = subparsers.add_parser(
+        'timings',
+        help='''
+        Summarizes the timing log written when the MIRROR_TIMING environment
+        variable is set (see utilities/timing.py).
+        '''
+    )
+    timings.add_argument(
+        '-l',
+        '--log',
+        help='''
+        The timing log to read. Defaults to the one MIRROR_TIMING points to
+        (or timings.jsonl in the same directory as this script).
+        '''
+    )
+    args = parser.parse_args()
+    if args.report == 'timings':
+        log_path = args.log or get_log_path()
+        try:
+            sys.stdout.write(timings_report(log_path))
+        except FileNotFoundError:
+            sys.exit(f'There is no timing log at {log_path}')
+    elif args.report == 'encoding':
+        sys.stdout.write(encoding_report(get_term_file_path()))
+    elif args.report == 'regions':
+        try:
+            sys.stdout.write(regions_report())
+        except (FileNotFoundError, ConnectionRefusedError):
+            sys.exit('The compositor isn\'t running')
@@ -0,0 +1,376 @@
+# !/bin/python
+# Displays the mirror in the terminal. This replaces color-watch.sh.
+#
+# color-watch.sh redraws the whole screen every couple of seconds, whether
+# anything changed or not. This keeps track of the last frame it displayed,
+# and when the screen changes it compares the new frame with the old one, cell
+# by cell. Only the cells that changed are redrawn: for each run of changed
+# cells we move the cursor there and write out the run. The whole frame goes
+# out in a single write(), so there's no flicker.
+# A clock that changes a dozen cells a minute costs a few dozen bytes, rather
+# than a full screen repaint.
+#
+# Rather than checking term.txt every couple of seconds, we use inotify to ask
+# the kernel to wake us up when term.txt is replaced. So we use no CPU at all
+# while nothing's happening, and the screen is redrawn as soon as something
+# does. If inotify isn't available (or you ask for it with --interval), we
+# fall back to checking every so often, like color-watch.sh.
+#
+# When the terminal is resized (the console font changed, say), we get a
+# SIGWINCH. The screen is resized to fit the terminal - by the compositor if
+# it's running, since it can put every region back where it belongs (see
+# compositor.py), or by cropping/padding the cell grid if it isn't - and
+# redrawn. None of the cron jobs have to be re-run. The size is also checked
+# when the renderer starts, in case it changed while the renderer was stopped.
+#
+# example:
+#     python renderer.py
+#     python renderer.py --interval 5
+import os
+import sys
+import time
+import select
+import signal
+import argparse
+from make_term_file import resize_term_file
+from mirror_client import send_resize
+from update_mirror import get_term_file_path
+from utilities.cell_grid import CellGrid, get_grid_path
+from utilities.char_width import CONTINUATION
+from utilities.color_depth import get_color_depth
+from utilities.inotify import (
+    IN_CLOSE_WRITE,
+    IN_MOVED_TO,
+    Inotify,
+    inotify_available,
+)
+from utilities.sgr_encoder import encode_row
+from utilities.sgr_tokenizer import tokenize_text
+
+HIDE_CURSOR = '\x1b[?25l'
+SHOW_CURSOR = '\x1b[?25h'
+CLEAR_SCREEN = '\x1b[H\x1b[2J'
+# Moving the cursor costs about 8 bytes, so if two runs of changed cells are
+# only a few cells apart it's cheaper to redraw the cells in between than to
+# move the cursor over them.
+MERGE_GAP = 4
+# When term.txt changes we wait this long (in seconds) for things to settle
+# down before redrawing, so that a burst of updates (several cron jobs firing
+# at once) only costs one redraw...
+COALESCE_WINDOW = 0.03
+# ...but we don't wait longer than this, even if the updates keep coming
+MAX_COALESCE_DELAY = 0.25
+
+
+def move_cursor(column: int, row: int) -> str:
+    """ Returns the escape sequence that moves the cursor to (column, row).
+    Both are indexed from zero (the terminal indexes them from one).
+    """
+    return f'\x1b[{row + 1};{column + 1}H'
+
+def changed_runs(old: list, new: list) -> list:
+    """ Input:
+            old: list of cells - a row of the frame that's on the screen
+            new: list of cells - the same row of the new frame
+        Output:
+            runs: list of (start, stop) tuples - the runs of cells that need
+                to be redrawn. Runs that are within MERGE_GAP cells of each
+                other are merged.
+    """
+    runs = []
+    start = None
+    last_change = None
+    for column, (old_cell, new_cell) in enumerate(zip(old, new)):
+        if old_cell == new_cell:
+            continue
+        if start is None:
+            start = column
+        elif column - last_change > MERGE_GAP:
+            runs.append((start, last_change + 1))
+            start = column
+        last_change = column
+    if start is not None:
+        runs.append((start, last_change + 1))
+    # If the new row is longer than the old one, the extra cells are new too
+    if len(new) > len(old):
+        if runs and len(old) - runs[-1][1] <= MERGE_GAP:
+            runs[-1] = (runs[-1][0], len(new))
+        else:
+            runs.append((len(old), len(new)))
+    if not runs:
+        return runs
+    # A wide character has to be drawn in one piece, so a run can't start or
+    # end halfway through one
+    fixed = []
+    for start, stop in runs:
+        if start and new[start][0] == CONTINUATION:
+            start -= 1
+        if stop < len(new) and new[stop][0] == CONTINUATION:
+            stop += 1
+        if fixed and start <= fixed[-1][1]:
+            fixed[-1] = (fixed[-1][0], stop)
+        else:
+            fixed.append((start, stop))
+    return fixed
+
+class FrameSource:
+    """ Reads frames from the cell grid (or from term.txt, if there's no grid)
+    and keeps track of whether the screen has changed since the last read.
+    """
+    def __init__(self, term_file_path: str = None):
+        self.term_file_path = term_file_path or get_term_file_path()
+        self.grid_path = get_grid_path(self.term_file_path)
+        self.signature = None
+
+    def _stat_signature(self):
+        """ term.txt is replaced (not edited) every time the screen changes, so
+        its inode number and mtime tell us whether anything happened.
+        """
+        try:
+            stat = os.stat(self.term_file_path)
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    def changed(self) -> bool:
+        """ Returns True if the screen has changed since the last read()
+        """
+        return self._stat_signature() != self.signature
+
+    def read(self) -> list:
+        """ Returns the current frame, as a list of rows of cells
+        """
+        self.signature = self._stat_signature()
+        if os.path.exists(self.grid_path):
+            with CellGrid.open(self.grid_path, writable=False) as grid:
+                with grid.lock(0, 0, grid.width, grid.height,
+                               exclusive=False):
+                    return grid.read_rows()
+        with open(self.term_file_path, encoding='utf-8') as f:
+            return tokenize_text(f.read())
+
+class DamageRenderer:
+    """ Draws frames to the terminal, redrawing only what changed since the
+    last frame.
+    """
+    def __init__(self, fd: int = None, term_file_path: str = None):
+        """ Input:
+                fd: int - the file descriptor to write to. Defaults to stdout.
+                term_file_path: str - the path of the term.txt we're
+                    displaying, which has the color depth to draw with saved
+                    next to it (see utilities/color_depth.py)
+        """
+        self.fd = sys.stdout.fileno() if fd is None else fd
+        self.term_file_path = term_file_path
+        self.last_frame = None
+
+    def frame_diff(self, frame: list) -> str:
+        """ Input:
+                frame: list of rows of cells - the new frame
+            Output:
+                the text that turns the last frame into the new one
+        """
+        last = self.last_frame
+        color_depth = get_color_depth(self.term_file_path)
+        if last is None or len(last) != len(frame):
+            # Nothing to compare against, so we draw everything
+            out = [CLEAR_SCREEN]
+            for row, cells in enumerate(frame):
+                out.append(move_cursor(0, row))
+                out.append(encode_row(cells, color_depth))
+            return ''.join(out)
+        out = []
+        for row, (old, new) in enumerate(zip(last, frame)):
+            # Comparing two lists of tuples happens in C, so unchanged rows
+            # (which is most of them) are cheap to skip
+            if old == new:
+                continue
+            for start, stop in changed_runs(old, new):
+                out.append(move_cursor(start, row))
+                out.append(encode_row(new[start:stop], color_depth))
+        return ''.join(out)
+
+    def draw(self, frame: list) -> int:
+        """ Input:
+                frame: list of rows of cells - the new frame
+            Output:
+                Writes the changes to the terminal in a single write() (or as
+                few as the OS will let us). Returns the number of bytes written.
+        """
+        data = self.frame_diff(frame).encode('utf-8')
+        self.last_frame = frame
+        view = memoryview(data)
+        while view:
+            written = os.write(self.fd, view)
+            view = view[written:]
+        return len(data)
+
+    def invalidate(self):
+        """ Forgets the last frame, so the next draw() redraws everything
+        """
+        self.last_frame = None
+
+def terminal_size(fd: int):
+    """ Returns the (width, height) of the terminal 'fd' is connected to, or
+    None if it isn't connected to one
+    """
+    try:
+        size = os.get_terminal_size(fd)
+    except OSError:
+        return None
+    return size.columns, size.lines
+
+def resize_screen(width: int, height: int, term_file_path: str):
+    """ Input:
+            width: int - the new width of the screen in columns
+            height: int - the new height of the screen in rows
+            term_file_path: str - the path of term.txt
+        Output:
+            Asks the compositor to resize the screen, or resizes the cell grid
+            ourselves if the compositor isn't running
+    """
+    try:
+        send_resize(width, height)
+    except (FileNotFoundError, ConnectionRefusedError):
+        resize_term_file(width, height, term_file_path)
+
+def check_size(source: FrameSource, renderer: DamageRenderer) -> bool:
+    """ Input:
+            source: FrameSource - where the frames come from
+            renderer: DamageRenderer - what draws the frames
+        Output:
+            If the terminal isn't the same size as the last frame we drew,
+            resizes the screen to fit and redraws it. Returns True if it did.
+    """
+    size = terminal_size(renderer.fd)
+    frame = renderer.last_frame
+    if size is None or not frame or size == (len(frame[0]), len(frame)):
+        return False
+    try:
+        resize_screen(*size, source.term_file_path)
+    except (OSError, RuntimeError, ValueError):
+        # We'll try again the next time we're woken up. There's nowhere to
+        # report the error that wouldn't mess up the screen.
+        return False
+    renderer.invalidate()
+    renderer.draw(source.read())
+    return True
+
+def drain(fd: int):
+    """ Reads (and throws away) everything that's waiting on a non-blocking
+    file descriptor
+    """
+    try:
+        while os.read(fd, 4096):
+            pass
+    except BlockingIOError:
+        pass
+
+def poll(source: FrameSource, renderer: DamageRenderer, interval: float,
+         wakeup_fd: int):
+    """ Input:
+            source: FrameSource - where the frames come from
+            renderer: DamageRenderer - what draws the frames
+            interval: float - how often (in seconds) to check whether the
+                screen has changed
+            wakeup_fd: int - a file descriptor that becomes readable when the
+                terminal is resized
+        Output:
+            Checks for changes every 'interval' seconds, forever
+    """
+    while True:
+        ready, _, _ = select.select([wakeup_fd], [], [], interval)
+        if ready:
+            drain(wakeup_fd)
+            check_size(source, renderer)
+        if source.changed():
+            renderer.draw(source.read())
+
+def wait_for_changes(source: FrameSource, renderer: DamageRenderer,
+                     wakeup_fd: int):
+    """ Input:
+            source: FrameSource - where the frames come from
+            renderer: DamageRenderer - what draws the frames
+            wakeup_fd: int - a file descriptor that becomes readable when the
+                terminal is resized
+        Output:
+            Redraws the screen whenever term.txt is replaced, forever
+
+    term.txt is published by renaming a temporary file on top of it, so we
+    watch the directory it's in (a watch on term.txt itself would be stuck on
+    the old file). Events for other files in the directory are ignored.
+    """
+    directory, name = os.path.split(os.path.abspath(source.term_file_path))
+    with Inotify() as notify:
+        notify.add_watch(directory, IN_CLOSE_WRITE | IN_MOVED_TO)
+        # In case something changed before the watch was set up
+        if source.changed():
+            renderer.draw(source.read())
+        while True:
+            ready, _, _ = select.select([notify.fd, wakeup_fd], [], [])
+            if wakeup_fd in ready:
+                drain(wakeup_fd)
+                check_size(source, renderer)
+            if notify.fd not in ready:
+                continue
+            events = notify.read_events(0)
+            if not any(event[3] == name for event in events):
+                continue
+            # Soak up any other events that arrive in quick succession
+            deadline = time.monotonic() + MAX_COALESCE_DELAY
+            while time.monotonic() < deadline:
+                if not notify.read_events(COALESCE_WINDOW):
+                    break
+            if source.changed():
+                renderer.draw(source.read())
+
+def watch(interval: float = None, term_file_path: str = None):
+    """ Input:
+            interval: float - how often (in seconds) to check whether the
+                screen has changed. If None, we use inotify to find out when
+                it changes instead (if we can).
+            term_file_path: str - the path of term.txt
+        Output:
+            Displays the mirror until interrupted
+    """
+    # SIGTERM (i.e. from 'kill') should clean up the same way Ctrl-C does
+    signal.signal(signal.SIGTERM, lambda *args: sys.exit(0))
+    # When the terminal is resized, Python writes the signal number to
+    # wakeup_fd, which wakes up whichever loop is waiting on it. The handler
+    # itself doesn't need to do anything.
+    wakeup_fd, wakeup_write_fd = os.pipe()
+    os.set_blocking(wakeup_fd, False)
+    os.set_blocking(wakeup_write_fd, False)
+    signal.set_wakeup_fd(wakeup_write_fd)
+    signal.signal(signal.SIGWINCH, lambda *args: None)
+    source = FrameSource(term_file_path)
+    renderer = DamageRenderer(term_file_path=source.term_file_path)
+    os.write(renderer.fd, HIDE_CURSOR.encode())
+    try:
+        renderer.draw(source.read())
+        check_size(source, renderer)
+        if interval is None and inotify_available():
+            wait_for_changes(source, renderer, wakeup_fd)
+        else:
+            poll(source, renderer, interval or 2, wakeup_fd)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        # unhide the cursor when we exit or are interrupted
+        os.write(renderer.fd, SHOW_CURSOR.encode())
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '-n',
+        '--interval',
+        type=float,
+        help='''
+        Check whether the screen has changed every INTERVAL seconds, like
+        color-watch.sh does. By default the renderer uses inotify to find out
+        when the screen changes instead, and only falls back to checking every
+        2 seconds if inotify isn't available.
+        '''
+    )
+    args = parser.parse_args()
+    watch(args.interval)
@@ -5,8 +5,20 @@
 import os
 import sys
 import argparse
-import re
+import json
 from pathlib import Path
+from utilities.atomic_file import atomic_splice, atomic_write, publish_lock
+from utilities.cell_grid import CellGrid, get_grid_path
+from utilities.color_depth import get_color_depth
+from utilities.row_index import build_row_index, load_row_index, save_row_index
+from utilities.sgr_encoder import encode_row
+from utilities.sgr_tokenizer import (
+    BLANK_CELL,
+    cell_to_ansi,
+    tokenize_line,
+)
+from utilities.spans import tokenize_block
+from utilities.timing import stage
 
 def get_script_dir():
     """ Input:
@@ -50,46 +62,162 @@ def break_line_into_characters(line, size=None):
     A pink "Z" on a blue background is:
         '\x1b[38;2;200;16;57;48;2;10;6;200mZ\x1b[0m'
     This function takes a string and turns it into a list, where each entry is
-    a single printable character.
-
-    ### BIG ASSUMPTION: ###
-    For simplicity, we're going to assume that each character with ANSI escape
-    code formatting is formatted individually.
-    If we want "Hello world!" to be printed in red, we *could* print the
-    sequence:
-        '\x1b[38;2;255;0;0mHello world!\x1b[0m'
-    But instead, we will be printing each individual character in its own escape
-    sequence bubble:
-        '\x1b[38;2;255;0;0mH\x1b[0m\x1b[38;2;255;0;0me\x1b[0m'...
-    This makes the term.txt file VERY VERBOSE, and I'm not sure that it's the
-    best way to approach this.
-    We're also going to assume that each character is followed by '\x1b[0m',
-    which is an escape sequence that resets all attributes (so we have a clean
-    slate.
-    Given that most of the term.txt file is expected to be whitespace (this is
-    for a magic mirror, and most of the display will be blank), I don't think
-    that this will have enough of an impact to really matter - but I could be
-    wrong. We'll see.
+    a single printable character (wrapped in its own escape sequence, if it
+    has any formatting).
+
+    This used to assume that every character was formatted individually and
+    followed by '\x1b[0m'. That's no longer the case - the heavy lifting is
+    done by utilities/sgr_tokenizer.py, which keeps track of the SGR state as
+    it goes, so text like '\x1b[38;2;255;0;0mHello world!\x1b[0m' is split up
+    correctly too.
+    If you don't need the strings, use tokenize_line() directly - it's
+    faster, and the cells it returns are easier to work with.
     """
+    return [cell_to_ansi(cell) for cell in tokenize_line(line, size)]
 
-    get_char_expression = r'''
-        \x1b\[          # This begins the escape sequence
-        ([0-9]{1,3};)+? # semicolon-separated parameters
-        [0-9]{1,3}m     # final parameter
-        (?P<char>.)     # the printable character
-        \x1b\[0m        # resets everything back to normal
-        |.              # this matches non-ANSI-formatted characters
-        '''
-    get_char = re.compile(get_char_expression, re.VERBOSE)
-    char_list = [i.group(0) for i in get_char.finditer(line)]
-    if size and (len(char_list) < size):
-        char_list += [' ']*(size - len(char_list))
-    return char_list[:size]
+def get_term_file_path():
+    """ Returns the path of the term.txt file
+    """
+    return os.path.join(get_script_dir(), 'term.txt')
+
+def read_term_rows(term_file_path, first_row, last_row, offsets=None):
+    """ Input:
+            term_file_path: str - the path of term.txt
+            first_row: int - the first row to read
+            last_row: int - one past the last row to read
+            offsets: list of ints - the row index of term.txt. Loaded from the
+                index file if not provided.
+        Output:
+            rows: list of strings - the rows first_row to last_row of term.txt
+                (or fewer, if term.txt doesn't have that many rows)
+
+    Uses the row index to read just the rows we're interested in.
+    """
+    if offsets is None:
+        offsets = load_row_index(term_file_path)
+    last_row = min(last_row, len(offsets) - 1)
+    if first_row >= last_row:
+        return []
+    start, end = offsets[first_row], offsets[last_row] - 1
+    with open(term_file_path, 'rb') as f:
+        f.seek(start)
+        return f.read(end - start).decode('utf-8').split('\n')
+
+def write_term_rows(term_file_path, new_rows, offsets):
+    """ Input:
+            term_file_path: str - the path of term.txt
+            new_rows: dict - maps row numbers to the new contents of those rows
+                (as strings). These have to be rows that already exist.
+            offsets: list of ints - the row index of term.txt
+        Output:
+            Publishes a new term.txt with the rows spliced in, and updates the
+            row index.
+
+    The caller has to be holding the publish_lock() for term.txt.
+    The new term.txt is written to a temporary file and renamed into place,
+    so anyone reading it never sees a half-written frame. The rows we aren't
+    replacing are copied over by the kernel (see atomic_splice()) - they're
+    never read into Python, let alone parsed.
+    """
+    with stage('update.splice', rows=len(new_rows)) as timer:
+        pieces = []
+        position = 0
+        encoded = {}
+        for row_number in sorted(new_rows):
+            encoded[row_number] = new_rows[row_number].encode('utf-8')
+            start, end = offsets[row_number], offsets[row_number + 1] - 1
+            pieces.append((position, start))
+            pieces.append(encoded[row_number])
+            position = end
+        pieces.append((position, None))
+        timer.count(bytes_out=sum(map(len, encoded.values())))
+    with stage('update.write'):
+        atomic_splice(term_file_path, pieces)
+
+    # Update the row index to match the new state of term.txt
+    with stage('update.index'):
+        delta = 0
+        for row_number in range(len(offsets) - 1):
+            old_length = offsets[row_number + 1] - 1 - offsets[row_number]
+            offsets[row_number] += delta
+            if row_number in encoded:
+                delta += len(encoded[row_number]) - old_length
+        offsets[-1] += delta
+        save_row_index(term_file_path, offsets)
+
+def render_term_file(grid, term_file_path):
+    """ Input:
+            grid: CellGrid - the cell grid holding the state of the screen
+            term_file_path: str - the path of term.txt
+        Output:
+            Renders the entire grid to term.txt (and writes its row index)
+
+    The caller has to be holding the publish_lock() for term.txt.
+    Rows are encoded with as few escape sequences as possible (see
+    utilities/sgr_encoder.py).
+    """
+    with stage('update.render', cells=grid.width*grid.height) as timer:
+        with grid.lock(0, 0, grid.width, grid.height, exclusive=False):
+            rows = grid.read_rows()
+        color_depth = get_color_depth(term_file_path)
+        data = '\n'.join([encode_row(cells, color_depth)
+                          for cells in rows]).encode('utf-8')
+        atomic_write(term_file_path, data)
+        save_row_index(term_file_path, build_row_index(data))
+        timer.count(bytes_out=len(data))
+
+def publish_grid_rows(grid, term_file_path, first_row, last_row):
+    """ Input:
+            grid: CellGrid - the cell grid holding the state of the screen
+            term_file_path: str - the path of term.txt
+            first_row: int - the first row of the grid that changed
+            last_row: int - one past the last row of the grid that changed
+        Output:
+            Re-renders the rows first_row to last_row of the grid and publishes
+            a new term.txt with them spliced in.
+    """
+    publish_grid_row_set(grid, term_file_path, range(first_row, last_row))
+
+def publish_grid_row_set(grid, term_file_path, row_numbers):
+    """ Input:
+            grid: CellGrid - the cell grid holding the state of the screen
+            term_file_path: str - the path of term.txt
+            row_numbers: iterable of ints - the rows of the grid that changed.
+                They don't have to be next to each other.
+        Output:
+            Re-renders those rows of the grid and publishes a new term.txt with
+            them spliced in.
+
+    Don't call this while holding a lock on the grid. We have to wait for
+    anyone writing to these rows of the grid to finish, so that we don't
+    publish half of their update.
+    """
+    with publish_lock(term_file_path):
+        offsets = load_row_index(term_file_path)
+        if len(offsets) - 1 != grid.height:
+            # term.txt doesn't match the grid (something else wrote to it), so
+            # the whole thing needs to be re-rendered
+            render_term_file(grid, term_file_path)
+            return
+        new_rows = {}
+        color_depth = get_color_depth(term_file_path)
+        with stage('update.encode') as timer:
+            for row_number in sorted(set(row_numbers)):
+                if not 0 <= row_number < grid.height:
+                    continue
+                with grid.lock(0, row_number, grid.width, 1, exclusive=False):
+                    cells = grid.read_row(row_number)
+                new_rows[row_number] = encode_row(cells, color_depth)
+            timer.count(rows=len(new_rows), cells=len(new_rows)*grid.width)
+        if new_rows:
+            write_term_rows(term_file_path, new_rows, offsets)
 
-def insert_text_block(txt, column, row, txt_width, txt_height):
+def insert_text_block(txt, column, row, txt_width, txt_height,
+                      term_file_path=None):
     """ Input:
             txt: string - a block of text that we want to insert into the
                 term.txt file. Lines are separated by newline characters.
+                It can also be in the span format (see utilities/spans.py).
             column: int - the offset of the upper lefthand corner of the text
                 block (in characters, not pixels or anything). If it's all the
                 way to the left, 'column' would be 0. If the text should be
@@ -97,46 +225,141 @@ def insert_text_block(txt, column, row, txt_width, txt_height):
             row: int - the offset of the upper lefthand corner of the text
                 block (in rows from the start of the file). If it's all the way
                 at the top of the page, 'row' would be 0.
-            txt_width: int - maximum width of the text box (in columns)
+            txt_width: int - maximum width of the text box (in columns). Wide
+                characters (CJK, emoji) take up two columns, and combining
+                marks none (see utilities/char_width.py).
             txt_width: int - maximum height of the text box (in rows)
+            term_file_path: str - the path of term.txt. Defaults to the value
+                returned by get_term_file_path()
+        Output:
+            Edits the cell grid (term.grid) and the term.txt file
+
+    The cell grid (see utilities/cell_grid.py) is the real state of the
+    screen, and term.txt is rendered from it. The text block is copied into
+    the grid, and then the rows it covers are re-rendered and spliced into
+    term.txt using the row index (see utilities/row_index.py). Nothing but the
+    text block itself is ever parsed, so the work scales with the size of the
+    text block rather than the size of the screen.
+
+    Several cron jobs can fire at the same time, so:
+        - the region of the grid we're writing to is locked while we write
+          to it. Writers whose regions don't overlap don't wait on each other.
+        - term.txt is published by renaming a temporary file into place,
+          while holding the publish lock (see utilities/atomic_file.py).
+          Whoever publishes second re-renders their rows from the grid, which
+          already has the first writer's changes in it, so nothing is lost.
+
+    If there's no cell grid (because term.txt was made by an older version of
+    make_term_file.py, say), we fall back to reading and tokenizing the rows
+    of term.txt that the text block covers.
+    """
+    insert_text_blocks([{
+        'text': txt,
+        'column': column,
+        'row': row,
+        'width': txt_width,
+        'height': txt_height,
+    }], term_file_path)
+
+def insert_text_blocks(blocks, term_file_path=None):
+    """ Input:
+            blocks: iterable of dicts - the text blocks to insert. Each one has
+                the keys 'text', 'column', 'row', 'width' and 'height', which
+                mean the same thing as the arguments to insert_text_block().
+            term_file_path: str - the path of term.txt. Defaults to the value
+                returned by get_term_file_path()
         Output:
-            Edits the term.txt file
+            Edits the cell grid (term.grid) and the term.txt file
 
-    It may be that I'll need to rewrite this.
-    I think that by doing the reading and writing all in one step I can avoid
-    issues with other bits and pieces trying to modify and/or display the
-    contents of term.txt, but I could be horrendously wrong.
+    This does the same thing as calling insert_text_block() once for each
+    block, except that term.txt is only rewritten once, no matter how many
+    blocks there are. The blocks are applied in order, so if two of them
+    overlap, the later one wins.
     """
-    # Make the text into a list of lists
-    # Truncates list if number of lines exceeds txt_height
-    txt_lines = [break_line_into_characters(line, txt_width)
-                    for line in txt.split('\n')][:txt_height]
-    # Adds lines made of whitespace if number of lines is less than text_height
-    if len(txt_lines) < txt_height:
-        txt_lines += [[' ']*txt_width]*(txt_height - len(txt_lines))
-    script_dir = get_script_dir()
-    term_file_path = os.path.join(script_dir, 'term.txt')
-    with open(term_file_path, 'r+') as f:
-        # read old terminal state
-        old_data = f.read().split('\n')
-
-        for row_number in range(len(old_data)):
-            line = break_line_into_characters(old_data[row_number])
-            if row_number < row:
-                pass
-            elif row_number > (row + txt_height - 1):
-                break
-            else:
-                new_line = line[:column] \
-                    + txt_lines[row_number-row] \
-                        + line[txt_width+column:]
-                old_data[row_number] = ''.join(new_line)
-
-        # write new data to term.txt file
-        new_data = '\n'.join(old_data)
-        f.seek(0)
-        f.write(new_data)
-        f.truncate()
+    with stage('update.total'):
+        _insert_text_blocks(blocks, term_file_path)
+
+def _insert_text_blocks(blocks, term_file_path=None):
+    """ Does the work for insert_text_blocks()
+    """
+    # Make each block's text into a list of lists of cells.
+    # Truncates/pads the rows to the width and the block to the height.
+    with stage('update.tokenize') as timer:
+        regions = [(
+            tokenize_block(block['text'], block['width'], block['height']),
+            block['column'],
+            block['row'],
+            block['width'],
+            block['height'],
+        ) for block in blocks]
+        timer.count(blocks=len(regions),
+                    cells=sum(w*h for _, _, _, w, h in regions))
+    if not regions:
+        return
+    term_file_path = term_file_path or get_term_file_path()
+    grid_path = get_grid_path(term_file_path)
+
+    if os.path.exists(grid_path):
+        with CellGrid.open(grid_path) as grid:
+            changed_rows = set()
+            with stage('update.grid_write'):
+                for txt_lines, column, row, txt_width, txt_height in regions:
+                    with grid.lock(column, row, txt_width, txt_height):
+                        grid.write_block(column, row, txt_lines)
+                    changed_rows.update(range(row, row + txt_height))
+            publish_grid_row_set(grid, term_file_path, changed_rows)
+        return
+
+    # No grid, so we have to tokenize the rows of term.txt the blocks cover.
+    # The whole read-modify-write has to happen under the publish lock.
+    with publish_lock(term_file_path):
+        offsets = load_row_index(term_file_path)
+        row_count = len(offsets) - 1
+        lines = {}
+        with stage('update.tokenize_rows') as timer:
+            for txt_lines, column, row, txt_width, txt_height in regions:
+                for row_number in range(row, min(row + txt_height, row_count)):
+                    if row_number not in lines:
+                        old_row = read_term_rows(
+                            term_file_path, row_number, row_number + 1,
+                            offsets)
+                        lines[row_number] = tokenize_line(old_row[0])
+                    line = lines[row_number]
+                    # Pads the row if the text block starts past the end of it
+                    if len(line) < column:
+                        line += [BLANK_CELL]*(column - len(line))
+                    lines[row_number] = line[:column] \
+                        + txt_lines[row_number-row] \
+                            + line[txt_width+column:]
+            timer.count(rows=len(lines))
+        if lines:
+            with stage('update.encode', rows=len(lines)):
+                color_depth = get_color_depth(term_file_path)
+                new_rows = {n: encode_row(line, color_depth)
+                            for n, line in lines.items()}
+            write_term_rows(term_file_path, new_rows, offsets)
+
+def read_batch(stream):
+    """ Input:
+            stream: a file object (like sys.stdin) containing one JSON object
+                per line. Each one has the keys 'column', 'row', 'width',
+                'height', and 'text'. Blank lines are skipped. They can also
+                have 'layer', 'z', and 'transparent' keys, which only the
+                compositor uses (see utilities/layers.py).
+        Output:
+            a generator which yields the blocks as dictionaries
+    """
+    for line_number, line in enumerate(stream, start=1):
+        if not line.strip():
+            continue
+        try:
+            block = json.loads(line)
+            for key in ('column', 'row', 'width', 'height'):
+                block[key] = int(block[key])
+            block['text'] = str(block['text'])
+        except (ValueError, KeyError, TypeError) as e:
+            raise ValueError(f'Invalid block on line {line_number}: {e}')
+        yield block
 
 if __name__ == "__main__":
     """ Input:
@@ -153,27 +376,59 @@ if __name__ == "__main__":
         echo 'some text\nnice text' | python update_mirror.py 1 2 9 2
 
     It will embed the text it receives into term.txt (assuming it is valid).
+
+    With --batch, it reads any number of text blocks instead, one JSON object
+    per line, and term.txt is only rewritten once for all of them.
+    example:
+        python update_mirror.py --batch <<EOF
+        {"column": 1, "row": 2, "width": 9, "height": 2, "text": "some text"}
+        {"column": 1, "row": 5, "width": 9, "height": 1, "text": "nice text"}
+        EOF
     """
     parser = argparse.ArgumentParser()
     parser.add_argument(
         'column',
+        nargs='?',
         help='How many columns from the left edge of the terminal is this text box?',
         type=int)
     parser.add_argument(
         'row',
+        nargs='?',
         help='How many rows from the top of the terminal is this text box?',
         type=int)
     parser.add_argument(
         'width',
+        nargs='?',
         help='Width of the text box in columns',
         type=int)
     parser.add_argument(
         'height',
+        nargs='?',
         help='Height of the text box in rows',
         type=int)
+    parser.add_argument(
+        '--batch',
+        action='store_true',
+        help='''
+        Read text blocks from stdin, one JSON object per line, each with the
+        keys "column", "row", "width", "height" and "text". All of them are
+        applied at once, and term.txt is only rewritten once.
+        '''
+    )
     args = parser.parse_args()
-    text = sys.stdin.read()
+    position = (args.column, args.row, args.width, args.height)
 
-    insert_text_block(text, args.column, args.row, args.width, args.height)
+    if args.batch:
+        if any(value is not None for value in position):
+            parser.error('column, row, width and height can\'t be used with --batch')
+        try:
+            insert_text_blocks(read_batch(sys.stdin))
+        except ValueError as e:
+            parser.error(str(e))
+    else:
+        if any(value is None for value in position):
+            parser.error('column, row, width and height are required')
+        text = sys.stdin.read()
+        insert_text_block(text, args.column, args.row, args.width, args.height)
 
     sys.exit(0)
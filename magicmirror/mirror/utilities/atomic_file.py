@@ -0,0 +1,146 @@
+""" Tools for publishing files (term.txt, mostly) so that nobody ever sees
+them half-written.
+
+Files are published by writing them to a temporary file in the same directory
+and then renaming it into place. A rename is atomic, so anyone reading the
+file (like 'cat term.txt' in color-watch.sh) either gets the old version or
+the new one, never a mix of the two - and they never have to wait for a lock.
+
+Writers, on the other hand, need to take turns. Otherwise two cron jobs that
+fire in the same minute could both read the old term.txt, each make their own
+change, and the second one to finish would quietly throw away the first one's
+change. publish_lock() takes care of that.
+
+When only part of a file changes, atomic_splice() builds the new version
+from the parts of the old one that are staying put plus the new bytes. The
+old parts are copied by the kernel (with copy_file_range(), where we have
+it), so they never pass through Python - the only bytes we handle ourselves
+are the ones that changed.
+"""
+import os
+import errno
+import fcntl
+import tempfile
+from contextlib import contextmanager
+from utilities.timing import stage
+
+
+def get_lock_path(path: str) -> str:
+    """ Returns the path of the lock file that guards 'path'
+    """
+    return path + '.lock'
+
+@contextmanager
+def publish_lock(path: str):
+    """ Input:
+            path: str - the path of the file we're about to publish
+        Output:
+            A context manager that holds an exclusive lock while the block
+            runs. Any other process trying to take the same lock will wait.
+
+    The lock is taken on a separate lock file, since the file we're
+    publishing gets replaced every time it's written (and a lock on a file
+    that's been replaced doesn't do anybody any good).
+    """
+    with open(get_lock_path(path), 'a') as lock_file:
+        with stage('publish.lock_wait'):
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+def _write_all(fd: int, data: bytes):
+    """ Writes all of 'data' to the file descriptor fd
+    """
+    view = memoryview(data)
+    while view:
+        view = view[os.write(fd, view):]
+
+def _copy_range(source: int, target: int, offset: int, length: int):
+    """ Input:
+            source: int - the file descriptor to copy from
+            target: int - the file descriptor to copy to
+            offset: int - where in 'source' to start copying from
+            length: int - the number of bytes to copy
+        Output:
+            Copies the bytes to the current position of 'target'. The kernel
+            does the copying if it can; otherwise we read and write them.
+    """
+    copy_file_range = getattr(os, 'copy_file_range', None)
+    while length > 0:
+        if copy_file_range is not None:
+            try:
+                copied = copy_file_range(source, target, length, offset)
+            except OSError as e:
+                if e.errno not in (errno.EXDEV, errno.ENOSYS, errno.EINVAL,
+                                   errno.EOPNOTSUPP, errno.EPERM):
+                    raise
+                # The kernel (or the filesystem) can't do it, so we'll do it
+                copy_file_range = None
+                continue
+        else:
+            data = os.pread(source, min(length, 1 << 20), offset)
+            _write_all(target, data)
+            copied = len(data)
+        if not copied:
+            # The source is shorter than we thought
+            break
+        offset += copied
+        length -= copied
+
+def atomic_splice(path: str, pieces: list, mode: int = 0o644):
+    """ Input:
+            path: str - the file we want to change
+            pieces: list - the new contents of the file, in order. Each piece
+                is either bytes (new data), or a (start, stop) tuple of byte
+                offsets of part of the current file to keep. A stop of None
+                means the end of the file.
+            mode: int - the permissions the file should have
+        Output:
+            Writes the new contents to a temporary file and renames it to
+            'path', like atomic_write(). The caller has to be holding the
+            publish_lock() for 'path', so that nobody replaces it while we're
+            copying from it.
+    """
+    directory, name = os.path.split(path)
+    with open(path, 'rb') as old:
+        source = old.fileno()
+        size = os.fstat(source).st_size
+        fd, temp_path = tempfile.mkstemp(dir=directory or '.',
+                                         prefix=f'.{name}.')
+        try:
+            try:
+                for piece in pieces:
+                    if isinstance(piece, tuple):
+                        start, stop = piece
+                        stop = size if stop is None else min(stop, size)
+                        _copy_range(source, fd, start, stop - start)
+                    elif piece:
+                        _write_all(fd, piece)
+                os.fchmod(fd, mode)
+            finally:
+                os.close(fd)
+            os.replace(temp_path, path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+
+def atomic_write(path: str, data: bytes, mode: int = 0o644):
+    """ Input:
+            path: str - the file we want to write
+            data: bytes - the new contents of the file
+            mode: int - the permissions the file should have
+        Output:
+            Writes 'data' to a temporary file and renames it to 'path'.
+    """
+    directory, name = os.path.split(path)
+    fd, temp_path = tempfile.mkstemp(dir=directory or '.', prefix=f'.{name}.')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+            os.fchmod(f.fileno(), mode)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
@@ -0,0 +1,273 @@
+""" A binary, memory-mapped grid of cells. This is the canonical state of the
+screen - term.txt is rendered from it.
+
+Every cell is stored in the same fixed-size slot, so cell (x, y) is always at
+the same spot in the file and writing a text block is just a matter of copying
+each of its rows into place - there's no need to parse anything.
+
+The file (term.grid) is laid out as:
+    - a 16 byte header: the magic bytes b'MMCG', the format version, the
+      width and height of the grid (in columns and rows), and some padding.
+    - width*height cells, row by row. Each cell is 4 little-endian unsigned
+      32-bit ints: (code_point, fg, bg, attrs). See sgr_tokenizer.py for what
+      those values mean.
+
+Because it's memory-mapped, any number of processes can open the grid and
+read it without making their own copy.
+
+Writers lock the part of the grid they're writing to with CellGrid.lock(), so
+two writers only have to wait for each other if their regions overlap.
+"""
+import mmap
+import os
+import fcntl
+import tempfile
+import struct
+from contextlib import contextmanager
+from itertools import chain, repeat
+from utilities.sgr_tokenizer import BLANK_CELL
+
+MAGIC = b'MMCG'
+GRID_VERSION = 1
+HEADER = struct.Struct('<4sHHII')
+CELL = struct.Struct('<IIII')
+CELL_SIZE = CELL.size
+VALUES_PER_CELL = 4
+
+# Structs for packing/unpacking runs of n cells, keyed by n
+_RUN_STRUCTS = {}
+
+
+def _run_struct(n: int) -> struct.Struct:
+    """ Returns a (cached) struct that packs n cells
+    """
+    run = _RUN_STRUCTS.get(n)
+    if run is None:
+        run = struct.Struct(f'<{n*VALUES_PER_CELL}I')
+        _RUN_STRUCTS[n] = run
+    return run
+
+class CellGrid:
+    """ A memory-mapped grid of cells. Use CellGrid.create() to make a new
+    (blank) grid file, and CellGrid.open() to open an existing one.
+    CellGrid objects can be used as context managers, which will close the
+    grid when the block exits.
+    """
+    def __init__(self, file, grid_map: mmap.mmap, width: int, height: int):
+        """ Input:
+                file: the open file object that backs the grid
+                grid_map: mmap.mmap - the memory map of 'file'
+                width: int - the width of the grid (in columns)
+                height: int - the height of the grid (in rows)
+        """
+        self.file = file
+        self.map = grid_map
+        self.width = width
+        self.height = height
+        self.row_size = width*CELL_SIZE
+
+    @classmethod
+    def create(cls, path: str, width: int, height: int):
+        """ Input:
+                path: str - where the grid file should be created. Any existing
+                    file is overwritten.
+                width: int - the width of the grid (in columns)
+                height: int - the height of the grid (in rows)
+        Output:
+                a CellGrid, filled with blank cells
+        """
+        blank_row = CELL.pack(*BLANK_CELL)*width
+        with open(path, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, GRID_VERSION, 0, width, height))
+            for _ in range(height):
+                f.write(blank_row)
+        return cls.open(path)
+
+    @classmethod
+    def replace(cls, path: str, width: int, height: int, rows: list):
+        """ Input:
+                path: str - the grid file to replace
+                width: int - the width of the new grid (in columns)
+                height: int - the height of the new grid (in rows)
+                rows: list of lists of cells - what to fill the new grid with.
+                    They're cropped, or padded with blank cells, to fit.
+        Output:
+                a CellGrid, for the new grid file
+
+        Unlike create(), the new grid is written to a temporary file and
+        renamed into place, so anyone who has the old grid mapped keeps
+        seeing the old one, rather than having it truncated under them.
+        """
+        blank_cell = CELL.pack(*BLANK_CELL)
+        directory, name = os.path.split(path)
+        fd, temp_path = tempfile.mkstemp(dir=directory or '.',
+                                         prefix=f'.{name}.')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(HEADER.pack(MAGIC, GRID_VERSION, 0, width, height))
+                for row in range(height):
+                    cells = rows[row][:width] if row < len(rows) else []
+                    values = [value for cell in cells for value in cell]
+                    f.write(_run_struct(len(cells)).pack(*values))
+                    f.write(blank_cell*(width - len(cells)))
+                os.fchmod(f.fileno(), 0o644)
+            os.replace(temp_path, path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+        return cls.open(path)
+
+    @classmethod
+    def open(cls, path: str, writable: bool = True):
+        """ Input:
+                path: str - the path of an existing grid file
+                writable: bool - if False, the grid is mapped read-only
+        Output:
+                a CellGrid
+        """
+        f = open(path, 'r+b' if writable else 'rb')
+        try:
+            access = mmap.ACCESS_WRITE if writable else mmap.ACCESS_READ
+            grid_map = mmap.mmap(f.fileno(), 0, access=access)
+            magic, version, _, width, height = HEADER.unpack_from(grid_map)
+            if magic != MAGIC or version != GRID_VERSION:
+                raise ValueError(f'{path} is not a version {GRID_VERSION} '
+                                 'cell grid file')
+            if len(grid_map) < HEADER.size + width*height*CELL_SIZE:
+                raise ValueError(f'{path} is truncated')
+        except Exception:
+            f.close()
+            raise
+        return cls(f, grid_map, width, height)
+
+    def close(self):
+        """ Unmaps and closes the grid file
+        """
+        self.map.close()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def offset(self, column: int, row: int) -> int:
+        """ Returns the byte offset of the cell at (column, row)
+        """
+        return HEADER.size + row*self.row_size + column*CELL_SIZE
+
+    def read_row(self, row: int, start: int = 0, stop: int = None) -> list:
+        """ Input:
+                row: int - the row to read
+                start: int - the first column to read
+                stop: int - one past the last column to read. Defaults to the
+                    width of the grid.
+        Output:
+                cells: list of (code_point, fg, bg, attrs) tuples
+        """
+        stop = self.width if stop is None else min(stop, self.width)
+        if stop <= start:
+            return []
+        values = _run_struct(stop - start).unpack_from(
+            self.map, self.offset(start, row))
+        # This groups the flat tuple of ints back into cells, 4 at a time
+        return list(zip(*repeat(iter(values), VALUES_PER_CELL)))
+
+    def read_rows(self, first_row: int = 0, last_row: int = None) -> list:
+        """ Returns the rows first_row up to (not including) last_row, as lists
+        of cells. Defaults to the whole grid.
+        """
+        last_row = self.height if last_row is None else last_row
+        return [self.read_row(row) for row in range(first_row, last_row)]
+
+    def write_row(self, column: int, row: int, cells: list):
+        """ Input:
+                column: int - the column of the first cell to write
+                row: int - the row to write to
+                cells: list of (code_point, fg, bg, attrs) tuples
+            Output:
+                Copies the cells into the grid. Anything that would fall
+                outside of the grid is clipped.
+        """
+        if not (0 <= row < self.height) or column >= self.width:
+            return
+        if column < 0:
+            # The part that's off the left edge of the screen
+            cells = cells[-column:]
+            column = 0
+        cells = cells[:self.width - column]
+        if not cells:
+            return
+        _run_struct(len(cells)).pack_into(
+            self.map, self.offset(column, row), *chain.from_iterable(cells))
+
+    def write_block(self, column: int, row: int, block: list):
+        """ Input:
+                column: int - the column of the upper left corner of the block
+                row: int - the row of the upper left corner of the block
+                block: list of lists of cells - the rows of the block
+            Output:
+                Copies the block into the grid, clipping anything that falls
+                outside of it.
+        """
+        for row_number, cells in enumerate(block, start=row):
+            if row_number >= self.height:
+                break
+            self.write_row(column, row_number, cells)
+
+    @contextmanager
+    def lock(self, column: int, row: int, width: int, height: int,
+             exclusive: bool = True):
+        """ Input:
+                column: int - the column of the upper left corner of the region
+                row: int - the row of the upper left corner of the region
+                width: int - the width of the region in columns
+                height: int - the height of the region in rows
+                exclusive: bool - if True, takes an exclusive (write) lock.
+                    Otherwise takes a shared (read) lock.
+            Output:
+                A context manager that holds the lock while the block runs.
+
+        Each row of the region is a contiguous run of bytes in the grid file,
+        so we lock one byte range per row with fcntl.lockf(). Locks are taken
+        from the top of the grid to the bottom, so two processes can't end up
+        waiting on each other.
+        Note that these are POSIX locks, which belong to the process: closing
+        ANY file object for the grid releases all of the process's locks on
+        it. So don't open the same grid twice in one process.
+        """
+        mode = fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH
+        start_column = max(column, 0)
+        stop_column = min(column + width, self.width)
+        ranges = []
+        if start_column < stop_column:
+            length = (stop_column - start_column)*CELL_SIZE
+            for row_number in range(max(row, 0), min(row + height,
+                                                      self.height)):
+                start = self.offset(start_column, row_number)
+                # Full-width rows are next to each other in the file, so they
+                # can share a single lock
+                if ranges and ranges[-1][0] + ranges[-1][1] == start:
+                    ranges[-1][1] += length
+                else:
+                    ranges.append([start, length])
+        locked = []
+        try:
+            for start, length in ranges:
+                fcntl.lockf(self.file, mode, length, start)
+                locked.append((start, length))
+            yield
+        finally:
+            for start, length in locked:
+                fcntl.lockf(self.file, fcntl.LOCK_UN, length, start)
+
+    def flush(self):
+        """ Flushes changes to the grid file
+        """
+        self.map.flush()
+
+def get_grid_path(term_file_path: str) -> str:
+    """ Returns the path of the cell grid that term_file_path is rendered from
+    """
+    return os.path.splitext(term_file_path)[0] + '.grid'
@@ -0,0 +1,188 @@
+""" Works out how many columns of the terminal a character takes up.
+
+Most characters take up one column, but:
+    - wide characters (CJK, most emoji, etc. - the ones with an East Asian
+      Width of 'W' or 'F') take up two
+    - combining marks (like the accent in 'e' + U+0301) and other zero-width
+      characters (U+200B, ZERO WIDTH SPACE, for instance) take up none
+If we counted those as one column each, every row after one of them would be
+out by a column or two, and regions would run into each other.
+
+A cell holds one character, so:
+    - a wide character takes up two cells: the character itself, followed by
+      a continuation cell (code point CONTINUATION) with the same style. The
+      continuation cell isn't drawn - the terminal moves the cursor two
+      columns when it draws the character.
+    - text is normalized to NFC first, so that accents are combined with the
+      letters they belong to wherever Unicode has a precomposed character for
+      them (which covers just about every accent you'll run into). Any
+      zero-width characters left after that are dropped.
+    - control characters (C0, DEL and C1) are replaced with spaces. The
+      terminal wouldn't draw them (if it didn't act on them), and a NUL would
+      look just like a continuation cell. They're still counted as one
+      column each, so nothing after them moves.
+
+Calling unicodedata for every character would be too slow for the
+tokenizer, so the widths are looked up in a table of ranges instead
+(utilities/width_table.py). The table is generated from unicodedata by
+write_width_table(), and only needs regenerating for a new version of
+Unicode:
+    python -c 'from utilities.char_width import write_width_table; \\
+        write_width_table()'
+Text that's all ASCII (which is most of it) never gets looked up at all.
+"""
+import os
+import unicodedata
+from array import array
+from bisect import bisect_right
+from utilities.width_table import WIDE, ZERO_WIDTH
+
+# The code point of the cell that follows a wide character
+CONTINUATION = 0
+
+# Everything below this takes up one column (the control characters do too,
+# once they've been replaced with spaces)
+_FIRST_SPECIAL = 0x300
+
+# For str.translate(): the C0 control characters, DEL, and the C1 control
+# characters, each replaced with a space
+_CONTROLS_TO_SPACES = dict.fromkeys([*range(0x20), *range(0x7f, 0xa0)], ' ')
+
+
+def _pack_ranges():
+    """ Merges the ranges from the width table into three arrays (range
+    starts, range ends, and widths), sorted by start, for bisect to search
+    """
+    ranges = sorted([(start, end, 0) for start, end in ZERO_WIDTH]
+                    + [(start, end, 2) for start, end in WIDE])
+    return (array('I', [r[0] for r in ranges]),
+            array('I', [r[1] for r in ranges]),
+            bytes(r[2] for r in ranges))
+
+_STARTS, _ENDS, _WIDTHS = _pack_ranges()
+# The first code point that can be wide. Anything lower is 0 or 1 columns.
+FIRST_WIDE = WIDE[0][0] if WIDE else 0x110000
+
+
+def char_width(code_point: int) -> int:
+    """ Returns the number of columns (0, 1 or 2) a character takes up
+    """
+    if code_point < _FIRST_SPECIAL:
+        return 1
+    i = bisect_right(_STARTS, code_point) - 1
+    if i >= 0 and code_point <= _ENDS[i]:
+        return _WIDTHS[i]
+    return 1
+
+def replace_controls(text: str) -> str:
+    """ Returns 'text' with any control characters replaced with spaces
+    """
+    # isprintable() is quick, and True for nearly everything we're given
+    if text.isprintable():
+        return text
+    return text.translate(_CONTROLS_TO_SPACES)
+
+def column_code_points(text: str) -> list:
+    """ Input:
+            text: str - some text (without escape sequences)
+        Output:
+            code_points: list of ints - one per column the text takes up: each
+                wide character is followed by CONTINUATION, zero-width
+                characters are left out, and control characters are spaces
+    """
+    text = replace_controls(text)
+    if text.isascii():
+        return list(map(ord, text))
+    code_points = []
+    append = code_points.append
+    for char in unicodedata.normalize('NFC', text):
+        code_point = ord(char)
+        if code_point < _FIRST_SPECIAL:
+            append(code_point)
+            continue
+        width = char_width(code_point)
+        if width == 1:
+            append(code_point)
+        elif width == 2:
+            append(code_point)
+            append(CONTINUATION)
+    return code_points
+
+def text_width(text: str) -> int:
+    """ Returns the number of columns some text (without escape sequences)
+    takes up
+    """
+    if text.isascii():
+        return len(text)
+    return len(column_code_points(text))
+
+def fix_wide_cells(cells: list) -> list:
+    """ Input:
+            cells: list of (code_point, fg, bg, attrs) tuples - a row of cells
+        Output:
+            the same row, with any wide character that's lost its continuation
+            cell, and any continuation cell that's lost its wide character,
+            replaced with a space. That happens when a text block is written
+            over half of a wide character.
+    """
+    cells = list(cells)
+    last = len(cells) - 1
+    for i, cell in enumerate(cells):
+        code_point = cell[0]
+        if code_point == CONTINUATION:
+            if i == 0 or char_width(cells[i - 1][0]) != 2:
+                cells[i] = (32,) + cell[1:]
+        elif code_point >= FIRST_WIDE and char_width(code_point) == 2:
+            if i == last or cells[i + 1][0] != CONTINUATION:
+                cells[i] = (32,) + cell[1:]
+    return cells
+
+def build_width_ranges():
+    """ Output:
+            (zero_width, wide): lists of (first, last) code point ranges of
+                the zero-width and the wide characters, according to the
+                unicodedata module
+    """
+    zero_width = []
+    wide = []
+    for code_point in range(_FIRST_SPECIAL, 0x110000):
+        char = chr(code_point)
+        category = unicodedata.category(char)
+        if category in ('Mn', 'Me', 'Cf') or 0x1160 <= code_point <= 0x11ff:
+            # Hangul medial vowels and final consonants join onto the
+            # syllable before them
+            ranges = zero_width
+        elif unicodedata.east_asian_width(char) in ('W', 'F') \
+                and category != 'Cn':
+            ranges = wide
+        else:
+            continue
+        if ranges and ranges[-1][1] == code_point - 1:
+            ranges[-1][1] = code_point
+        else:
+            ranges.append([code_point, code_point])
+    return zero_width, wide
+
+def write_width_table(path: str = None):
+    """ Regenerates utilities/width_table.py (or writes the table to 'path')
+    """
+    if path is None:
+        path = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                            'width_table.py')
+    zero_width, wide = build_width_ranges()
+    lines = [
+        '""" The ranges of zero-width and wide (two column) characters, for',
+        'utilities/char_width.py. Generated by char_width.write_width_table()',
+        f'from Unicode {unicodedata.unidata_version} - don\'t edit it by hand.',
+        '"""',
+        f'UNICODE_VERSION = {unicodedata.unidata_version!r}',
+        '',
+    ]
+    for name, ranges in (('ZERO_WIDTH', zero_width), ('WIDE', wide)):
+        lines.append(f'{name} = (')
+        for start, end in ranges:
+            lines.append(f'    (0x{start:04x}, 0x{end:04x}),')
+        lines.append(')')
+        lines.append('')
+    with open(path, 'w') as f:
+        f.write('\n'.join(lines))
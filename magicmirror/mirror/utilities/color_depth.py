@@ -0,0 +1,263 @@
+""" Converts 24-bit colors to the 256-color or 16-color palettes, for
+terminals that can't display 24-bit color.
+
+The Raspberry Pi OS Lite text console (the Linux console) only has 16 colors.
+It does its best with '38;2;r;g;b', but that's the longest escape sequence
+there is, and it's wasted on a terminal that's going to round it off anyway.
+So when the terminal can't do better, term.txt is written with '38;5;n'
+(256 colors) or the plain 30-37/90-97 codes (16 colors) instead.
+
+The cell grid always keeps the full 24-bit colors - the conversion happens
+when the cells are encoded (see utilities/sgr_encoder.py), so changing the
+color depth doesn't lose anything.
+
+The color depth is one of:
+    - 'truecolor': colors are left alone
+    - '256': colors are mapped to the 256-color palette
+    - '16': colors are mapped to the 16 basic colors
+It's set by 'color_depth' in the [display] section of magicmirror/config. If
+it isn't set (or it's set to 'auto'), make_term_file.py works it out from the
+terminal when the mirror starts up and saves it next to term.txt. It has to be
+worked out then, because the cron jobs don't run in the terminal, so they
+can't tell what it's capable of.
+
+Rather than searching the palette for the closest color to each cell, we
+look it up in a table. The table has an entry for every color with 5 bits per
+component (32768 of them), which is plenty - the palettes are a lot coarser
+than that. It's built the first time it's needed.
+"""
+import os
+import configparser
+from functools import lru_cache
+from utilities.atomic_file import atomic_write
+from utilities.sgr_tokenizer import PALETTE_COLOR, RGB_COLOR
+
+TRUECOLOR = 'truecolor'
+COLORS_256 = '256'
+COLORS_16 = '16'
+COLOR_DEPTHS = (TRUECOLOR, COLORS_256, COLORS_16)
+
+# The levels used by each component of the 6x6x6 color cube (entries 16-231
+# of the 256-color palette)
+_CUBE_LEVELS = (0, 95, 135, 175, 215, 255)
+# The 16 basic colors, the way the Linux console displays them (the standard
+# VGA palette)
+_BASIC_COLORS = (
+    (0, 0, 0), (170, 0, 0), (0, 170, 0), (170, 85, 0),
+    (0, 0, 170), (170, 0, 170), (0, 170, 170), (170, 170, 170),
+    (85, 85, 85), (255, 85, 85), (85, 255, 85), (255, 255, 85),
+    (85, 85, 255), (255, 85, 255), (85, 255, 255), (255, 255, 255))
+
+_LUT_BITS = 5
+
+# This module lives in magicmirror/mirror/utilities
+_MIRROR_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_CONFIG_PATH = os.path.join(os.path.dirname(_MIRROR_DIR), 'config')
+
+
+def palette_rgb(n: int) -> tuple:
+    """ Returns the (r, g, b) value of entry n of the 256-color palette
+    """
+    if n < 16:
+        return _BASIC_COLORS[n]
+    if n < 232:
+        n -= 16
+        return (_CUBE_LEVELS[n // 36], _CUBE_LEVELS[(n // 6) % 6],
+                _CUBE_LEVELS[n % 6])
+    level = 8 + 10*(n - 232)
+    return level, level, level
+
+def _distance(a: tuple, b: tuple) -> int:
+    """ The squared distance between two colors. Green counts for the most
+    and blue for the least, which is roughly how our eyes see it.
+    """
+    return 3*(a[0] - b[0])**2 + 4*(a[1] - b[1])**2 + 2*(a[2] - b[2])**2
+
+def _nearest(rgb: tuple, candidates) -> int:
+    """ Returns the palette entry from 'candidates' that's closest to 'rgb'
+    """
+    return min(candidates, key=lambda n: _distance(rgb, palette_rgb(n)))
+
+def _lut_index(color: int) -> int:
+    """ Returns the position of an RGB color id in the lookup tables
+    """
+    shift = 8 - _LUT_BITS
+    r = (color >> (16 + shift)) & 0x1f
+    g = (color >> (8 + shift)) & 0x1f
+    b = (color >> shift) & 0x1f
+    return (r << 2*_LUT_BITS) | (g << _LUT_BITS) | b
+
+@lru_cache(maxsize=None)
+def _lut_256() -> bytes:
+    """ The lookup table that maps colors to entries 16-255 of the 256-color
+    palette (entries 0-15 are left out, since terminals don't agree on what
+    they look like).
+    """
+    size = 1 << _LUT_BITS
+    shift = 8 - _LUT_BITS
+    # The middle of the range of colors each entry stands for
+    values = [(i << shift) | (1 << (shift - 1)) for i in range(size)]
+    # Each component of the cube can be matched on its own, so we only
+    # need to do that once per value
+    cube = []
+    for value in values:
+        index = min(range(6), key=lambda i: abs(_CUBE_LEVELS[i] - value))
+        cube.append((index, _CUBE_LEVELS[index]))
+    table = bytearray(size**3)
+    position = 0
+    for r in values:
+        r_index, r_level = cube[r >> shift]
+        for g in values:
+            g_index, g_level = cube[g >> shift]
+            for b in values:
+                b_index, b_level = cube[b >> shift]
+                rgb = (r, g, b)
+                best = 16 + 36*r_index + 6*g_index + b_index
+                best_distance = _distance(rgb, (r_level, g_level, b_level))
+                # The gray ramp might be closer than the cube
+                gray = min(max(round(((r + g + b)/3 - 8)/10), 0), 23)
+                level = 8 + 10*gray
+                if _distance(rgb, (level, level, level)) < best_distance:
+                    best = 232 + gray
+                table[position] = best
+                position += 1
+    return bytes(table)
+
+@lru_cache(maxsize=None)
+def _palette_to_16() -> bytes:
+    """ Maps each entry of the 256-color palette to the closest basic color
+    """
+    return bytes(n if n < 16 else _nearest(palette_rgb(n), range(16))
+                 for n in range(256))
+
+@lru_cache(maxsize=None)
+def _lut_16() -> bytes:
+    """ The lookup table that maps colors to the 16 basic colors. Built from
+    the 256-color table, which is a lot quicker than searching for each color
+    and looks just about the same.
+    """
+    return _lut_256().translate(_palette_to_16())
+
+def downconvert(color: int, color_depth: str) -> int:
+    """ Input:
+            color: int - a color id (see utilities/sgr_tokenizer.py)
+            color_depth: str - one of COLOR_DEPTHS
+        Output:
+            the color id of the closest color the terminal can display
+    """
+    if color_depth == TRUECOLOR:
+        return color
+    if color & RGB_COLOR:
+        if color_depth == COLORS_256:
+            return PALETTE_COLOR | _lut_256()[_lut_index(color)]
+        return PALETTE_COLOR | _lut_16()[_lut_index(color)]
+    if color & PALETTE_COLOR and color_depth == COLORS_16:
+        return PALETTE_COLOR | _palette_to_16()[color & 0xff]
+    return color
+
+def downconvert_row(cells: list, color_depth: str) -> list:
+    """ Input:
+            cells: list of (code_point, fg, bg, attrs) tuples - a row of cells
+            color_depth: str - one of COLOR_DEPTHS
+        Output:
+            the row, with the colors converted to ones the terminal can display
+    """
+    if color_depth == TRUECOLOR:
+        return cells
+    # Most rows only use a handful of colors
+    converted = {0: 0}
+    out = []
+    for code_point, fg, bg, attrs in cells:
+        new_fg = converted.get(fg)
+        if new_fg is None:
+            new_fg = converted[fg] = downconvert(fg, color_depth)
+        new_bg = converted.get(bg)
+        if new_bg is None:
+            new_bg = converted[bg] = downconvert(bg, color_depth)
+        out.append((code_point, new_fg, new_bg, attrs))
+    return out
+
+def probe_color_depth(environ=None) -> str:
+    """ Input:
+            environ: dict - the environment variables. Defaults to os.environ
+        Output:
+            the color depth the terminal we're running in can display, as best
+            we can tell from $COLORTERM and $TERM
+    """
+    environ = os.environ if environ is None else environ
+    colorterm = environ.get('COLORTERM', '').lower()
+    term = environ.get('TERM', '').lower()
+    if colorterm in ('truecolor', '24bit') or 'direct' in term:
+        return TRUECOLOR
+    if '256color' in term:
+        return COLORS_256
+    # This includes the Linux console (TERM=linux)
+    return COLORS_16
+
+def get_depth_path(term_file_path: str) -> str:
+    """ Returns the path of the file that holds the color depth that was
+    probed when the mirror started up
+    """
+    return term_file_path + '.depth'
+
+def save_probed_color_depth(term_file_path: str) -> str:
+    """ Input:
+            term_file_path: str - the path of term.txt
+        Output:
+            Works out the color depth of the terminal we're running in, saves
+            it next to term.txt, and returns it.
+    """
+    color_depth = probe_color_depth()
+    atomic_write(get_depth_path(term_file_path), color_depth.encode() + b'\n')
+    _get_color_depth.cache_clear()
+    return color_depth
+
+def read_configured_color_depth(config_path: str = _CONFIG_PATH) -> str:
+    """ Returns the color depth from the [display] section of the config file,
+    or None if it isn't set (or is set to 'auto').
+    """
+    config = configparser.ConfigParser()
+    config.read(config_path)
+    color_depth = config.get('display', 'color_depth', fallback='auto')
+    color_depth = color_depth.strip().lower()
+    if color_depth == 'auto':
+        return None
+    if color_depth not in COLOR_DEPTHS:
+        raise ValueError(
+            f'Invalid color_depth {color_depth!r} in {config_path}. '
+            f'Expected one of: auto, {", ".join(COLOR_DEPTHS)}')
+    return color_depth
+
+def get_color_depth(term_file_path: str = None) -> str:
+    """ Input:
+            term_file_path: str - the path of term.txt. Defaults to term.txt in
+                the magicmirror/mirror directory.
+        Output:
+            the color depth term.txt should be written with. In order of
+            preference, that's:
+                - the one set in magicmirror/config
+                - the one probed by make_term_file.py at startup, for this
+                  term.txt
+                - whatever we can tell about the terminal we're running in
+    """
+    if term_file_path is None:
+        term_file_path = os.path.join(_MIRROR_DIR, 'term.txt')
+    # Each term.txt has its own color depth, so the cache is keyed on the
+    # full path (and the same file always has the same key)
+    return _get_color_depth(os.path.abspath(term_file_path))
+
+@lru_cache(maxsize=None)
+def _get_color_depth(term_file_path: str) -> str:
+    """ Does the work for get_color_depth()
+    """
+    color_depth = read_configured_color_depth()
+    if color_depth:
+        return color_depth
+    try:
+        with open(get_depth_path(term_file_path)) as f:
+            color_depth = f.read().strip()
+    except FileNotFoundError:
+        pass
+    if color_depth in COLOR_DEPTHS:
+        return color_depth
+    return probe_color_depth()
@@ -1,6 +1,36 @@
 """ The LinearColorTracker class uses the ColorComponent class to track red,
 green, and blue components moving with both horizontal and vertical gradients.
+
+Both of them can be used in two ways:
+    - stepping through them with __next__() (and newline()), one character
+      at a time, which is what color_text.py does
+    - asking for the color at a given position with at(), without stepping
+      through everything before it. That lets us work out the colors for
+      just part of a text box (i.e. a region that needs re-rendering).
+at() gives exactly the same values that stepping would.
 """
+import math
+
+def fold_step(n, low: int, high: int, start: int = 0, step_inc: int = 1):
+    """ Input:
+            n: int - how many times __next__() has been called
+            low, high: ints - the first steps that are out of range below and
+                above the start (see ColorComponent.bounds())
+            start: int - the step before the first call
+            step_inc: int - the direction the step was going in (1 or -1)
+        Output:
+            the step a bouncing ColorComponent is at after n calls.
+
+    Bouncing, the step goes up to 'high' (where it flips), down to 'low',
+    back up to 'high', and so on - a triangle wave with a period of
+    2 * (high - low). So we fold n into that. This only uses arithmetic, so it
+    works on NumPy arrays too (see utilities/gradient_field.py).
+    """
+    span = high - low
+    period = 2 * span
+    offset = start - low if step_inc > 0 else period - (start - low)
+    position = (offset + n) % period
+    return low + span - abs(position - span)
 
 class ColorComponent:
     """ This represents the magnitude of a color component (red, green, or
@@ -127,6 +157,87 @@ class ColorComponent:
         self.step += self.step_inc
         return val
 
+    def out_of_range(self, step: int, value: int = None) -> bool:
+        """ Returns True if the magnitude at 'step' (before it's clamped) is
+        outside the allowed range, i.e. if val() would clamp it and flip_step().
+        """
+        val = (self.value if value is None else value) + (step * self.inc)
+        return val > self.max_val or val < self.min_val
+
+    def _first_out_of_range(self, direction: int, value: int,
+                            limit: int) -> int:
+        """ Input:
+                direction: int - 1 or -1
+                value: int - the magnitude at step 0
+                limit: int - the furthest step we care about
+            Output:
+                the first step (counting away from 0 in 'direction') whose
+                magnitude is out of range, or limit + 1 (in 'direction') if
+                it's further away than 'limit'
+        """
+        # The magnitude changes by abs(inc) per step, so it leaves the range
+        # after about (distance to the edge) / abs(inc) steps. Floating point
+        # rounding can put the real answer a step either side of that, so we
+        # check it with the same arithmetic val() uses.
+        # With a tiny inc that's a huge number of steps, and once the steps
+        # are too big for a float to tell n and n + 1 apart, checking them
+        # one at a time would never finish - hence the limit.
+        if (direction > 0) == (self.inc > 0):
+            distance = self.max_val - value
+        else:
+            distance = value - self.min_val
+        steps = max(min(int(math.floor(distance / abs(self.inc))) + 1,
+                        limit + 1), 1)
+        while steps > 1 and self.out_of_range(direction * (steps - 1), value):
+            steps -= 1
+        while steps <= limit and not self.out_of_range(direction * steps,
+                                                       value):
+            steps += 1
+        return direction * steps
+
+    def bounds(self, limit: int, value: int = None) -> tuple:
+        """ Input:
+                limit: int - the furthest step (either side of 0) that will
+                    be reached. A bound further away than that can't make a
+                    difference, so we don't go looking for it.
+                value: int - the magnitude at step 0. Defaults to self.value.
+            Output:
+                (low, high): the first steps that are out of range below and
+                    above step 0 - the steps a bouncing component flips at
+                    (or -(limit + 1) and limit + 1, if they're out of reach)
+        """
+        if value is None:
+            value = self.value
+        return (self._first_out_of_range(-1, value, limit),
+                self._first_out_of_range(1, value, limit))
+
+    def at(self, n: int, value: int = None) -> int:
+        """ Input:
+                n: int - how many times __next__() has been called since the
+                    start (or since the last change())
+                value: int - the magnitude at step 0. Defaults to self.value.
+            Output:
+                val: int - what the next call to __next__() would return, i.e.
+                    the magnitude after n steps.
+
+        This doesn't change the component, and it doesn't step through
+        anything, so it takes the same time for any n.
+        Without bounce, the step after n calls is just n. With bounce, it's
+        folded back and forth between the steps where it flips (see
+        fold_step()).
+        """
+        if value is None:
+            value = self.value
+        step = n
+        if self.bounce and self.inc:
+            step = fold_step(n, *self.bounds(n, value))
+        val = value + (step * self.inc)
+        if val > self.max_val:
+            val = self.max_val
+        if val < self.min_val:
+            val = self.min_val
+        return int(round(val))
+
 class LinearColorTracker:
     """ This class uses the ColorComponent class to track red, green, and blue
     components moving with horizontal and vertical gradients specified by the
@@ -184,6 +295,23 @@ class LinearColorTracker:
         r, g, b = (color.__next__() for color in self.horiz)
         return r, g, b
 
+    def at(self, x: int, y: int) -> tuple:
+        """ Input:
+                x: int - the column
+                y: int - the row
+            Output:
+                a tuple of 3 ints - the color of the character at (x, y), i.e.
+                the same thing stepping a new tracker through the text box
+                (with __next__() for each character and newline() for each
+                row) would give for that character.
+        The tracker isn't changed, so at() can be called in any order.
+        """
+        # Each row starts where the vertical component is after y steps, and
+        # then moves along the horizontal component from there
+        r, g, b = (horiz_color.at(x, vert_color.at(y))
+                   for vert_color, horiz_color in zip(self.vert, self.horiz))
+        return r, g, b
+
     def newline(self):
         """ We're using this for text.
         If we have only horizontal gradients, it's expected that all the text
@@ -197,3 +325,12 @@ class LinearColorTracker:
         for vert_color, horiz_color in zip(self.vert, self.horiz):
             vert_inc = vert_color.__next__()
             horiz_color.change(vert_inc)
+
+    def skip_rows(self, rows: int):
+        """ Moves the tracker on by 'rows' rows, leaving it in the same state
+        as stepping through every character of those rows would (newline()
+        resets the horizontal components, so only the vertical ones need to
+        be stepped).
+        """
+        for _ in range(rows):
+            self.newline()
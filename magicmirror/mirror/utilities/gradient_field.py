@@ -0,0 +1,123 @@
+""" Works out the colors of a whole gradient at once with NumPy, instead of
+one character at a time.
+
+LinearColorTracker (utilities/color_tracker.py) steps three ColorComponents
+for every character, each one with its own clamping and bouncing logic in
+Python. That's fine for a clock, but a full screen gradient is tens of
+thousands of steps. None of it actually needs to be done one step at a time,
+though:
+    - without bounce, a component's value at column n is just
+      value + n * inc, clamped between min_val and max_val
+    - with bounce, the step goes back and forth between the steps where it
+      flips, which is a triangle wave. ColorComponent.bounds() finds where
+      it flips, and fold_step() (both in utilities/color_tracker.py) folds
+      the column number into the wave - which works just as well for every
+      column at once.
+Each row starts where the vertical tracker says it does (which is the same
+kind of walk, one step per row), so the whole width x height box comes out of
+a handful of array operations. The arithmetic is done the same way
+ColorComponent.val() does it (in float64, then clamped, then rounded half to
+even), so the colors are exactly the same as the ones you'd get from stepping
+the tracker.
+
+NumPy is optional - it's a big install on a Pi Zero. If it isn't there,
+HAVE_NUMPY is False and color_text.py steps the trackers like it always has.
+"""
+try:
+    import numpy as np
+    HAVE_NUMPY = True
+except ImportError:
+    np = None
+    HAVE_NUMPY = False
+
+from utilities.color_tracker import fold_step
+from utilities.sgr_tokenizer import RGB_COLOR
+
+_COLOR_MASK = (1 << 25) - 1
+
+
+def _walk(component, values, step: int, step_inc: int, count: int):
+    """ Input:
+            component: ColorComponent - the settings (inc, min_val, max_val
+                and bounce) to walk with
+            values: list of ints - the 'value' of the ColorComponent, one per
+                walk (i.e. one per row)
+            step, step_inc: ints - the ColorComponent's current step and
+                direction
+            count: int - the number of times __next__() would be called
+        Output:
+            2D int array, with one row per value - the magnitudes __next__()
+            would return
+    """
+    inc, min_val, max_val = component.inc, component.min_val, component.max_val
+    if count <= 0:
+        return np.zeros((len(values), 0), dtype=np.int64)
+    n = np.arange(count)
+    if not component.bounce or not inc:
+        steps = (step + step_inc * n)[None, :]
+    else:
+        # The values are whole numbers in a small range, so lots of rows
+        # share the same bounds. No step further than 'count' from the
+        # current one can be reached.
+        limit = abs(step) + count
+        bounds = {value: component.bounds(limit, value)
+                  for value in set(values)}
+        low, high = np.array([bounds[value] for value in values],
+                             dtype=np.int64).T
+        steps = fold_step(n[None, :], low[:, None], high[:, None], step,
+                          step_inc)
+    magnitudes = np.asarray(values, dtype=np.float64)[:, None] + steps * inc
+    return np.rint(np.clip(magnitudes, min_val, max_val)).astype(np.int64)
+
+def tracker_field(tracker, width: int, height: int):
+    """ Input:
+            tracker: LinearColorTracker - a tracker, in the state it's in
+                before apply_gradient() starts stepping it
+            width, height: ints - the size of the box (in cells)
+        Output:
+            (red, green, blue): 2D int arrays (height x width) - the colors
+                stepping the tracker through the box would give. The tracker
+                itself isn't changed.
+    """
+    components = []
+    for horiz, vert in zip(tracker.horiz, tracker.vert):
+        # The first row carries on from wherever the tracker is now. Every
+        # row after that starts from the next step of the vertical
+        # component, with the horizontal step reset (see newline()).
+        first = _walk(horiz, [horiz.value], horiz.step, horiz.step_inc, width)
+        if height > 1:
+            starts = _walk(vert, [vert.value], vert.step, vert.step_inc,
+                           height - 1)[0].tolist()
+            rest = _walk(horiz, starts, 0, 1, width)
+            components.append(np.concatenate((first, rest)))
+        else:
+            components.append(first[:height])
+    return tuple(components)
+
+def color_ids(red, green, blue, background: bool = False):
+    """ Input:
+            red, green, blue: int arrays - the output of tracker_field()
+            background: bool - if True, black is left as the default color
+                (the way format_rgb() leaves out a black background)
+        Output:
+            an int array of color ids (see utilities/sgr_tokenizer.py)
+    """
+    ids = RGB_COLOR | (red << 16) | (green << 8) | blue
+    if background:
+        ids[(red | green | blue) == 0] = 0
+    return ids
+
+def style_index(fg_ids, bg_ids):
+    """ Input:
+            fg_ids, bg_ids: 2D arrays of color ids - the output of color_ids()
+                for the foreground and the background
+        Output:
+            styles: list of (fg, bg) tuples - each combination of colors that
+                shows up, once
+            index: list of lists of ints - for each cell, the position of its
+                colors in 'styles'
+    """
+    # Color ids fit in 25 bits, so a pair of them fits in one int64
+    keys, inverse = np.unique((fg_ids << 25) | bg_ids, return_inverse=True)
+    styles = [(key >> 25, key & _COLOR_MASK) for key in keys.tolist()]
+    return styles, inverse.reshape(fg_ids.shape).tolist()
@@ -0,0 +1,165 @@
+""" Gradients that are worked out ahead of time as lookup tables, rather than
+stepped through one character at a time like LinearColorTracker.
+
+A gradient here is made of two parts:
+    - a position grid: for every cell of the text box, a position along the
+      gradient (an int). What that is depends on the direction:
+        horizontal:         the column
+        vertical:           the row
+        diagonal:           column + row (top left to bottom right)
+        reverse-diagonal:   (width - 1 - column) + row (top right to bottom
+                            left)
+        radial:             the distance from the center point, in columns.
+                            Characters are about twice as tall as they are
+                            wide, so a row counts as two columns - otherwise
+                            the circles would come out as tall ovals.
+    - a color table: one color for each position.
+The color tables are:
+    - stops: an even blend between any number of colors (see stops_table())
+    - sine: a sine wave going back and forth between two colors, with a
+      given period (see sine_table())
+
+Both parts only depend on the gradient's settings and the size of the text
+box, so they're cached (see gradient_map()). Once they're built, coloring a
+cell is just two lookups - table[grid[row][column]] - with no floating point
+math at all, which matters on a Pi Zero.
+"""
+import math
+from functools import lru_cache
+
+DIRECTIONS = ('horizontal', 'vertical', 'diagonal', 'reverse-diagonal',
+              'radial')
+KINDS = ('stops', 'sine')
+
+# Characters are roughly this many times as tall as they are wide
+CELL_ASPECT = 2
+
+
+@lru_cache(maxsize=32)
+def position_grid(direction: str, width: int, height: int,
+                  center: tuple = None):
+    """ Input:
+            direction: str - one of DIRECTIONS
+            width, height: ints - the size of the text box
+            center: tuple of 2 numbers - the (column, row) of the center of a
+                radial gradient. Defaults to the middle of the text box.
+        Output:
+            (grid, length): grid is a tuple of rows, each a tuple of ints - the
+                position of each cell along the gradient. length is the number
+                of positions (one more than the largest position).
+    """
+    if direction == 'horizontal':
+        row = tuple(range(width))
+        grid = (row,) * height
+    elif direction == 'vertical':
+        grid = tuple((y,) * width for y in range(height))
+    elif direction == 'diagonal':
+        grid = tuple(tuple(range(y, y + width)) for y in range(height))
+    elif direction == 'reverse-diagonal':
+        grid = tuple(tuple(range(y + width - 1, y - 1, -1))
+                     for y in range(height))
+    elif direction == 'radial':
+        if center is None:
+            center = ((width - 1) / 2, (height - 1) / 2)
+        center_x, center_y = center
+        grid = tuple(
+            tuple(int(round(math.hypot(x - center_x,
+                                       (y - center_y) * CELL_ASPECT)))
+                  for x in range(width))
+            for y in range(height))
+    else:
+        raise ValueError(f'Unknown gradient direction {direction!r}. '
+                         f'Expected one of: {", ".join(DIRECTIONS)}')
+    length = max((max(row) for row in grid if row), default=-1) + 1
+    return grid, length
+
+@lru_cache(maxsize=32)
+def stops_table(stops: tuple, length: int) -> tuple:
+    """ Input:
+            stops: tuple of (r, g, b) tuples - the colors to blend between, in
+                order. The first one is at position 0, the last one at the last
+                position, and the rest are spaced out evenly in between.
+            length: int - the number of positions
+        Output:
+            a tuple of 'length' (r, g, b) tuples
+    """
+    if len(stops) == 1 or length < 2:
+        return (tuple(stops[0]),) * length
+    segments = len(stops) - 1
+    table = []
+    for i in range(length):
+        t = i * segments / (length - 1)
+        # Which pair of stops we're between, and how far along
+        k = min(int(t), segments - 1)
+        fraction = t - k
+        start, end = stops[k], stops[k + 1]
+        table.append(tuple(int(round(a + (b - a) * fraction))
+                           for a, b in zip(start, end)))
+    return tuple(table)
+
+@lru_cache(maxsize=32)
+def sine_table(color_1: tuple, color_2: tuple, period: int,
+               offset: float = 0) -> tuple:
+    """ Input:
+            color_1, color_2: (r, g, b) tuples - the colors the wave goes
+                between
+            period: int - the number of positions before the wave repeats
+            offset: float - how far the wave is shifted to the left, in units
+                of a quarter of a period. Some sample values:
+                    offset = 0: color_1 at position 0, color_2 halfway through
+                    offset = 1: halfway between the two at position 0, heading
+                        towards color_2
+                    offset = 2: color_2 at position 0, color_1 halfway through
+                    offset = 3: halfway between the two at position 0, heading
+                        towards color_1
+        Output:
+            a tuple of 'period' (r, g, b) tuples - one period of the wave
+    """
+    if period < 1:
+        raise ValueError(f'The period of a sine gradient must be at least 1, '
+                         f'not {period}')
+    table = []
+    for step in range(period):
+        # 1 at color_1, -1 at color_2
+        wave = math.sin(2 * math.pi * step / period
+                        + (math.pi / 2) * (offset + 1))
+        table.append(tuple(
+            int(round((a + b) / 2 + (a - b) / 2 * wave))
+            for a, b in zip(color_1, color_2)))
+    return tuple(table)
+
+@lru_cache(maxsize=32)
+def gradient_map(kind: str, direction: str, colors: tuple, width: int,
+                 height: int, period: int = None, offset: float = 0,
+                 center: tuple = None):
+    """ Input:
+            kind: str - 'stops' or 'sine' (see KINDS)
+            direction: str - one of DIRECTIONS
+            colors: tuple of (r, g, b) tuples - the stops (for 'stops'), or
+                the two colors the wave goes between (for 'sine')
+            width, height: ints - the size of the text box
+            period, offset: the wave's period and offset (see sine_table()).
+                Only used for 'sine'.
+            center: the center of a radial gradient (see position_grid())
+        Output:
+            (table, grid): grid is the position of each cell (see
+                position_grid()), and table[position] is the color for that
+                position. So the color of the cell at (x, y) is
+                table[grid[y][x]].
+
+    All the arguments have to be hashable (tuples, not lists), since the
+    result is cached.
+    """
+    grid, length = position_grid(direction, width, height, center)
+    if kind == 'stops':
+        table = stops_table(colors, length)
+    elif kind == 'sine':
+        if len(colors) != 2:
+            raise ValueError('A sine gradient needs exactly two colors')
+        wave = sine_table(colors[0], colors[1], period, offset)
+        # Repeat the wave so that every position has its own entry
+        table = tuple(wave[i % period] for i in range(length))
+    else:
+        raise ValueError(f'Unknown gradient kind {kind!r}. '
+                         f'Expected one of: {", ".join(KINDS)}')
+    return table, grid
@@ -0,0 +1,118 @@
+""" A tiny wrapper around Linux's inotify, using ctypes (so there's nothing
+extra to install).
+
+inotify lets us ask the kernel to tell us when a file changes, instead of
+checking it over and over again. Waiting on an inotify file descriptor costs
+nothing, so a process that's waiting for term.txt to change uses no CPU at
+all until it does.
+
+example:
+    with Inotify() as notify:
+        notify.add_watch('/some/dir', IN_CLOSE_WRITE | IN_MOVED_TO)
+        for wd, mask, cookie, name in notify.read_events():
+            ...
+"""
+import os
+import select
+import struct
+import ctypes
+import ctypes.util
+
+# From <sys/inotify.h>
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_DELETE = 0x00000200
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+
+_EVENT = struct.Struct('iIII')
+
+_libc = None
+
+
+def _get_libc():
+    """ Loads libc the first time it's needed
+    """
+    global _libc
+    if _libc is None:
+        _libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6',
+                            use_errno=True)
+        _libc.inotify_init1.argtypes = [ctypes.c_int]
+        _libc.inotify_add_watch.argtypes = [
+            ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+    return _libc
+
+def inotify_available() -> bool:
+    """ Returns True if we can use inotify on this system
+    """
+    try:
+        libc = _get_libc()
+        return hasattr(libc, 'inotify_init1')
+    except OSError:
+        return False
+
+class Inotify:
+    """ An inotify instance. Can be used as a context manager, which closes it
+    when the block exits.
+    """
+    def __init__(self):
+        fd = _get_libc().inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if fd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno))
+        self.fd = fd
+
+    def add_watch(self, path: str, mask: int) -> int:
+        """ Input:
+                path: str - the file or directory to watch
+                mask: int - the events we want to hear about, i.e.
+                    IN_CLOSE_WRITE | IN_MOVED_TO
+            Output:
+                wd: int - the watch descriptor (it's included in each event)
+        """
+        wd = _get_libc().inotify_add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno), path)
+        return wd
+
+    def read_events(self, timeout: float = None) -> list:
+        """ Input:
+                timeout: float - how long (in seconds) to wait for something to
+                    happen. If None, waits forever.
+            Output:
+                events: list of (wd, mask, cookie, name) tuples. Empty if the
+                    timeout ran out before anything happened. 'name' is the
+                    name of the file within a watched directory (or '' if the
+                    event is about the watched path itself).
+        """
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        try:
+            data = os.read(self.fd, 64*1024)
+        except BlockingIOError:
+            return []
+        events = []
+        position = 0
+        while position < len(data):
+            wd, mask, cookie, length = _EVENT.unpack_from(data, position)
+            position += _EVENT.size
+            name = data[position:position + length].rstrip(b'\0')
+            position += length
+            events.append((wd, mask, cookie, os.fsdecode(name)))
+        return events
+
+    def close(self):
+        """ Closes the inotify file descriptor
+        """
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,226 @@
+""" Layers let regions of the screen overlap without clobbering each other.
+
+Each config section gets its own layer, which holds the last text block it
+sent (as rows of cells) and where that block goes on the screen. Every layer
+has a z-index - layers with a higher z-index are drawn on top. Layers with the
+same z-index are stacked in the order they were last updated, so if nobody
+sets a z-index, the last region written wins, the way it always has.
+
+A layer can be partly transparent, so that it can be drawn on top of
+something else (a clock on top of a background, say). Its 'transparent'
+setting is one of:
+    - None (or 'none'): every cell of the layer is drawn. This is the default.
+    - 'spaces': spaces with the default background aren't drawn - whatever is
+      underneath them shows through.
+    - a single character: cells containing that character aren't drawn. This
+      is handy if the layer needs spaces of its own.
+
+When a layer changes, only the rectangle it covers (before and after the
+change) is re-composited. For each cell in that rectangle, we start from the
+bottom layer and paint the layers that overlap the rectangle on top of it, in
+order. Layers that don't overlap the rectangle aren't looked at, so the cost
+depends on the size of the update rather than on how many layers there are.
+
+The bottom of the stack is the base: whatever was on the screen before any
+layers were added.
+"""
+from utilities.sgr_tokenizer import BLANK_CELL, REVERSE
+
+OPAQUE = 'none'
+SPACES = 'spaces'
+
+
+def transparency_test(transparent):
+    """ Input:
+            transparent: str - a layer's 'transparent' setting (see above)
+        Output:
+            a function that takes a cell and returns True if it's transparent,
+            or None if the layer is opaque
+    """
+    if not transparent or transparent == OPAQUE:
+        return None
+    if transparent == SPACES:
+        # A reversed space shows the foreground color, so it isn't empty
+        return lambda cell: cell[0] == 32 and not cell[2] \
+            and not cell[3] & REVERSE
+    if len(transparent) != 1:
+        raise ValueError(
+            f'Invalid transparency {transparent!r}. Expected "{OPAQUE}", '
+            f'"{SPACES}", or a single character')
+    code_point = ord(transparent)
+    return lambda cell: cell[0] == code_point
+
+def _union(a: tuple, b: tuple) -> tuple:
+    """ Returns the smallest (column, row, width, height) rectangle that
+    covers both of the rectangles a and b
+    """
+    left = min(a[0], b[0])
+    top = min(a[1], b[1])
+    right = max(a[0] + a[2], b[0] + b[2])
+    bottom = max(a[1] + a[3], b[1] + b[3])
+    return left, top, right - left, bottom - top
+
+def _overlaps(a: tuple, b: tuple) -> bool:
+    """ Returns True if two (column, row, width, height) rectangles overlap
+    """
+    return (a[0] < b[0] + b[2] and b[0] < a[0] + a[2]
+            and a[1] < b[1] + b[3] and b[1] < a[1] + a[3])
+
+class Layer:
+    """ A text block, where it goes, and how it stacks up against the others
+    """
+    __slots__ = ('name', 'z', 'rect', 'rows', 'transparent', 'is_transparent',
+                 'sequence')
+
+    def __init__(self, name: str, rect: tuple, rows: list, z: int = 0,
+                 transparent: str = None, sequence: int = 0):
+        """ Input:
+                name: str - the name of the layer (the config section)
+                rect: tuple - (column, row, width, height) of the block
+                rows: list of lists of cells - the block itself
+                z: int - the z-index. Higher is closer to the top.
+                transparent: str - which cells are transparent (see above)
+                sequence: int - when the layer was last updated, for breaking
+                    ties between layers with the same z-index
+        """
+        self.name = name
+        self.z = z
+        self.rect = rect
+        self.rows = rows
+        self.transparent = transparent
+        self.is_transparent = transparency_test(transparent)
+        self.sequence = sequence
+
+    def paint(self, frame: list, rect: tuple):
+        """ Input:
+                frame: list of lists of cells - the part of the screen covered
+                    by 'rect', which gets painted over
+                rect: tuple - (column, row, width, height) of 'frame'
+            Output:
+                Draws the part of this layer that falls inside 'rect' on top
+                of 'frame'.
+        """
+        column, row, width, height = self.rect
+        # The part of the layer that's inside rect, in screen coordinates
+        left = max(column, rect[0])
+        right = min(column + width, rect[0] + rect[2])
+        top = max(row, rect[1])
+        bottom = min(row + height, rect[1] + rect[3])
+        if left >= right or top >= bottom:
+            return
+        is_transparent = self.is_transparent
+        for y in range(top, bottom):
+            source = self.rows[y - row][left - column:right - column]
+            target = frame[y - rect[1]]
+            start = left - rect[0]
+            if is_transparent is None:
+                target[start:start + len(source)] = source
+                continue
+            for x, cell in enumerate(source, start):
+                if not is_transparent(cell):
+                    target[x] = cell
+
+class LayerStack:
+    """ All of the layers, stacked on top of a base frame
+    """
+    def __init__(self, base: list):
+        """ Input:
+                base: list of lists of cells - what's on the screen below all
+                    the layers (i.e. the contents of the cell grid when the
+                    compositor started). Every row has to be the same length.
+        """
+        self.base = base
+        self.height = len(base)
+        self.width = len(base[0]) if base else 0
+        self.layers = {}
+        self.sequence = 0
+
+    def resize(self, width: int, height: int):
+        """ Input:
+                width: int - the new width of the screen (in columns)
+                height: int - the new height of the screen (in rows)
+            Output:
+                Crops the base (or pads it with blank cells) to the new size.
+                The layers are left alone - they're clipped to the screen when
+                they're drawn, so a layer that's off the edge of a smaller
+                screen comes back if the screen gets bigger again.
+        """
+        base = [row[:width] + [BLANK_CELL]*(width - len(row))
+                for row in self.base[:height]]
+        base += [[BLANK_CELL]*width for _ in range(height - len(base))]
+        self.base = base
+        self.width = width
+        self.height = height
+
+    def clear_base(self, rect: tuple):
+        """ Input:
+                rect: tuple - (column, row, width, height) of part of the screen
+            Output:
+                Blanks that part of the base, so that nothing that was on the
+                screen before shows through any transparent layer there.
+        """
+        column, row, width, height = self.clip(rect)
+        for y in range(row, row + height):
+            self.base[y][column:column + width] = [BLANK_CELL]*width
+
+    def clip(self, rect: tuple) -> tuple:
+        """ Returns the part of 'rect' that's on the screen (which might be
+        empty, i.e. have a width or height of 0)
+        """
+        left = min(max(rect[0], 0), self.width)
+        top = min(max(rect[1], 0), self.height)
+        right = min(max(rect[0] + rect[2], left), self.width)
+        bottom = min(max(rect[1] + rect[3], top), self.height)
+        return left, top, right - left, bottom - top
+
+    def set_layer(self, name: str, rect: tuple, rows: list, z: int = 0,
+                  transparent: str = None) -> tuple:
+        """ Input:
+                name: str - the name of the layer. A layer is added if there
+                    isn't one with this name already, and replaced if there is.
+                rect: tuple - (column, row, width, height) of the text block
+                rows: list of lists of cells - the text block, exactly
+                    'width' cells wide and 'height' rows tall
+                z: int - the z-index of the layer
+                transparent: str - which of its cells are transparent
+            Output:
+                dirty: tuple - the (column, row, width, height) rectangle of
+                    the screen that needs to be re-composited
+        """
+        self.sequence += 1
+        old = self.layers.get(name)
+        self.layers[name] = Layer(
+            name, tuple(rect), rows, z, transparent, self.sequence)
+        dirty = rect if old is None else _union(old.rect, rect)
+        return self.clip(dirty)
+
+    def remove_layer(self, name: str) -> tuple:
+        """ Input:
+                name: str - the name of the layer to remove
+            Output:
+                dirty: tuple - the (column, row, width, height) rectangle of
+                    the screen that needs to be re-composited, or None if
+                    there's no layer with that name
+        """
+        old = self.layers.pop(name, None)
+        if old is None:
+            return None
+        return self.clip(old.rect)
+
+    def flatten(self, rect: tuple) -> list:
+        """ Input:
+                rect: tuple - (column, row, width, height) of part of the screen
+            Output:
+                frame: list of lists of cells - what that part of the screen
+                    looks like with all the layers stacked up
+        """
+        column, row, width, height = self.clip(rect)
+        frame = [self.base[y][column:column + width]
+                 for y in range(row, row + height)]
+        clipped = (column, row, width, height)
+        layers = [layer for layer in self.layers.values()
+                  if _overlaps(layer.rect, clipped)]
+        layers.sort(key=lambda layer: (layer.z, layer.sequence))
+        for layer in layers:
+            layer.paint(frame, clipped)
+        return frame
@@ -0,0 +1,118 @@
+""" Keeps track of what was last written to each region of the screen, so that
+updates that wouldn't change anything can be skipped.
+
+Most of the cron jobs print exactly the same thing most of the time (the
+forecast only changes when the NWS updates it, for example). Writing the same
+text block again still means re-rendering term.txt, and since the file gets
+replaced, the renderer wakes up and compares the whole frame for nothing.
+
+Rather than keeping a copy of every text block, we keep a hash of it, keyed by
+the region it was written to: (column, row, width, height).
+
+A hash is only good as long as nothing else has written over its region, so:
+    - writing to a region forgets the hashes of any other regions that
+      overlap it.
+    - if term.txt has been published by someone else since we last published
+      it (update_mirror.py, or make_term_file.py), we forget everything. We
+      can tell by checking term.txt's inode number, mtime, and size, which
+      change every time it's replaced.
+"""
+import os
+import hashlib
+
+
+def hash_text(text: str) -> bytes:
+    """ Returns a hash of a text block
+    """
+    return hashlib.blake2b(
+        text.encode('utf-8', errors='replace'), digest_size=16).digest()
+
+def _overlaps(a: tuple, b: tuple) -> bool:
+    """ Returns True if two (column, row, width, height) regions overlap
+    """
+    a_column, a_row, a_width, a_height = a
+    b_column, b_row, b_width, b_height = b
+    return (a_column < b_column + b_width and b_column < a_column + a_width
+            and a_row < b_row + b_height and b_row < a_row + a_height)
+
+class RegionHashes:
+    """ The hashes of the text blocks that were last written to each region,
+    along with counts of how many updates were applied and how many were
+    skipped.
+    """
+    def __init__(self, term_file_path: str):
+        """ Input:
+                term_file_path: str - the path of term.txt
+        """
+        self.term_file_path = term_file_path
+        self.hashes = {}
+        self.signature = None
+        self.applied = 0
+        self.skipped = 0
+
+    def _stat_signature(self):
+        try:
+            stat = os.stat(self.term_file_path)
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    def unchanged(self, region: tuple, text: str) -> bool:
+        """ Input:
+                region: tuple - (column, row, width, height)
+                text: str - the text block we're about to write there
+            Output:
+                True if that exact text block is already in that region (in
+                which case the update is counted as skipped)
+        """
+        if self.hashes and self._stat_signature() != self.signature:
+            # Someone else has published term.txt, so we can't trust any of
+            # the hashes anymore
+            self.hashes.clear()
+        if self.hashes.get(region) == hash_text(text):
+            self.skipped += 1
+            return True
+        return False
+
+    def record(self, region: tuple, text: str):
+        """ Input:
+                region: tuple - (column, row, width, height)
+                text: str - the text block that was just written there
+            Output:
+                Remembers the hash of the text block, and forgets the hashes
+                of any other regions that it was written over.
+        """
+        for other in [other for other in self.hashes
+                      if other != region and _overlaps(region, other)]:
+            del self.hashes[other]
+        self.hashes[region] = hash_text(text)
+        self.applied += 1
+
+    def forget(self, region: tuple):
+        """ Forgets the hashes of any regions that overlap 'region' (i.e.
+        because a layer that covered it was removed)
+        """
+        for other in [other for other in self.hashes
+                      if _overlaps(region, other)]:
+            del self.hashes[other]
+
+    def clear(self):
+        """ Forgets all of the hashes (i.e. because the screen was resized)
+        """
+        self.hashes.clear()
+
+    def published(self):
+        """ Should be called after we publish term.txt, so that we can tell
+        whether anyone else publishes it after us.
+        """
+        self.signature = self._stat_signature()
+
+    def stats(self) -> dict:
+        """ Returns the number of updates that were applied and skipped, and
+        the number of regions we're keeping track of
+        """
+        return {
+            'applied': self.applied,
+            'skipped': self.skipped,
+            'regions': len(self.hashes),
+        }
@@ -0,0 +1,86 @@
+""" Keeps track of where each row of term.txt starts, so that we can seek
+straight to the rows a text block covers instead of reading (and splitting)
+the whole file.
+
+The index lives in a sidecar file next to term.txt (term.txt.idx). It's just
+an array of 64-bit ints:
+    [INDEX_VERSION, file size, file mtime (ns), number of rows, offsets...]
+There's one offset per row, plus one extra entry at the end, so that row n
+always occupies the bytes offsets[n]:offsets[n+1]-1 (the -1 skips the newline
+that separates it from the next row - the last row doesn't have one, so the
+extra entry is the file size plus one).
+
+The size and mtime are there so we can tell when something other than
+update_mirror.py (term_test.py, for example) has rewritten term.txt. When
+that happens the index is rebuilt from scratch.
+"""
+import os
+from array import array
+from utilities.atomic_file import atomic_write
+
+INDEX_VERSION = 1
+_HEADER_LENGTH = 4
+
+
+def get_index_path(term_file_path: str) -> str:
+    """ Returns the path of the index file for 'term_file_path'
+    """
+    return term_file_path + '.idx'
+
+def build_row_index(data: bytes) -> list:
+    """ Input:
+            data: bytes - the contents of term.txt
+        Output:
+            offsets: list of ints - the byte offset of the start of each row,
+                plus one extra entry (see the module docstring).
+    """
+    offsets = [0]
+    find = data.find
+    position = find(b'\n')
+    while position != -1:
+        offsets.append(position + 1)
+        position = find(b'\n', position + 1)
+    offsets.append(len(data) + 1)
+    return offsets
+
+def save_row_index(term_file_path: str, offsets: list):
+    """ Input:
+            term_file_path: str - the path of term.txt
+            offsets: list of ints - the row offsets of term.txt, as returned by
+                build_row_index()
+        Output:
+            Writes the index file. Call this AFTER term.txt has been written,
+            since it records the size and mtime of term.txt.
+    """
+    stat = os.stat(term_file_path)
+    header = [INDEX_VERSION, stat.st_size, stat.st_mtime_ns, len(offsets) - 1]
+    atomic_write(get_index_path(term_file_path),
+                 array('q', header + offsets).tobytes())
+
+def load_row_index(term_file_path: str) -> list:
+    """ Input:
+            term_file_path: str - the path of term.txt
+        Output:
+            offsets: list of ints - the row offsets of term.txt.
+
+    If the index file is missing, or doesn't match the current state of
+    term.txt, the index is rebuilt by scanning term.txt (and saved, so the
+    next caller doesn't have to).
+    """
+    stat = os.stat(term_file_path)
+    try:
+        with open(get_index_path(term_file_path), 'rb') as f:
+            index = array('q', f.read())
+        version, size, mtime_ns, row_count = index[:_HEADER_LENGTH]
+        if (version == INDEX_VERSION
+                and size == stat.st_size
+                and mtime_ns == stat.st_mtime_ns
+                and len(index) == _HEADER_LENGTH + row_count + 1):
+            return index[_HEADER_LENGTH:].tolist()
+    except (OSError, ValueError):
+        # Missing, truncated or otherwise garbled - we'll rebuild it
+        pass
+    with open(term_file_path, 'rb') as f:
+        offsets = build_row_index(f.read())
+    save_row_index(term_file_path, offsets)
+    return offsets
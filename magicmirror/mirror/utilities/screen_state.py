@@ -0,0 +1,77 @@
+""" Saves what's on the screen, so that the mirror can show it again straight
+away after a reboot, instead of a blank screen.
+
+There are two parts to it:
+    - the last frame, which is just the cell grid (term.grid). It's already
+      on disk, so all make_term_file.py has to do is not throw it away.
+    - the last text block each layer sent (see utilities/layers.py), which the
+      compositor saves to term.txt.state every time a layer changes. When it
+      starts back up, it puts the layers back from there, so a layer that's
+      refreshed replaces exactly what it had on the screen before (even if
+      it's partly transparent).
+
+Until a region is refreshed, whatever's there is stale, so it's drawn dimmed
+(SGR 2, "half-bright" on the Linux console). That way you can tell at a
+glance which parts of the mirror are still waiting for their cron job to run.
+
+The state file is JSON:
+    {
+        "version": 1,
+        "layers": [
+            {"layer": "clock", "column": 0, "row": 12, "width": 74,
+             "height": 11, "z": 0, "transparent": null, "text": "..."},
+            ...
+        ]
+    }
+with the layers in the order they were last updated (so they stack up the
+same way again).
+"""
+import json
+from utilities.atomic_file import atomic_write
+from utilities.sgr_tokenizer import DIM
+
+STATE_VERSION = 1
+
+
+def get_state_path(term_file_path: str) -> str:
+    """ Returns the path of the file that holds the layers' text blocks
+    """
+    return term_file_path + '.state'
+
+def mark_stale(rows: list) -> list:
+    """ Input:
+            rows: list of lists of cells
+        Output:
+            the same rows, with every cell dimmed to show it's out of date
+    """
+    return [[(code_point, fg, bg, attrs | DIM)
+             for code_point, fg, bg, attrs in row] for row in rows]
+
+def save_state(state_path: str, blocks: list):
+    """ Input:
+            state_path: str - where to save the state (see get_state_path())
+            blocks: list of dicts - the last text block of each layer, in the
+                order they were updated. Each one has the keys 'layer',
+                'column', 'row', 'width', 'height', 'z', 'transparent', and
+                'text'.
+        Output:
+            Atomically replaces the state file
+    """
+    state = {'version': STATE_VERSION, 'layers': blocks}
+    atomic_write(state_path, json.dumps(state).encode('utf-8'))
+
+def load_state(state_path: str) -> list:
+    """ Input:
+            state_path: str - the state file (see get_state_path())
+        Output:
+            blocks: list of dicts - the text blocks saved by save_state(), or
+                an empty list if there's no state file (or it can't be used)
+    """
+    try:
+        with open(state_path, encoding='utf-8') as f:
+            state = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return []
+    if not isinstance(state, dict) or state.get('version') != STATE_VERSION:
+        return []
+    return state.get('layers', [])
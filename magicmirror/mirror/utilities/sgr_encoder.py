@@ -0,0 +1,162 @@
+""" Turns rows of cells back into ANSI-formatted text, using as few bytes as
+possible.
+
+color_text.py wraps every character in its own escape sequence, followed by a
+reset. That's easy to work with, but it makes a colored screen 20-30 times
+bigger than the text you can actually see - and every byte of term.txt gets
+pushed to the console each time the screen is redrawn.
+Since the cell grid is what we actually edit, term.txt doesn't need to be
+easy to work with anymore. So, when rendering a row, we only emit an escape
+sequence when the foreground, background, or attributes change from one cell
+to the next. When they do change, we emit whichever is shorter: the
+difference between the two styles, or a reset followed by the new style.
+
+Spaces get special treatment, since a space with the default background looks
+the same no matter what the foreground color is (unless it's underlined,
+struck through, or reversed). Runs of plain spaces never need an escape
+sequence, unless we have to switch the background back to the default.
+
+Each row starts from a clean slate and ends with a reset (if it needs one),
+so any row can be parsed on its own.
+
+Wide characters (see utilities/char_width.py) are written once, and their
+continuation cells are skipped, since the terminal moves the cursor past both
+columns. If a row has half of a wide character in it (because a text block was
+written over the other half), that half is drawn as a space, so the rest of
+the row doesn't shift over.
+
+If the terminal can't display 24-bit color, the colors are converted to the
+256-color or 16-color palette first (see utilities/color_depth.py), which
+makes the escape sequences a lot shorter too.
+"""
+from functools import lru_cache
+from utilities.char_width import CONTINUATION, FIRST_WIDE, fix_wide_cells
+from utilities.color_depth import downconvert_row, get_color_depth
+from utilities.sgr_tokenizer import (
+    BLINK,
+    BOLD,
+    DIM,
+    HIDDEN,
+    ITALIC,
+    REVERSE,
+    STRIKE,
+    UNDERLINE,
+    cell_to_ansi,
+    color_params,
+    style_params,
+)
+
+RESET = '\x1b[0m'
+
+# Attributes that show up on a space
+_SPACE_ATTRS = UNDERLINE | REVERSE | STRIKE
+
+# The SGR codes that turn each attribute off. Bold and dim share one.
+_ATTR_OFF_CODES = (
+    (BOLD | DIM, '22'), (ITALIC, '23'), (UNDERLINE, '24'), (BLINK, '25'),
+    (REVERSE, '27'), (HIDDEN, '28'), (STRIKE, '29'))
+
+
+@lru_cache(maxsize=4096)
+def transition(fg: int, bg: int, attrs: int,
+               new_fg: int, new_bg: int, new_attrs: int) -> str:
+    """ Input:
+            fg, bg, attrs: ints - the current style
+            new_fg, new_bg, new_attrs: ints - the style we want
+        Output:
+            the shortest escape sequence that gets us from the current style to
+            the new one (or '' if they're the same)
+    """
+    if (fg, bg, attrs) == (new_fg, new_bg, new_attrs):
+        return ''
+    if not (new_fg or new_bg or new_attrs):
+        return RESET
+    # Option 1: reset everything, then set up the new style from scratch
+    from_scratch = '\x1b[0;' + style_params(new_fg, new_bg, new_attrs) + 'm'
+
+    # Option 2: just change the things that are different
+    params = []
+    removed = attrs & ~new_attrs
+    added = new_attrs & ~attrs
+    for bits, code in _ATTR_OFF_CODES:
+        if removed & bits:
+            params.append(code)
+            # 22 turns off both bold and dim, so we may need one of them back
+            added |= new_attrs & bits
+    if added:
+        params.append(style_params(0, 0, added))
+    if new_fg != fg:
+        params.append(color_params(new_fg))
+    if new_bg != bg:
+        params.append(color_params(new_bg, background=True))
+    difference = '\x1b[' + ';'.join(params) + 'm'
+
+    return difference if len(difference) < len(from_scratch) else from_scratch
+
+def encode_row(cells: list, color_depth: str = None,
+               term_file_path: str = None) -> str:
+    """ Input:
+            cells: list of (code_point, fg, bg, attrs) tuples - a row of cells
+            color_depth: str - 'truecolor', '256', or '16'. Defaults to the
+                color depth of the term.txt at 'term_file_path' (see
+                get_color_depth()).
+            term_file_path: str - the path of the term.txt the row is for.
+                Only used if there's no color_depth. Defaults to the mirror's
+                term.txt.
+        Output:
+            the row as a string of ANSI-formatted text, with an escape sequence
+            only where the style changes.
+    """
+    if color_depth is None:
+        color_depth = get_color_depth(term_file_path)
+    return _encode_cells(downconvert_row(cells, color_depth))
+
+def _encode_cells(cells: list, checked: bool = False) -> str:
+    """ Does the work for encode_row(). 'checked' is True once the row's wide
+    characters have been checked by fix_wide_cells().
+    """
+    out = []
+    append = out.append
+    fg = bg = attrs = 0
+    for code_point, cell_fg, cell_bg, cell_attrs in cells:
+        if not 0 < code_point < FIRST_WIDE:
+            # A wide character or a continuation cell, which most rows don't
+            # have - so rather than checking every row for half of a wide
+            # character, we only do it once we've found one
+            if not checked:
+                return _encode_cells(fix_wide_cells(cells), True)
+            if code_point == CONTINUATION:
+                continue
+        if cell_fg != fg or cell_bg != bg or cell_attrs != attrs:
+            if code_point == 32 and not cell_bg \
+                    and not (cell_attrs & _SPACE_ATTRS):
+                # A plain space - the foreground doesn't matter, so all we
+                # care about is getting back to the default background
+                if bg or attrs & _SPACE_ATTRS:
+                    append(RESET)
+                    fg = bg = attrs = 0
+                append(' ')
+                continue
+            append(transition(fg, bg, attrs, cell_fg, cell_bg, cell_attrs))
+            fg, bg, attrs = cell_fg, cell_bg, cell_attrs
+        append(chr(code_point))
+    if fg or bg or attrs:
+        append(RESET)
+    return ''.join(out)
+
+def encoding_savings(rows: list, color_depth: str = None):
+    """ Input:
+            rows: list of lists of cells
+            color_depth: str - the color depth to encode with (see encode_row())
+        Output:
+            (per_cell_bytes, minimal_bytes): the number of bytes it takes to
+                encode 'rows' with every cell wrapped in its own escape sequence
+                (the way color_text.py does it), and with encode_row().
+    """
+    per_cell = sum(len(''.join([cell_to_ansi(cell) for cell in cells])
+                       .encode('utf-8')) for cells in rows)
+    minimal = sum(len(encode_row(cells, color_depth).encode('utf-8'))
+                  for cells in rows)
+    # Each row is followed by a newline (except the last one)
+    newlines = max(len(rows) - 1, 0)
+    return per_cell + newlines, minimal + newlines
@@ -0,0 +1,359 @@
+""" Turns lines of ANSI-formatted text into lists of cells.
+
+A cell is one column of the terminal. It is stored as a tuple of four ints:
+    (code_point, fg, bg, attrs)
+    - code_point: the ord() of the printable character in the cell. A wide
+      character (CJK, emoji, etc.) takes up two cells, and the second one's
+      code point is CONTINUATION (see utilities/char_width.py).
+    - fg: the foreground color id (see below)
+    - bg: the background color id
+    - attrs: a bitmask of text attributes (BOLD, UNDERLINE, etc.)
+
+Color ids pack every kind of color an SGR sequence can ask for into a single
+int, which keeps cells small and makes comparing two cells cheap:
+    - DEFAULT_COLOR (0): the terminal's default color
+    - PALETTE_COLOR | n: entry n of the 256-color lookup table. The 30-37,
+      90-97 (and 40-47, 100-107) codes map to entries 0-7 and 8-15.
+    - RGB_COLOR | (r << 16) | (g << 8) | b: a 24-bit "truecolor" color
+
+Unlike the old regex in update_mirror.py, this doesn't assume that every
+character is wrapped in its own escape sequence. It keeps track of the SGR
+state as it goes, so a single escape sequence coloring a whole word (which is
+what you get from lolcat, for example), resets, and partial resets like
+'\x1b[39m' (default foreground) all work.
+"""
+import re
+from itertools import repeat
+from utilities.char_width import (
+    CONTINUATION,
+    column_code_points,
+    replace_controls,
+)
+
+DEFAULT_COLOR = 0
+RGB_COLOR = 1 << 24
+PALETTE_COLOR = 2 << 24
+
+# Attribute bits
+BOLD = 1
+DIM = 2
+ITALIC = 4
+UNDERLINE = 8
+BLINK = 16
+REVERSE = 32
+HIDDEN = 64
+STRIKE = 128
+
+# The names of the attributes, i.e. for color_text.py --style
+STYLE_NAMES = {
+    'bold': BOLD, 'dim': DIM, 'italic': ITALIC, 'underline': UNDERLINE,
+    'blink': BLINK, 'reverse': REVERSE, 'hidden': HIDDEN, 'strike': STRIKE}
+
+BLANK_CELL = (32, DEFAULT_COLOR, DEFAULT_COLOR, 0)
+
+# 21 is double underline (not 'bold off', whatever some old terminals
+# thought), which we draw as a plain underline
+_ATTR_ON = {
+    1: BOLD, 2: DIM, 3: ITALIC, 4: UNDERLINE, 5: BLINK, 6: BLINK,
+    7: REVERSE, 8: HIDDEN, 9: STRIKE, 21: UNDERLINE}
+_ATTR_OFF = {
+    22: BOLD | DIM, 23: ITALIC, 24: UNDERLINE, 25: BLINK,
+    27: REVERSE, 28: HIDDEN, 29: STRIKE}
+_ATTR_CODES = sorted((bit, code) for code, bit in _ATTR_ON.items()
+                     if code not in (6, 21))
+
+# This is compiled once, when the module is imported. Each match is either an
+# escape sequence or a run of ordinary text between escape sequences.
+# The 'm' is included in the 'sgr' group so that findall() gives us a non-empty
+# string for every SGR sequence (even '\x1b[m'), and ('', '') for the escape
+# sequences we ignore.
+_TOKEN = re.compile(r'''
+    \x1b\[(?P<sgr>[0-9;:]*m)            # SGR sequence (the one we care about)
+    |\x1b\[[0-?]*[\x20-/]*[@-~]         # any other CSI sequence (ignored)
+    |\x1b\][^\x07\x1b]*(?:\x07|\x1b\\)? # OSC sequence (ignored)
+    |\x1b[\x20-/]+[0-~]?                # character sets, i.e. '\x1b(B' (ignored)
+    |\x1b[0-~]?                         # two character escapes, stray ESCs
+    |(?P<text>[^\x1b\r]+)               # a run of printable text
+    |\r                                 # carriage returns are dropped
+    ''', re.VERBOSE)
+
+# Maps (parameters, fg, bg, attrs) -> (fg, bg, attrs). Most text only uses a
+# handful of distinct escape sequences, so this saves us from re-parsing them.
+_SGR_CACHE = {}
+_SGR_CACHE_LIMIT = 4096
+
+
+def rgb_color(r: int, g: int, b: int) -> int:
+    """ Returns the color id for the 24-bit color r, g, b
+    """
+    return RGB_COLOR | (r << 16) | (g << 8) | b
+
+def palette_color(n: int) -> int:
+    """ Returns the color id for entry n of the 256-color lookup table
+    """
+    return PALETTE_COLOR | n
+
+def parse_styles(names) -> int:
+    """ Input:
+            names: iterable of str - attribute names, like ['bold', 'italic']
+                (see STYLE_NAMES)
+        Output:
+            attrs: int - the attribute bits, ORed together
+    """
+    attrs = 0
+    for name in names:
+        try:
+            attrs |= STYLE_NAMES[name.lower()]
+        except KeyError:
+            raise ValueError(
+                f'Unknown style {name!r}. Expected one of: '
+                f'{", ".join(STYLE_NAMES)}') from None
+    return attrs
+
+def color_to_rgb(color: int):
+    """ Returns the (r, g, b) tuple of an RGB color id, or None for default
+    and palette colors.
+    """
+    if color & RGB_COLOR:
+        return (color >> 16) & 0xff, (color >> 8) & 0xff, color & 0xff
+    return None
+
+def _extended_color(codes: list, i: int):
+    """ Input:
+            codes: list of str - the semicolon-separated SGR parameters
+            i: int - the index of the parameter following a 38 or 48
+        Output:
+            (color, i): the color id that was specified, and the index of the
+                first parameter after the color specification.
+    """
+    try:
+        mode = codes[i]
+        if mode == '5':
+            return PALETTE_COLOR | (int(codes[i+1]) & 0xff), i + 2
+        if mode == '2':
+            r, g, b = (int(c or 0) & 0xff for c in codes[i+1:i+4])
+            return RGB_COLOR | (r << 16) | (g << 8) | b, i + 4
+    except (IndexError, ValueError):
+        pass
+    # Malformed - skip the rest of the sequence rather than guessing
+    return None, len(codes)
+
+def _colon_color(param: str):
+    """ Handles the ITU style colon-separated color parameters, i.e.
+    '38:2::255:0:0' or '38:5:196'. Returns None if it can't make sense of it.
+    """
+    sub = param.split(':')
+    try:
+        if sub[1] == '5':
+            return PALETTE_COLOR | (int(sub[2]) & 0xff)
+        if sub[1] == '2':
+            r, g, b = (int(c or 0) & 0xff for c in sub[-3:])
+            return RGB_COLOR | (r << 16) | (g << 8) | b
+    except (IndexError, ValueError):
+        pass
+    return None
+
+def _apply_sgr(params: str, fg: int, bg: int, attrs: int):
+    """ Input:
+            params: str - the parameters of an SGR sequence followed by the
+                final 'm', i.e. '1;38;5;196m' for '\x1b[1;38;5;196m'
+            fg: int - the current foreground color id
+            bg: int - the current background color id
+            attrs: int - the current attribute bitmask
+        Output:
+            (fg, bg, attrs): the state after applying the sequence
+    """
+    key = (params, fg, bg, attrs)
+    state = _SGR_CACHE.get(key)
+    if state is not None:
+        return state
+
+    if params == 'm':
+        # '\x1b[m' is the same as '\x1b[0m'
+        state = (DEFAULT_COLOR, DEFAULT_COLOR, 0)
+    else:
+        codes = params[:-1].split(';')
+        i = 0
+        while i < len(codes):
+            param = codes[i]
+            i += 1
+            if ':' in param:
+                color = _colon_color(param)
+                if color is not None:
+                    if param.startswith('38'):
+                        fg = color
+                    elif param.startswith('48'):
+                        bg = color
+                continue
+            code = int(param) if param else 0
+            if code == 0:
+                fg, bg, attrs = DEFAULT_COLOR, DEFAULT_COLOR, 0
+            elif 30 <= code <= 37:
+                fg = PALETTE_COLOR | (code - 30)
+            elif 40 <= code <= 47:
+                bg = PALETTE_COLOR | (code - 40)
+            elif 90 <= code <= 97:
+                fg = PALETTE_COLOR | (code - 82)
+            elif 100 <= code <= 107:
+                bg = PALETTE_COLOR | (code - 92)
+            elif code == 38:
+                color, i = _extended_color(codes, i)
+                if color is not None:
+                    fg = color
+            elif code == 48:
+                color, i = _extended_color(codes, i)
+                if color is not None:
+                    bg = color
+            elif code == 39:
+                fg = DEFAULT_COLOR
+            elif code == 49:
+                bg = DEFAULT_COLOR
+            elif code in _ATTR_ON:
+                attrs |= _ATTR_ON[code]
+            elif code in _ATTR_OFF:
+                attrs &= ~_ATTR_OFF[code]
+            # Anything else (fonts, frames, etc.) is ignored
+        state = (fg, bg, attrs)
+
+    if len(_SGR_CACHE) >= _SGR_CACHE_LIMIT:
+        _SGR_CACHE.clear()
+    _SGR_CACHE[key] = state
+    return state
+
+def tokenize_line(line: str, size: int = None, state: tuple = None) -> list:
+    """ Input:
+            line: str - a single line of text (no newlines), which may contain
+                ANSI escape sequences.
+            size: int - if given, the list of cells is truncated or padded with
+                blank cells so that it is exactly this long.
+            state: tuple of 3 ints - the (fg, bg, attrs) state at the start of
+                the line. Defaults to a clean slate.
+        Output:
+            cells: list of tuples - one (code_point, fg, bg, attrs) tuple for
+                each printable character in 'line'.
+    """
+    return _tokenize(line, size, state)[0]
+
+def _tokenize(line: str, size: int = None, state: tuple = None):
+    """ Does the work for tokenize_line(). Returns the list of cells along with
+    the (fg, bg, attrs) state at the end of the line.
+    """
+    fg, bg, attrs = state if state else (DEFAULT_COLOR, DEFAULT_COLOR, 0)
+    cells = []
+    if '\x1b' not in line and '\r' not in line:
+        # Plain text - nothing to parse
+        cells.extend(zip(code_points(line), repeat(fg), repeat(bg),
+                         repeat(attrs)))
+    else:
+        for params, text in _TOKEN.findall(line):
+            if text:
+                # zip/map/repeat keeps the per-character work in C, which is
+                # what makes this fast enough to parse a whole screen
+                cells.extend(zip(code_points(text), repeat(fg), repeat(bg),
+                                 repeat(attrs)))
+            elif params:
+                fg, bg, attrs = _apply_sgr(params, fg, bg, attrs)
+    if size is not None:
+        fit_cells(cells, size)
+    return cells, (fg, bg, attrs)
+
+def code_points(text: str):
+    """ Returns the code points of the cells 'text' takes up. For ASCII text
+    (nearly all of it), that's just map(ord, text). Otherwise wide characters
+    get a continuation cell and zero-width characters are dropped. Control
+    characters come out as spaces either way.
+    """
+    if text.isascii():
+        return map(ord, replace_controls(text))
+    return column_code_points(text)
+
+def fit_cells(cells: list, size: int):
+    """ Truncates or pads a row of cells (in place) so that it's exactly 'size'
+    cells long. If that cuts a wide character in half, the half that's left is
+    replaced with a space.
+    """
+    if len(cells) < size:
+        cells.extend(repeat(BLANK_CELL, size - len(cells)))
+    elif len(cells) > size:
+        if size and cells[size][0] == CONTINUATION:
+            cells[size - 1] = (32,) + cells[size - 1][1:]
+        del cells[size:]
+
+def tokenize_text(text: str, width: int = None, height: int = None) -> list:
+    """ Input:
+            text: str - a block of text. Lines are separated by newlines.
+            width: int - if given, each row is truncated or padded to this many
+                cells.
+            height: int - if given, the block is truncated or padded with blank
+                rows so that it has this many rows.
+        Output:
+            rows: list of lists of cells
+
+    The SGR state carries over from one line to the next, the same way it
+    would if you printed 'text' to a terminal.
+    """
+    rows = []
+    state = None
+    for line in text.split('\n'):
+        if height is not None and len(rows) >= height:
+            break
+        cells, state = _tokenize(line, width, state)
+        rows.append(cells)
+    if height is not None and len(rows) < height:
+        blank_width = width or 0
+        rows.extend([BLANK_CELL]*blank_width
+                    for _ in range(height - len(rows)))
+    return rows
+
+def color_params(color: int, background: bool = False) -> str:
+    """ Input:
+            color: int - a color id
+            background: bool - if True, returns the parameters that set the
+                background, otherwise the foreground.
+        Output:
+            the SGR parameters (without the '\x1b[' and 'm') for the color
+    """
+    if color & RGB_COLOR:
+        prefix = '48;2;' if background else '38;2;'
+        return prefix + f'{(color >> 16) & 0xff};{(color >> 8) & 0xff};' \
+            f'{color & 0xff}'
+    if color & PALETTE_COLOR:
+        n = color & 0xff
+        if n < 8:
+            return str((40 if background else 30) + n)
+        if n < 16:
+            return str((100 if background else 90) + n - 8)
+        return ('48;5;' if background else '38;5;') + str(n)
+    return '49' if background else '39'
+
+def style_params(fg: int, bg: int, attrs: int) -> str:
+    """ Returns the SGR parameters that set up the given style from a clean
+    slate, i.e. '1;38;2;255;0;0' for bold red text.
+    """
+    params = [str(code) for bit, code in _ATTR_CODES if attrs & bit]
+    if fg:
+        params.append(color_params(fg))
+    if bg:
+        params.append(color_params(bg, background=True))
+    return ';'.join(params)
+
+def cell_to_ansi(cell: tuple) -> str:
+    """ Renders a single cell the way color_text.py does: wrapped in its own
+    escape sequence, followed by a reset.
+    """
+    code_point, fg, bg, attrs = cell
+    if code_point == CONTINUATION:
+        # The wide character before it already took up this column
+        return ''
+    if not (fg or bg or attrs):
+        return chr(code_point)
+    return f'\x1b[{style_params(fg, bg, attrs)}m{chr(code_point)}\x1b[0m'
+
+def render_cells(cells: list) -> str:
+    """ Input:
+            cells: list of tuples - a row of cells
+        Output:
+            the row as a string, with each formatted cell wrapped in its own
+            escape sequence.
+    """
+    return ''.join([cell_to_ansi(cell) for cell in cells])
@@ -0,0 +1,134 @@
+""" Region files ("shards"), so that each config section can update its part
+of the screen without touching term.txt at all.
+
+Normally every update goes through term.txt (or the compositor's socket), so
+every writer pays for the whole screen and has to wait its turn. With shards,
+each config section writes its text block to a small file of its own in the
+shard directory (term.txt.shards, next to term.txt), and that's it - nobody
+else writes that file, so there's nothing to wait for, and it costs about as
+much as the text block is big.
+
+The compositor watches the shard directory, and merges the shards into the
+screen whenever one of them changes. Each shard is a layer (see
+utilities/layers.py), named after the file, so they stack up the same way
+updates sent over the socket do.
+
+A shard holds exactly what mirror_client.py would have sent over the socket:
+a header line, "column row width height", optionally followed by the layer
+options (see compositor.parse_header()), and then the text block.
+
+The files are written atomically (to a temporary file, which is then renamed
+into place), so the compositor never sees half a shard. Temporary files start
+with a '.' and don't end with SHARD_SUFFIX, so they're ignored.
+
+This only needs the standard library, so mirror_client.py can use it when
+it's run with 'python -S'.
+"""
+import os
+import tempfile
+from urllib.parse import quote, unquote
+
+SHARD_SUFFIX = '.shard'
+
+
+def get_shard_dir(term_file_path: str) -> str:
+    """ Returns the path of the directory that holds the shards
+    """
+    return term_file_path + '.shards'
+
+def get_shard_path(shard_dir: str, layer: str) -> str:
+    """ Returns the path of the shard for a layer. The layer name is
+    URL-encoded, so it can't contain a '/' (or start with a '.').
+    """
+    return os.path.join(shard_dir, quote(layer, safe='') + SHARD_SUFFIX)
+
+def get_shard_layer(file_name: str) -> str:
+    """ Returns the name of the layer a shard file holds, or None if the file
+    isn't a shard
+    """
+    if file_name.startswith('.') or not file_name.endswith(SHARD_SUFFIX):
+        return None
+    return unquote(file_name[:-len(SHARD_SUFFIX)])
+
+def write_shard(shard_dir: str, layer: str, data: bytes):
+    """ Input:
+            shard_dir: str - the shard directory (see get_shard_dir())
+            layer: str - the name of the layer (the config section)
+            data: bytes - the header line followed by the text block
+        Output:
+            Replaces the layer's shard with 'data'
+    """
+    os.makedirs(shard_dir, exist_ok=True)
+    path = get_shard_path(shard_dir, layer)
+    fd, temp_path = tempfile.mkstemp(
+        dir=shard_dir, prefix=f'.{os.path.basename(path)}.')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+            os.fchmod(f.fileno(), 0o644)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+
+def clear_shards(shard_dir: str):
+    """ Deletes all of the shards (i.e. when the screen is reset)
+    """
+    try:
+        names = os.listdir(shard_dir)
+    except FileNotFoundError:
+        return
+    for name in names:
+        if get_shard_layer(name) is not None:
+            os.unlink(os.path.join(shard_dir, name))
+
+class ShardSet:
+    """ Keeps track of the shards in the shard directory, so that only the
+    ones that changed since we last looked need to be read.
+    """
+    def __init__(self, shard_dir: str):
+        """ Input:
+                shard_dir: str - the shard directory (see get_shard_dir())
+        """
+        self.shard_dir = shard_dir
+        # The stat signature of each shard, as of the last scan(), keyed by
+        # layer name
+        self.signatures = {}
+
+    def scan(self):
+        """ Output:
+                (changed, removed): a dict containing the contents (bytes) of
+                    each shard that was added or changed since the last scan,
+                    keyed by layer name, and a list of the layers whose shards
+                    have been deleted
+        """
+        try:
+            entries = list(os.scandir(self.shard_dir))
+        except FileNotFoundError:
+            entries = []
+        changed = {}
+        seen = set()
+        for entry in entries:
+            layer = get_shard_layer(entry.name)
+            if layer is None:
+                continue
+            try:
+                stat = entry.stat()
+                # The shard is replaced (not edited) on every write, so a
+                # new inode means new contents, even if the mtime and size
+                # happen to be the same
+                signature = stat.st_ino, stat.st_mtime_ns, stat.st_size
+                seen.add(layer)
+                if self.signatures.get(layer) == signature:
+                    continue
+                with open(entry.path, 'rb') as f:
+                    changed[layer] = f.read()
+            except FileNotFoundError:
+                # It was deleted while we were looking at it
+                seen.discard(layer)
+                continue
+            self.signatures[layer] = signature
+        removed = [layer for layer in self.signatures if layer not in seen]
+        for layer in removed:
+            del self.signatures[layer]
+        return changed, removed
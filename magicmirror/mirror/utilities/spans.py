@@ -0,0 +1,171 @@
+""" A structured format for styled text blocks ("spans"), so that the stages
+of the pipeline (a plugin, color_text.py, update_mirror.py or the compositor)
+can hand each other text without turning it into escape sequences and
+parsing them back out again.
+
+A span is a run of characters that all have the same style:
+    [text, fg, bg, attrs]
+where fg, bg, and attrs mean the same thing they do in a cell (see
+utilities/sgr_tokenizer.py) - so a span is just a run of cells with the
+code points stuck together into a string (leaving out the continuation
+cells of wide characters, which come back when the span is decoded).
+
+A text block in the span format is:
+    - the header line, SPANS_HEADER (an ASCII record separator followed by
+      'spans 1'). Plain text and ANSI text never start with a record
+      separator, which is how we tell the two apart.
+    - one line per row of the block, each one a JSON list of spans.
+For example, "Hi" in green with a plain "!" after it, over two rows:
+    \\x1espans 1
+    [["Hi",16842496,0,0],["!",0,0,0]]
+    []
+Each row starts with a clean slate - unlike ANSI text, styles don't carry
+over from one row to the next.
+
+Decoding a row is one json.loads() (which happens in C) and a zip() per
+span, with no escape sequences to look for, so it's quite a bit cheaper than
+tokenizing the same row as ANSI text. Everything that accepts text blocks
+(update_mirror.py, mirror_client.py, the compositor) accepts both formats -
+use tokenize_block() rather than tokenize_text() and you get that for free.
+"""
+import json
+from itertools import repeat
+from utilities.char_width import CONTINUATION
+from utilities.sgr_tokenizer import (
+    BLANK_CELL,
+    code_points,
+    fit_cells,
+    tokenize_text,
+)
+
+SPANS_HEADER = '\x1espans 1'
+# fg, bg and attrs are each stored as an unsigned 32-bit int (see
+# utilities/cell_grid.py), so that's as big as they can get
+MAX_STYLE_VALUE = (1 << 32) - 1
+
+
+def is_spans(text: str) -> bool:
+    """ Returns True if 'text' is a text block in the span format
+    """
+    return text.startswith(SPANS_HEADER)
+
+def _check_style(fg, bg, attrs):
+    """ Raises a ValueError unless fg, bg and attrs are all ints that fit in
+    a cell (JSON true and false don't count, even though Python thinks bools
+    are ints)
+    """
+    for name, value in (('fg', fg), ('bg', bg), ('attrs', attrs)):
+        if type(value) is not int or not 0 <= value <= MAX_STYLE_VALUE:
+            raise ValueError(f'{name} should be an int from 0 to '
+                             f'{MAX_STYLE_VALUE}, not {value!r}')
+
+def cells_to_spans(cells: list) -> list:
+    """ Input:
+            cells: list of (code_point, fg, bg, attrs) tuples - a row of cells
+        Output:
+            spans: list of [text, fg, bg, attrs] lists - the same row, with
+                runs of cells that have the same style merged together
+    """
+    spans = []
+    text = []
+    style = None
+    for code_point, fg, bg, attrs in cells:
+        if (fg, bg, attrs) != style:
+            if text:
+                spans.append([''.join(text), *style])
+            text = []
+            style = (fg, bg, attrs)
+        if code_point != CONTINUATION:
+            text.append(chr(code_point))
+    if text:
+        spans.append([''.join(text), *style])
+    return spans
+
+def encode_span_rows(rows) -> str:
+    """ Input:
+            rows: iterable of lists of spans - i.e. the output of
+                cells_to_spans() for each row of a text block
+        Output:
+            the text block in the span format
+    """
+    return '\n'.join(iter_span_lines(rows))
+
+def iter_span_lines(rows):
+    """ Input:
+            rows: iterable of lists of spans (see encode_span_rows())
+        Output:
+            yields the lines of the text block in the span format (without
+            newlines) one at a time, starting with the header - so a block
+            can be written out as its rows come in
+    """
+    yield SPANS_HEADER
+    for spans in rows:
+        yield json.dumps(spans, ensure_ascii=False, separators=(',', ':'))
+
+def encode_spans(rows: list) -> str:
+    """ Input:
+            rows: list of lists of cells - a text block
+        Output:
+            the text block in the span format
+    """
+    return encode_span_rows(cells_to_spans(cells) for cells in rows)
+
+def decode_spans(text: str, width: int = None, height: int = None) -> list:
+    """ Input:
+            text: str - a text block in the span format
+            width: int - if given, each row is truncated or padded to this many
+                cells.
+            height: int - if given, the block is truncated or padded with blank
+                rows so that it has this many rows.
+        Output:
+            rows: list of lists of cells - the same thing tokenize_text() would
+                return for the same block in ANSI
+
+    Raises a ValueError if the block isn't valid, including when a span's
+    fg, bg or attrs isn't something that can be stored in a cell.
+    """
+    lines = text.split('\n')
+    if lines[0] != SPANS_HEADER:
+        raise ValueError('Not a text block in the span format')
+    # A trailing newline doesn't make an extra row
+    if len(lines) > 1 and lines[-1] == '':
+        lines.pop()
+    rows = []
+    for line_number, line in enumerate(lines[1:], 2):
+        if height is not None and len(rows) >= height:
+            break
+        cells = []
+        try:
+            for span_text, fg, bg, attrs in json.loads(line or '[]'):
+                # Checked inline (this runs once per span); _check_style()
+                # just works out what was wrong with it
+                if not (type(fg) is type(bg) is type(attrs) is int
+                        and 0 <= fg <= MAX_STYLE_VALUE
+                        and 0 <= bg <= MAX_STYLE_VALUE
+                        and 0 <= attrs <= MAX_STYLE_VALUE):
+                    _check_style(fg, bg, attrs)
+                cells.extend(zip(code_points(span_text), repeat(fg),
+                                 repeat(bg), repeat(attrs)))
+        except (TypeError, ValueError) as e:
+            raise ValueError(
+                f'Invalid spans on line {line_number}: {e}') from None
+        if width is not None:
+            fit_cells(cells, width)
+        rows.append(cells)
+    if height is not None and len(rows) < height:
+        blank_width = width or 0
+        rows.extend([BLANK_CELL]*blank_width
+                    for _ in range(height - len(rows)))
+    return rows
+
+def tokenize_block(text: str, width: int = None, height: int = None) -> list:
+    """ Input:
+            text: str - a text block, either in the span format or as (ANSI
+                formatted) text
+            width, height: ints - the same as for tokenize_text()
+        Output:
+            rows: list of lists of cells
+    """
+    if is_spans(text):
+        return decode_spans(text, width, height)
+    return tokenize_text(text, width, height)
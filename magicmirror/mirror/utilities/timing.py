@@ -0,0 +1,184 @@
+""" Optional timing of the stages of an update, for working out where the time
+goes when updates are slow.
+
+It's off unless the MIRROR_TIMING environment variable is set. Set it to the
+path of a log file, or to 1 to use timings.jsonl in the magicmirror/mirror
+directory. For the cron jobs, that means adding it to the [environment]
+section of magicmirror/config:
+    MIRROR_TIMING = 1
+Plugins that live outside of magicmirror/mirror (like plugins/api/weather.py)
+can only find this module if that directory is on PYTHONPATH, so to time
+them too, add it (as an absolute path - cron doesn't expand variables):
+    PYTHONPATH = /path/to/magic-mirror-zero/magicmirror/mirror
+
+Each stage is timed like this:
+    with stage('update.tokenize', bytes_in=len(text)) as timer:
+        cells = tokenize_text(text)
+        timer.count(cells=len(cells))
+and appended to the log file as a line of JSON, containing the name of the
+stage, how long it took (in seconds, measured with a monotonic clock), the
+program and process it happened in, and any counts (bytes in and out, cells,
+and so on) that were given.
+
+When timing is off, stage() hands back the same do-nothing object every
+time, so the cost is a function call. Counts that are expensive to work out
+should be guarded with 'if timing.ENABLED'.
+
+'python mirror_stats.py timings' summarizes the log.
+"""
+import os
+import sys
+import json
+import math
+import time
+
+TIMING_VARIABLE = 'MIRROR_TIMING'
+
+# This module lives in magicmirror/mirror/utilities
+_MIRROR_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_LOG_PATH = os.path.join(_MIRROR_DIR, 'timings.jsonl')
+
+_setting = os.environ.get(TIMING_VARIABLE, '').strip()
+ENABLED = _setting.lower() not in ('', '0', 'false', 'no')
+_log_fd = None
+
+
+def get_log_path(setting: str = None) -> str:
+    """ Returns the path of the timing log, given the value of MIRROR_TIMING
+    """
+    setting = _setting if setting is None else setting
+    if setting.lower() in ('', '0', 'false', 'no', '1', 'true', 'yes'):
+        return DEFAULT_LOG_PATH
+    return setting
+
+class Stage:
+    """ Times the block of a 'with' statement, and logs it when it's done
+    """
+    __slots__ = ('name', 'counts', 'start')
+
+    def __init__(self, name: str, counts: dict):
+        self.name = name
+        self.counts = counts
+        self.start = None
+
+    def count(self, **counts):
+        """ Adds counts (bytes_out=..., cells=...) to what gets logged
+        """
+        self.counts.update(counts)
+
+    def __enter__(self):
+        self.start = time.monotonic()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        seconds = time.monotonic() - self.start
+        if exc_type is not None:
+            self.counts['error'] = exc_type.__name__
+        record(self.name, seconds, **self.counts)
+
+class _NullStage:
+    """ What stage() returns when timing is off. Does nothing.
+    """
+    __slots__ = ()
+
+    def count(self, **counts):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        pass
+
+_NULL_STAGE = _NullStage()
+
+def stage(name: str, **counts):
+    """ Input:
+            name: str - the name of the stage, like 'update.tokenize'
+            counts: ints - anything else worth logging (bytes_in, cells, etc.)
+        Output:
+            a context manager that times its block (see the module docstring)
+    """
+    if not ENABLED:
+        return _NULL_STAGE
+    return Stage(name, counts)
+
+def record(name: str, seconds: float, **counts):
+    """ Appends a timing to the log file. Each one is written with a single
+    write() to a file opened in append mode, so processes logging at the same
+    time don't mix up each other's lines.
+    """
+    global _log_fd, ENABLED
+    entry = {
+        'stage': name,
+        'seconds': round(seconds, 7),
+        'program': os.path.basename(sys.argv[0]) if sys.argv else '',
+        'pid': os.getpid(),
+        'time': round(time.time(), 3),
+    }
+    entry.update(counts)
+    try:
+        if _log_fd is None:
+            _log_fd = os.open(get_log_path(),
+                              os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        os.write(_log_fd, json.dumps(entry).encode() + b'\n')
+    except OSError as e:
+        # Timing is for debugging - it shouldn't be able to break an update
+        sys.stderr.write(f'timing: disabled, could not write the log: {e}\n')
+        ENABLED = False
+
+def read_timings(log_path: str) -> list:
+    """ Returns the entries in a timing log, as a list of dictionaries. Lines
+    that can't be parsed (say, the last line of a log that's being written to)
+    are skipped.
+    """
+    entries = []
+    with open(log_path) as f:
+        for line in f:
+            try:
+                entries.append(json.loads(line))
+            except ValueError:
+                continue
+    return entries
+
+def percentile(values: list, fraction: float) -> float:
+    """ Returns the nearest-rank percentile of a sorted list of values, i.e.
+    fraction=0.95 for the 95th percentile
+    """
+    # The rank is the smallest one that has at least 'fraction' of the
+    # values at or below it. The rounding keeps float error (0.07*100 is
+    # 7.000000000000001) from pushing it up a rank.
+    rank = math.ceil(round(fraction*len(values), 9))
+    index = max(rank - 1, 0)
+    return values[min(index, len(values) - 1)]
+
+def summarize_timings(entries: list) -> dict:
+    """ Input:
+            entries: list of dicts - the entries from a timing log
+        Output:
+            summary: dict - for each stage, the number of times it ran, the
+                median, 95th percentile and max time it took (in seconds), and
+                the average of each of the counts that were logged with it
+    """
+    stages = {}
+    for entry in entries:
+        stages.setdefault(entry.get('stage', '?'), []).append(entry)
+    summary = {}
+    for name, stage_entries in stages.items():
+        seconds = sorted(entry['seconds'] for entry in stage_entries)
+        counts = {}
+        for entry in stage_entries:
+            for key, value in entry.items():
+                if key in ('seconds', 'pid', 'time') \
+                        or not isinstance(value, (int, float)):
+                    continue
+                counts.setdefault(key, []).append(value)
+        summary[name] = {
+            'count': len(seconds),
+            'p50': percentile(seconds, 0.5),
+            'p95': percentile(seconds, 0.95),
+            'max': seconds[-1],
+            'averages': {key: sum(values)/len(values)
+                         for key, values in counts.items()},
+        }
+    return summary
@@ -8,9 +8,22 @@ import time
 from datetime import datetime as dt
 import argparse
 import textwrap
+from contextlib import nullcontext
 from itertools import zip_longest
+from types import SimpleNamespace
 import requests
 
+# The timing instrumentation (see utilities/timing.py) lives with the rest of
+# the mirror's code, so it's only available if magicmirror/mirror is on
+# PYTHONPATH. Otherwise the stages just aren't timed.
+try:
+    from utilities.timing import stage
+except ImportError:
+    _UNTIMED = SimpleNamespace(count=lambda **counts: None)
+
+    def stage(name: str, **counts):
+        return nullcontext(_UNTIMED)
+
 MAX_RETRIES = 3
 # A 5 second timeout should work for most purposes, but if you have a
 # particularly slow connection you may need to increase this value
@@ -23,7 +36,9 @@ def make_request(url: str)->dict:
             returns a dictionary containing the requested data
     """
     for i in range(MAX_RETRIES):
-        req = requests.get(url, timeout=TIMEOUT)
+        with stage('weather.request', attempt=i) as timer:
+            req = requests.get(url, timeout=TIMEOUT)
+            timer.count(bytes_in=len(req.content), status=req.status_code)
         # This checks to see if the request returned a successful status code
         try:
             req.raise_for_status()
@@ -296,20 +311,22 @@ def forecast_handler(args: argparse.Namespace):
     if args.remove_field_names:
         data_fields = [i for i in data_fields if i not in args.remove_field_names]
 
-    forecast = quick_7_day_formatting(
-        col_limit=args.col_limit,
-        col_width=args.col_width,
-        col_padding=args.col_padding,
-        alignment=args.alignment,
-        include_current_period=args.include_current_period,
-        include_tonight=args.include_tonight,
-        start_index=args.start,
-        end_index=args.end,
-        include_day=args.include_day,
-        include_night=args.include_night,
-        data_fields=data_fields,
-    )
-    sys.stdout.write(forecast)
+    with stage('weather.forecast'):
+        forecast = quick_7_day_formatting(
+            col_limit=args.col_limit,
+            col_width=args.col_width,
+            col_padding=args.col_padding,
+            alignment=args.alignment,
+            include_current_period=args.include_current_period,
+            include_tonight=args.include_tonight,
+            start_index=args.start,
+            end_index=args.end,
+            include_day=args.include_day,
+            include_night=args.include_night,
+            data_fields=data_fields,
+        )
+    with stage('weather.write', bytes_out=len(forecast)):
+        sys.stdout.write(forecast)
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(
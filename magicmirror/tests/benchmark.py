@@ -0,0 +1,314 @@
+# !/bin/python
+""" Times how long it takes to update the mirror, so we can tell whether a
+change makes things slower on the Pi.
+
+Each benchmark works on its own term.txt in a temporary directory (the real
+one is left alone). For each screen size, we start from three kinds of
+screen:
+    - blank: what make_term_file.py creates
+    - random: every cell is a randomly colored half-block on a randomly
+      colored background (term_test.fill_screen_random()). This is the worst
+      case - every cell needs its own escape sequence.
+    - solid: every cell is the same colored half-block
+      (term_test.fill_screen_solid())
+and then time:
+    - single_region: one clock-sized text block
+    - many_regions: a dozen small text blocks, one insert_text_block() each
+    - batch_regions: the same dozen blocks in one insert_text_blocks() call
+    - full_screen: a text block that covers the whole screen
+    - tokenize_row: break_line_into_characters() on one row of term.txt
+
+The results are written to a JSON file, which can be kept as a baseline.
+Later runs can be compared against it, and anything that got slower by more
+than the threshold is flagged. We compare the fastest of the runs, since
+that's the one the rest of the system interfered with the least.
+
+example:
+    python benchmark.py run --output baseline.json
+    (make some changes)
+    python benchmark.py compare baseline.json --threshold 0.2
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import statistics
+import tempfile
+
+# The mirror's modules expect to be run from the mirror directory
+this_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(this_dir), 'mirror'))
+
+import term_test
+from make_term_file import make_term_file
+from update_mirror import (
+    break_line_into_characters,
+    insert_text_block,
+    insert_text_blocks,
+    read_term_rows,
+)
+from utilities.color_depth import get_color_depth
+
+SIZES = ((80, 24), (160, 48), (240, 67), (480, 135))
+SCREENS = ('blank', 'random', 'solid')
+# Regressions smaller than this (in seconds) are just noise
+MIN_REGRESSION = 0.0005
+
+
+def parse_size(size: str) -> tuple:
+    """ Turns '240x67' into (240, 67)
+    """
+    try:
+        width, height = (int(i) for i in size.lower().split('x'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            f'expected a size like 240x67, got {size!r}')
+    return width, height
+
+def make_screen(kind: str, width: int, height: int) -> str:
+    """ Returns the text for a screen of the given kind ('blank', 'random', or
+    'solid'), or None for a blank screen
+    """
+    if kind == 'random':
+        return term_test.fill_screen_random(width, height)
+    if kind == 'solid':
+        return term_test.fill_screen_solid(width, height)
+    return None
+
+def clock_block() -> str:
+    """ A colored text block about the size of the clock widget
+    """
+    line = '\x1b[38;2;50;205;50m' + '█'*18 + '\x1b[0m'
+    return '\n'.join([line]*5)
+
+def small_blocks(width: int, height: int) -> list:
+    """ A dozen small text blocks, scattered over the screen
+    """
+    blocks = []
+    for i in range(12):
+        column = (i*29) % max(width - 20, 1)
+        row = (i*7) % max(height - 3, 1)
+        text = f'\x1b[1;33mwidget {i:2}\x1b[0m\nsome text\n{i*1234:>12}'
+        blocks.append({'text': text, 'column': column, 'row': row,
+                       'width': 20, 'height': 3})
+    return blocks
+
+def time_it(function, repeats: int) -> dict:
+    """ Input:
+            function: a function that takes no arguments
+            repeats: int - how many times to run it
+        Output:
+            timings: dict - the median, min, and max time it took, in seconds
+    """
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return {
+        'median': statistics.median(times),
+        'min': min(times),
+        'max': max(times),
+        'repeats': repeats,
+    }
+
+def benchmark_screen(kind: str, width: int, height: int, repeats: int,
+                     directory: str) -> dict:
+    """ Input:
+            kind: str - 'blank', 'random', or 'solid'
+            width, height: ints - the size of the screen
+            repeats: int - how many times to run each benchmark
+            directory: str - where to put term.txt
+        Output:
+            results: dict - the timings for each benchmark, keyed by name
+    """
+    term_file_path = os.path.join(directory, 'term.txt')
+    make_term_file(width, height, term_file_path)
+    screen = make_screen(kind, width, height)
+
+    def reset():
+        if screen is not None:
+            insert_text_block(screen, 0, 0, width, height, term_file_path)
+
+    reset()
+    results = {}
+    clock = clock_block()
+    results['single_region'] = time_it(
+        lambda: insert_text_block(clock, 1, 1, 20, 5, term_file_path),
+        repeats)
+    reset()
+    blocks = small_blocks(width, height)
+
+    def many_regions():
+        for block in blocks:
+            insert_text_block(block['text'], block['column'], block['row'],
+                              block['width'], block['height'], term_file_path)
+
+    results['many_regions'] = time_it(many_regions, repeats)
+    reset()
+    results['batch_regions'] = time_it(
+        lambda: insert_text_blocks(blocks, term_file_path), repeats)
+    full = screen or make_screen('solid', width, height)
+    results['full_screen'] = time_it(
+        lambda: insert_text_block(full, 0, 0, width, height, term_file_path),
+        repeats)
+    reset()
+    row = read_term_rows(term_file_path, height//2, height//2 + 1)[0]
+    results['tokenize_row'] = time_it(
+        lambda: break_line_into_characters(row), repeats)
+    return results
+
+def run_benchmarks(sizes=SIZES, screens=SCREENS, repeats: int = 5) -> dict:
+    """ Input:
+            sizes: list of (width, height) tuples
+            screens: list of str - which kinds of screen to start from
+            repeats: int - how many times to run each benchmark
+        Output:
+            report: dict - some information about the machine, and the timings
+                for each benchmark, keyed by "<width>x<height>/<screen>/<name>"
+    """
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for width, height in sizes:
+            for kind in screens:
+                # So the random screens are the same from run to run, even if
+                # we only run some of the benchmarks
+                random.seed(f'{width}x{height}/{kind}')
+                screen_results = benchmark_screen(
+                    kind, width, height, repeats, directory)
+                for name, timings in screen_results.items():
+                    key = f'{width}x{height}/{kind}/{name}'
+                    results[key] = timings
+                    sys.stderr.write(
+                        f'{key:40} {timings["min"]*1000:9.2f} ms\n')
+    return {
+        'machine': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'processor': platform.machine(),
+            'color_depth': get_color_depth(),
+        },
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'results': results,
+    }
+
+def compare(baseline: dict, current: dict, threshold: float) -> list:
+    """ Input:
+            baseline: dict - a report from run_benchmarks()
+            current: dict - another report from run_benchmarks()
+            threshold: float - how much slower a benchmark can get before it
+                counts as a regression (0.2 means 20% slower)
+        Output:
+            lines: list of (key, old, new, ratio, regressed) tuples, one for each
+                benchmark the two reports have in common
+    """
+    lines = []
+    for key, timings in current['results'].items():
+        if key not in baseline['results']:
+            continue
+        old = baseline['results'][key]['min']
+        new = timings['min']
+        ratio = new/old if old else float('inf')
+        regressed = ratio > 1 + threshold and new - old > MIN_REGRESSION
+        lines.append((key, old, new, ratio, regressed))
+    return lines
+
+def print_comparison(lines: list):
+    """ Prints the output of compare() as a table
+    """
+    for key, old, new, ratio, regressed in lines:
+        flag = '  REGRESSION' if regressed else ''
+        print(f'{key:40} {old*1000:9.2f} ms -> {new*1000:9.2f} ms '
+              f'({ratio:5.2f}x){flag}')
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest='mode', required=True)
+    run = subparsers.add_parser(
+        'run',
+        help='Runs the benchmarks and saves the results'
+    )
+    run.add_argument(
+        '-o',
+        '--output',
+        default='benchmark.json',
+        help='Where to save the results (default: benchmark.json)'
+    )
+    check = subparsers.add_parser(
+        'compare',
+        help='''
+        Runs the benchmarks and compares them with a baseline saved by "run".
+        Exits with status 1 if anything got slower than the threshold allows.
+        '''
+    )
+    check.add_argument(
+        'baseline',
+        help='The results to compare against'
+    )
+    check.add_argument(
+        '--current',
+        help='''
+        Compare these saved results with the baseline, instead of running the
+        benchmarks again
+        '''
+    )
+    check.add_argument(
+        '-t',
+        '--threshold',
+        type=float,
+        default=0.2,
+        help='''
+        How much slower a benchmark can get before it's flagged, as a fraction
+        (default: 0.2, i.e. 20%% slower)
+        '''
+    )
+    for subparser in (run, check):
+        subparser.add_argument(
+            '-s',
+            '--sizes',
+            nargs='+',
+            type=parse_size,
+            default=SIZES,
+            help='''
+            The screen sizes to benchmark, like 80x24 240x67
+            (default: 80x24 160x48 240x67 480x135)
+            '''
+        )
+        subparser.add_argument(
+            '--screens',
+            nargs='+',
+            choices=SCREENS,
+            default=SCREENS,
+            help='The kinds of screen to start from (default: all of them)'
+        )
+        subparser.add_argument(
+            '-r',
+            '--repeats',
+            type=int,
+            default=5,
+            help='How many times to run each benchmark (default: 5)'
+        )
+    args = parser.parse_args()
+
+    if args.mode == 'run':
+        report = run_benchmarks(args.sizes, args.screens, args.repeats)
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        sys.exit(0)
+
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    if args.current:
+        with open(args.current) as f:
+            current = json.load(f)
+    else:
+        current = run_benchmarks(args.sizes, args.screens, args.repeats)
+    if baseline['machine'] != current['machine']:
+        print('warning: the baseline was recorded on a different machine (or '
+              'with a different color depth)')
+    lines = compare(baseline, current, args.threshold)
+    print_comparison(lines)
+    sys.exit(1 if any(line[4] for line in lines) else 0)
@@ -0,0 +1,67 @@
+""" Checks that CellGrid.write_row() and write_block() clip anything that falls
+outside of the grid, instead of writing over the cells next to it (or raising
+an error).
+
+example:
+    python -m pytest cell_grid_test.py
+"""
+import os
+import tempfile
+
+from utilities.cell_grid import CellGrid
+from utilities.sgr_tokenizer import BLANK_CELL
+
+WIDTH = 8
+HEIGHT = 3
+
+
+def make_grid(directory: str) -> CellGrid:
+    """ Returns a blank WIDTH x HEIGHT grid in 'directory'
+    """
+    return CellGrid.create(os.path.join(directory, 'term.grid'), WIDTH, HEIGHT)
+
+def cells(text: str) -> list:
+    """ Returns a row of cells with the default colors, one per character
+    """
+    return [(ord(char), 0, 0, 0) for char in text]
+
+def text(row: list) -> str:
+    """ Returns the characters in a row of cells
+    """
+    return ''.join(chr(cell[0]) for cell in row)
+
+def test_negative_column_on_first_row():
+    with tempfile.TemporaryDirectory() as directory, \
+            make_grid(directory) as grid:
+        grid.write_row(-2, 0, cells('abcd'))
+        assert text(grid.read_row(0)) == 'cd      '
+
+def test_negative_column_leaves_previous_row_alone():
+    with tempfile.TemporaryDirectory() as directory, \
+            make_grid(directory) as grid:
+        grid.write_row(0, 0, cells('01234567'))
+        grid.write_row(-3, 1, cells('abcde'))
+        assert text(grid.read_row(0)) == '01234567'
+        assert text(grid.read_row(1)) == 'de      '
+
+def test_entirely_off_screen():
+    with tempfile.TemporaryDirectory() as directory, \
+            make_grid(directory) as grid:
+        grid.write_row(-5, 1, cells('abc'))
+        grid.write_row(WIDTH, 1, cells('abc'))
+        grid.write_row(0, -1, cells('abc'))
+        grid.write_row(0, HEIGHT, cells('abc'))
+        assert grid.read_rows() == [[BLANK_CELL]*WIDTH]*HEIGHT
+
+def test_partly_off_both_edges():
+    with tempfile.TemporaryDirectory() as directory, \
+            make_grid(directory) as grid:
+        grid.write_row(-1, 2, cells('abcdefghijk'))
+        assert text(grid.read_row(2)) == 'bcdefghi'
+
+def test_block_partly_off_screen():
+    with tempfile.TemporaryDirectory() as directory, \
+            make_grid(directory) as grid:
+        grid.write_block(-2, 1, [cells('abcd'), cells('efgh'), cells('ijkl')])
+        assert [text(row) for row in grid.read_rows()] == \
+            ['        ', 'cd      ', 'gh      ']
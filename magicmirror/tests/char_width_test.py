@@ -0,0 +1,31 @@
+""" Checks how many cells characters take up once they've been tokenized:
+wide characters, zero-width characters, and control characters (which
+mustn't turn into cells that look like the second half of a wide character).
+
+example:
+    python -m pytest char_width_test.py
+"""
+from utilities.char_width import CONTINUATION, column_code_points, text_width
+from utilities.sgr_tokenizer import tokenize_text
+from utilities.spans import decode_spans, encode_spans
+
+
+def test_wide_and_zero_width():
+    assert column_code_points('a中b') == \
+        [ord('a'), 0x4e2d, CONTINUATION, ord('b')]
+    assert column_code_points('é​x') == [0xe9, ord('x')]
+
+def test_controls_are_spaces():
+    for text in ('a\x00b\x01c\x7f', 'a\x00b\x01c\x7fé\x85'):
+        code_points = column_code_points(text)
+        assert len(code_points) == text_width(text) == len(text)
+        assert CONTINUATION not in code_points
+        assert all(code_point >= 32 for code_point in code_points)
+
+def test_controls_keep_their_column():
+    rows = tokenize_text('a\x00b\x01c', 6, 1)
+    assert ''.join(chr(cell[0]) for cell in rows[0]) == 'a b c '
+    # So a NUL doesn't vanish on the way through the span format
+    assert decode_spans(encode_spans(rows)) == rows
+    rows = tokenize_text('\x1b[1ma\x00b\tc', 6, 1)
+    assert ''.join(chr(cell[0]) for cell in rows[0]) == 'a b c '
@@ -0,0 +1,125 @@
+""" Checks that ColorComponent.at() and LinearColorTracker.at() give exactly the
+same colors as stepping through the gradient one character at a time.
+
+These are property tests: each one tries a few thousand randomly generated
+gradients (bounce or not, whole and fractional increments, tiny and huge
+increments, narrow and wide ranges) and compares the two. The random seed is
+fixed, so a failure can be reproduced.
+
+example:
+    python -m pytest color_tracker_test.py
+"""
+import random
+
+from utilities.color_tracker import ColorComponent, LinearColorTracker
+
+SEED = 2024
+CASES = 2000
+
+
+def random_component_settings(rng: random.Random) -> dict:
+    """ Returns the arguments for a random (but valid) ColorComponent
+    """
+    min_val = rng.randint(0, 254)
+    max_val = rng.randint(min_val + 1, 255)
+    width = max_val - min_val
+    inc = rng.choice([
+        0,
+        rng.randint(-20, 20),
+        rng.uniform(-80, 80),
+        rng.uniform(-1, 1),
+        # Increments that land exactly on the edges of the range
+        width / rng.randint(1, 12),
+        -width / rng.randint(1, 12),
+        # Increments that don't quite divide the range evenly
+        1/3, -0.1, 2.5,
+        # Bigger than the whole range
+        rng.choice([-1, 1]) * (width + rng.uniform(0, 300)),
+    ])
+    return {
+        'value': rng.randint(min_val, max_val),
+        'inc': inc,
+        'min_val': min_val,
+        'max_val': max_val,
+        'bounce': rng.random() < 0.75,
+    }
+
+def random_tracker_settings(rng: random.Random) -> dict:
+    """ Returns the arguments for a random (but valid) LinearColorTracker
+    """
+    components = [random_component_settings(rng) for _ in range(3)]
+    vert_incs = [random_component_settings(rng)['inc'] for _ in range(3)]
+    return {
+        'rgb': tuple(c['value'] for c in components),
+        'horz_inc': tuple(c['inc'] for c in components),
+        'vert_inc': tuple(vert_incs),
+        'min_vals': tuple(c['min_val'] for c in components),
+        'max_vals': tuple(c['max_val'] for c in components),
+        'bounce': rng.random() < 0.75,
+    }
+
+def test_component_at_matches_stepping():
+    rng = random.Random(SEED)
+    for _ in range(CASES):
+        settings = random_component_settings(rng)
+        steps = rng.randint(1, 400)
+        component = ColorComponent(**settings)
+        stepped = [component.__next__() for _ in range(steps)]
+        fresh = ColorComponent(**settings)
+        assert [fresh.at(n) for n in range(steps)] == stepped, settings
+
+def test_component_at_doesnt_change_state():
+    rng = random.Random(SEED + 1)
+    for _ in range(CASES // 10):
+        settings = random_component_settings(rng)
+        component = ColorComponent(**settings)
+        # Asking out of order (and more than once) shouldn't matter
+        for n in rng.sample(range(500), 50):
+            component.at(n)
+        stepped = [component.__next__() for _ in range(100)]
+        assert stepped == [ColorComponent(**settings).at(n)
+                           for n in range(100)], settings
+
+def test_component_at_with_value():
+    rng = random.Random(SEED + 2)
+    for _ in range(CASES):
+        settings = random_component_settings(rng)
+        component = ColorComponent(**settings)
+        value = rng.randint(settings['min_val'], settings['max_val'])
+        # change() is what newline() uses to start a new row
+        component.change(value)
+        stepped = [component.__next__() for _ in range(200)]
+        fresh = ColorComponent(**settings)
+        assert [fresh.at(n, value) for n in range(200)] == stepped, settings
+
+def test_tracker_at_matches_stepping():
+    rng = random.Random(SEED + 3)
+    for _ in range(CASES // 4):
+        settings = random_tracker_settings(rng)
+        width = rng.randint(1, 60)
+        height = rng.randint(1, 30)
+        tracker = LinearColorTracker(**settings)
+        stepped = []
+        for _ in range(height):
+            stepped.append([tracker.__next__() for _ in range(width)])
+            tracker.newline()
+        fresh = LinearColorTracker(**settings)
+        at = [[fresh.at(x, y) for x in range(width)] for y in range(height)]
+        assert at == stepped, settings
+
+def test_tracker_at_sub_rectangle():
+    rng = random.Random(SEED + 4)
+    for _ in range(CASES // 10):
+        settings = random_tracker_settings(rng)
+        tracker = LinearColorTracker(**settings)
+        stepped = []
+        for _ in range(40):
+            stepped.append([tracker.__next__() for _ in range(80)])
+            tracker.newline()
+        fresh = LinearColorTracker(**settings)
+        # Only the cells a partial re-render would need
+        left, top = rng.randint(0, 79), rng.randint(0, 39)
+        right, bottom = rng.randint(left, 79), rng.randint(top, 39)
+        for y in range(top, bottom + 1):
+            for x in range(left, right + 1):
+                assert fresh.at(x, y) == stepped[y][x], (settings, x, y)
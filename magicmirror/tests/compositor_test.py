@@ -0,0 +1,54 @@
+""" Checks what happens to the screen when the mirror is restarted with the
+last frame restored (start_mirror.sh runs the compositor with --restore).
+
+example:
+    python -m pytest compositor_test.py
+"""
+import os
+import tempfile
+
+from compositor import Compositor
+from make_term_file import make_term_file
+from utilities.sgr_tokenizer import DIM
+
+WIDTH = 10
+HEIGHT = 2
+
+
+def row_text(compositor: Compositor, row: int) -> str:
+    """ Returns the characters on a row of the screen
+    """
+    return ''.join(chr(cell[0]) for cell in compositor.grid.read_row(row))
+
+def dimmed(compositor: Compositor, row: int) -> str:
+    """ Returns a row of the screen with '*' for every dimmed cell, and '.'
+    for every other one
+    """
+    return ''.join('*' if cell[3] & DIM else '.'
+                   for cell in compositor.grid.read_row(row))
+
+def restart(term_file_path: str) -> Compositor:
+    """ Does what start_mirror.sh does when the mirror starts up again
+    """
+    make_term_file(WIDTH, HEIGHT, term_file_path, restore=True)
+    return Compositor(term_file_path, restore=True)
+
+def test_refreshed_layer_replaces_last_frame():
+    with tempfile.TemporaryDirectory() as directory:
+        term_file_path = os.path.join(directory, 'term.txt')
+        make_term_file(WIDTH, HEIGHT, term_file_path)
+        compositor = Compositor(term_file_path)
+        compositor.update('12:00', 2, 0, 5, 1, 'clock', transparent='spaces')
+        compositor.close()
+
+        compositor = restart(term_file_path)
+        try:
+            assert row_text(compositor, 0) == '  12:00   '
+            assert dimmed(compositor, 0) == '**********'
+            compositor.update(' 1:01', 2, 0, 5, 1, 'clock',
+                              transparent='spaces')
+            # Nothing left over from the old frame under the clock's space
+            assert row_text(compositor, 0) == '   1:01   '
+            assert dimmed(compositor, 0) == '**.....***'
+        finally:
+            compositor.close()
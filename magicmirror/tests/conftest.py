@@ -0,0 +1,10 @@
+""" Shared set up for the tests. The mirror's modules expect to be run from
+the mirror directory (they import each other as 'utilities.cell_grid' and so
+on), so it goes on the path before pytest imports any of the test files.
+"""
+import os
+import sys
+
+MIRROR_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'mirror')
+sys.path.insert(0, MIRROR_DIR)
@@ -0,0 +1,49 @@
+""" Checks that the crontab lines cron_launcher.py writes survive cron's
+handling of '%' (which ends the command, unless it's backslash escaped).
+
+example:
+    python -m pytest cron_launcher_test.py
+"""
+import re
+import shlex
+
+from cron_launcher import layer_options
+
+
+def crontab_line(section_name: str, section: dict) -> str:
+    """ Returns a crontab line for a section, put together the same way
+    cron_formatter() does it (without needing the project directory)
+    """
+    options = layer_options(section_name, section, as_crontab=True)
+    return f'* * * * * date | python -S mirror_client.py {options}0 0 10 1'
+
+def run_like_cron(line: str) -> list:
+    """ Input:
+            line: str - a crontab line
+        Output:
+            the arguments the shell would get for the last command in the
+            pipeline, after cron has cut the command off at the first
+            unescaped '%' and unescaped the rest
+    """
+    command = line.split(None, 5)[5]
+    command = re.split(r'(?<!\\)%', command)[0].replace('\\%', '%')
+    return shlex.split(command.split(' | ')[-1])
+
+def test_percent_in_layer_name():
+    args = run_like_cron(crontab_line('cpu 50% load', {}))
+    assert args[args.index('--layer') + 1] == 'cpu 50% load'
+    assert args[-4:] == ['0', '0', '10', '1']
+
+def test_percent_in_transparent():
+    args = run_like_cron(crontab_line('clock', {'transparent': '%'}))
+    assert args[args.index('--transparent') + 1] == '%'
+    assert args[-4:] == ['0', '0', '10', '1']
+
+def test_command_file_isnt_escaped():
+    # command.sh is run by bash, not cron, so there's nothing to escape
+    args = shlex.split(layer_options('cpu 50% load', {}))
+    assert args == ['--layer', 'cpu 50% load']
+
+def test_layer_options_without_percent():
+    assert layer_options('clock', {'z_index': '2'}, as_crontab=True) == \
+        layer_options('clock', {'z_index': '2'}) == '--layer clock --z 2 '
@@ -0,0 +1,101 @@
+""" Checks that the compositor skips an update only when the text block is
+already on the screen - and not once something else has written over it.
+
+example:
+    python -m pytest region_hashes_test.py
+"""
+import os
+import tempfile
+
+from compositor import Compositor
+from update_mirror import render_term_file
+from utilities.atomic_file import publish_lock
+from utilities.cell_grid import CellGrid, get_grid_path
+from utilities.region_hashes import RegionHashes
+from utilities.sgr_tokenizer import tokenize_line
+
+WIDTH = 20
+HEIGHT = 4
+
+
+def replace_file(path: str, data: bytes):
+    """ Replaces a file the way term.txt gets published (a new file renamed
+    over the old one)
+    """
+    with open(path + '.new', 'wb') as f:
+        f.write(data)
+    os.replace(path + '.new', path)
+
+def make_screen(directory: str) -> str:
+    """ Makes a blank WIDTH x HEIGHT screen (grid and term.txt) in
+    'directory', and returns the path of its term.txt
+    """
+    term_file_path = os.path.join(directory, 'term.txt')
+    with publish_lock(term_file_path), CellGrid.create(
+            get_grid_path(term_file_path), WIDTH, HEIGHT) as grid:
+        render_term_file(grid, term_file_path)
+    return term_file_path
+
+def row_text(compositor: Compositor, row: int) -> str:
+    """ Returns the characters on a row of the screen
+    """
+    return ''.join(chr(cell[0]) for cell in compositor.grid.read_row(row))
+
+def test_identical_update_is_skipped():
+    with tempfile.TemporaryDirectory() as directory:
+        hashes = RegionHashes(os.path.join(directory, 'term.txt'))
+        assert not hashes.unchanged((0, 0, 5, 1), 'hello')
+        hashes.record((0, 0, 5, 1), 'hello')
+        assert hashes.unchanged((0, 0, 5, 1), 'hello')
+        assert not hashes.unchanged((0, 0, 5, 1), 'world')
+        # The same text in a different region is a different update
+        assert not hashes.unchanged((1, 0, 5, 1), 'hello')
+        assert hashes.stats() == {'applied': 1, 'skipped': 1, 'regions': 1}
+
+def test_overlapping_record_forgets():
+    with tempfile.TemporaryDirectory() as directory:
+        hashes = RegionHashes(os.path.join(directory, 'term.txt'))
+        hashes.record((0, 0, 5, 2), 'a')
+        hashes.record((10, 0, 5, 2), 'b')
+        hashes.record((4, 1, 3, 1), 'c')
+        assert not hashes.unchanged((0, 0, 5, 2), 'a')
+        assert hashes.unchanged((10, 0, 5, 2), 'b')
+        assert hashes.unchanged((4, 1, 3, 1), 'c')
+
+def test_published_by_someone_else_forgets():
+    with tempfile.TemporaryDirectory() as directory:
+        term_file_path = os.path.join(directory, 'term.txt')
+        replace_file(term_file_path, b'one')
+        hashes = RegionHashes(term_file_path)
+        hashes.record((0, 0, 5, 1), 'hello')
+        hashes.published()
+        assert hashes.unchanged((0, 0, 5, 1), 'hello')
+        replace_file(term_file_path, b'two')
+        assert not hashes.unchanged((0, 0, 5, 1), 'hello')
+
+def test_compositor_skips_only_what_is_on_screen():
+    with tempfile.TemporaryDirectory() as directory:
+        term_file_path = make_screen(directory)
+        compositor = Compositor(term_file_path)
+        try:
+            assert compositor.update('hello', 0, 0, 5, 1)
+            stat = os.stat(term_file_path)
+            assert not compositor.update('hello', 0, 0, 5, 1)
+            # term.txt wasn't touched, so the renderer isn't woken up
+            assert os.stat(term_file_path).st_mtime_ns == stat.st_mtime_ns
+            assert os.stat(term_file_path).st_ino == stat.st_ino
+
+            # Written over by something else (like update_mirror.py), without
+            # the compositor knowing
+            compositor.grid.write_row(1, 0, tokenize_line('xx'))
+            with publish_lock(term_file_path):
+                render_term_file(compositor.grid, term_file_path)
+            assert compositor.update('hello', 0, 0, 5, 1)
+            assert row_text(compositor, 0).startswith('hello')
+
+            # Written over by another region
+            assert compositor.update('=====', 3, 0, 5, 1)
+            assert compositor.update('hello', 0, 0, 5, 1)
+            assert row_text(compositor, 0).startswith('hello===')
+        finally:
+            compositor.close()
@@ -0,0 +1,114 @@
+""" Checks that encode_row() loses nothing: tokenizing the row it writes gets
+back the same cells (with the colors converted for the color depth, if
+they need to be), apart from things that don't show, like the foreground
+color of a plain space.
+
+The property test tries a few thousand random rows, with runs of the same
+style (so there are style changes to minimize as well as ones to make),
+every attribute, all three kinds of color, and wide characters - including
+halves of wide characters left behind by an overlapping text block. The
+random seed is fixed, so a failure can be reproduced.
+
+example:
+    python -m pytest sgr_encoder_test.py
+"""
+import random
+
+from utilities.char_width import CONTINUATION, fix_wide_cells
+from utilities.color_depth import COLOR_DEPTHS, downconvert_row
+from utilities.sgr_encoder import encode_row
+from utilities.sgr_tokenizer import (
+    BLANK_CELL,
+    BOLD,
+    DIM,
+    ITALIC,
+    REVERSE,
+    STRIKE,
+    UNDERLINE,
+    palette_color,
+    rgb_color,
+    tokenize_line,
+)
+
+SEED = 2024
+CASES = 2000
+WIDE = 0x4e2d
+# Attributes that show up on a space (see sgr_encoder.py)
+SPACE_ATTRS = UNDERLINE | REVERSE | STRIKE
+
+
+def looks(cells: list) -> list:
+    """ Returns a row of cells with the plain spaces (which look the same
+    whatever their foreground and their other attributes are) made blank,
+    and continuation cells given the style of their wide character (which
+    is what both columns are drawn with)
+    """
+    out = []
+    for cell in cells:
+        if cell[0] == CONTINUATION:
+            cell = (CONTINUATION,) + out[-1][1:]
+        elif cell[0] == 32 and not cell[2] and not cell[3] & SPACE_ATTRS:
+            cell = BLANK_CELL
+        out.append(cell)
+    return out
+
+def assert_round_trip(cells: list):
+    """ Checks that a row of cells comes back from encode_row() and
+    tokenize_line() the way it went in, at every color depth
+    """
+    for color_depth in COLOR_DEPTHS:
+        expected = fix_wide_cells(downconvert_row(cells, color_depth))
+        encoded = encode_row(cells, color_depth)
+        assert looks(tokenize_line(encoded)) == looks(expected), \
+            (color_depth, cells, encoded)
+
+def random_color(rng: random.Random) -> int:
+    """ Returns a random color id: default, palette or RGB
+    """
+    kind = rng.random()
+    if kind < 0.3:
+        return 0
+    if kind < 0.6:
+        return palette_color(rng.choice([rng.randrange(16),
+                                         rng.randrange(256)]))
+    return rgb_color(rng.randrange(256), rng.randrange(256),
+                     rng.randrange(256))
+
+def random_row(rng: random.Random) -> list:
+    """ Returns a random row of cells, made of runs that share a style
+    """
+    cells = []
+    while len(cells) < 40:
+        style = (random_color(rng), random_color(rng), rng.randrange(256))
+        for _ in range(rng.randint(1, 6)):
+            kind = rng.random()
+            if kind < 0.1:
+                cells.append((WIDE, *style))
+                cells.append((CONTINUATION, *style))
+            elif kind < 0.12:
+                # Half of a wide character
+                cells.append((rng.choice([WIDE, CONTINUATION]), *style))
+            elif kind < 0.4:
+                cells.append((32, *style))
+            else:
+                cells.append((rng.choice(b'aZ#~'), *style))
+    return cells
+
+def test_bold_and_dim():
+    # 22 turns off bold and dim together, so going from bold and dim to just
+    # one of them has to turn the other one back on
+    attrs = [BOLD | DIM, DIM, BOLD | DIM, BOLD, 0, DIM | ITALIC,
+             BOLD | ITALIC, BOLD | DIM | UNDERLINE, DIM]
+    assert_round_trip([(ord('x'), 0, 0, a) for a in attrs])
+    assert_round_trip([(ord('x'), palette_color(1), 0, a) for a in attrs])
+
+def test_spaces():
+    red = rgb_color(255, 0, 0)
+    assert_round_trip([(ord('a'), red, 0, BOLD), (32, red, 0, BOLD),
+                       (32, 0, red, 0), (32, 0, 0, UNDERLINE), (32, 0, 0, 0),
+                       (ord('b'), red, 0, BOLD)])
+
+def test_random_rows():
+    rng = random.Random(SEED)
+    for _ in range(CASES):
+        assert_round_trip(random_row(rng))
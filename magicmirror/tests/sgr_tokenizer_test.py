@@ -0,0 +1,79 @@
+""" Checks that the SGR tokenizer keeps track of the style the way a terminal
+would, and that rendering the cells it returns and tokenizing them again
+gets back exactly the same cells.
+
+example:
+    python -m pytest sgr_tokenizer_test.py
+"""
+from utilities.color_depth import TRUECOLOR
+from utilities.sgr_encoder import encode_row
+from utilities.sgr_tokenizer import (
+    BOLD,
+    DIM,
+    ITALIC,
+    UNDERLINE,
+    palette_color,
+    render_cells,
+    rgb_color,
+    tokenize_line,
+)
+
+RED = palette_color(1)
+GREEN = palette_color(2)
+
+
+def styles(line: str) -> list:
+    """ Returns the (fg, bg, attrs) of each cell 'line' is tokenized into,
+    after checking that its characters came through and that it survives
+    a round trip
+    """
+    cells = tokenize_line(line)
+    assert ''.join(chr(cell[0]) for cell in cells) == 'abcdefgh'[:len(cells)]
+    assert_round_trip(cells)
+    return [cell[1:] for cell in cells]
+
+def assert_round_trip(cells: list):
+    """ Checks that rendering a row of cells (one escape sequence per cell, or
+    as few as possible) and tokenizing it again gets back the same cells
+    """
+    assert tokenize_line(render_cells(cells)) == cells
+    assert tokenize_line(encode_row(cells, TRUECOLOR)) == cells
+
+def test_partial_resets():
+    assert styles('\x1b[1;31;42ma\x1b[39mb\x1b[49mc\x1b[4md\x1b[24me') == [
+        (RED, GREEN, BOLD), (0, GREEN, BOLD), (0, 0, BOLD),
+        (0, 0, BOLD | UNDERLINE), (0, 0, BOLD)]
+
+def test_22_turns_off_bold_and_dim():
+    assert styles('\x1b[1;2;3ma\x1b[22mb\x1b[2mc\x1b[0md') == [
+        (0, 0, BOLD | DIM | ITALIC), (0, 0, ITALIC), (0, 0, DIM | ITALIC),
+        (0, 0, 0)]
+
+def test_21_is_double_underline():
+    assert styles('\x1b[1;21ma\x1b[24mb') == [
+        (0, 0, BOLD | UNDERLINE), (0, 0, BOLD)]
+
+def test_colon_colors():
+    assert styles('\x1b[38:2::255:0:0ma\x1b[48:5:196mb'
+                  '\x1b[38:2:10:20:30;39mc\x1b[38:5:2md') == [
+        (rgb_color(255, 0, 0), 0, 0),
+        (rgb_color(255, 0, 0), palette_color(196), 0),
+        (0, palette_color(196), 0),
+        (GREEN, palette_color(196), 0)]
+
+def test_malformed_extended_colors():
+    # The rest of a sequence with a bad 38/48 in it is skipped, but
+    # anything before it still counts
+    assert styles('\x1b[31ma\x1b[38;5mb\x1b[38;2;1;2mc\x1b[1;48;9;4md'
+                  '\x1b[38:7:1me\x1b[0;38;2;300;0;0mf') == [
+        (RED, 0, 0), (RED, 0, 0), (RED, 0, 0), (RED, 0, BOLD),
+        (RED, 0, BOLD), (rgb_color(44, 0, 0), 0, 0)]
+
+def test_ignored_sequences():
+    # Cursor movement, erasing, window titles, hyperlinks, character sets
+    # (tput sgr0 starts with '\x1b(B'), saving the cursor and stray escapes
+    # don't style anything or show up as text
+    assert styles('a\x1b[2Kb\x1b[10;5Hc\x1b]0;title\x07d'
+                  '\x1b]8;;http://example.com\x1b\\e\x1b(B\x1b[mf\x1b7g\x1b'
+                  ) == [(0, 0, 0)]*7
+    assert styles('\x1b[1ma\x1b[?25lb\x1b(0c') == [(0, 0, BOLD)]*3
@@ -0,0 +1,42 @@
+""" Checks that decode_spans() only accepts spans whose fg, bg and attrs can
+be stored in a cell, and raises a ValueError (rather than handing back cells
+that blow up later on) for anything else.
+
+example:
+    python -m pytest spans_test.py
+"""
+
+from utilities.spans import SPANS_HEADER, decode_spans, encode_spans
+from utilities.sgr_tokenizer import DIM, RGB_COLOR
+
+
+def raises_value_error(line: str) -> bool:
+    """ Returns True if decoding a block with 'line' as its only row raises a
+    ValueError
+    """
+    try:
+        decode_spans(f'{SPANS_HEADER}\n{line}')
+    except ValueError:
+        return True
+    return False
+
+def test_round_trip():
+    rows = [[(ord('a'), RGB_COLOR | 0xFF0000, 0, DIM), (ord('b'), 0, 0, 0)],
+            []]
+    assert decode_spans(encode_spans(rows)) == rows
+
+def test_largest_values():
+    assert decode_spans(f'{SPANS_HEADER}\n[["a",4294967295,0,4294967295]]') \
+        == [[(ord('a'), 4294967295, 0, 4294967295)]]
+
+def test_wrong_types():
+    assert raises_value_error('[["a","red",0,0]]')
+    assert raises_value_error('[["a",0,null,0]]')
+    assert raises_value_error('[["a",0,0,1.5]]')
+    assert raises_value_error('[["a",0,0,true]]')
+    assert raises_value_error('[["a",[1],0,0]]')
+
+def test_out_of_range():
+    assert raises_value_error('[["a",-1,0,0]]')
+    assert raises_value_error('[["a",0,4294967296,0]]')
+    assert raises_value_error('[["a",0,0,-2]]')
@@ -28,25 +28,15 @@ def get_solid_block():
 def fill_screen_random(width, height):
     """ Fills the screen with randomly colored blocks
     """
-    screen_text = ''
-    for y in range(height):
-        for x in range(width):
-            screen_text += get_random_block()
-        screen_text += '\n'
-    # we use strip() here to get rid of the last new line character
-    return screen_text.strip()
+    rows = [''.join([get_random_block() for x in range(width)])
+            for y in range(height)]
+    return '\n'.join(rows)
 
 def fill_screen_solid(width, height):
     """ Fills the screen with randomly colored blocks
     """
-    screen_text = ''
     block = get_solid_block()
-    for y in range(height):
-        for x in range(width):
-            screen_text += block
-        screen_text += '\n'
-    # we use strip() here to get rid of the last new line character
-    return screen_text.strip()
+    return '\n'.join([block*width]*height)
 
 def get_term_file_path():
     this_file_path = os.path.abspath(__file__)
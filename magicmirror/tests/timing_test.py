@@ -0,0 +1,18 @@
+""" Checks the percentiles that 'python mirror_stats.py timings' reports.
+
+example:
+    python -m pytest timing_test.py
+"""
+from utilities.timing import percentile
+
+
+def test_nearest_rank():
+    assert percentile([1, 2, 3, 4, 5, 6], 0.5) == 3
+    assert percentile([1, 2, 3, 4, 5], 0.5) == 3
+    assert percentile(list(range(1, 21)), 0.95) == 19
+    assert percentile(list(range(1, 101)), 0.07) == 7
+
+def test_ends():
+    assert percentile([4], 0.5) == 4
+    assert percentile([1, 2, 3], 0) == 1
+    assert percentile([1, 2, 3], 1) == 3
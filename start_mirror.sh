@@ -9,7 +9,34 @@
 PROJECT_DIR=$(dirname $0)
 MIRROR_DIR=$PROJECT_DIR/magicmirror/mirror
 
-python $MIRROR_DIR/make_term_file.py
+# --restore starts the screen off with whatever was on it before the mirror
+# was last stopped (dimmed, since it's out of date), so we don't stare at a
+# blank screen while the startup commands run.
+python $MIRROR_DIR/make_term_file.py --restore
+# The compositor keeps the screen in memory and applies the updates from the
+# cron jobs. It has to be started after make_term_file.py creates the grid.
+# With --restore it puts back each region from the last time it ran, and they
+# stay dimmed until they're refreshed.
+# It only starts listening on its socket once that's done, so we wait for the
+# socket before starting anything that sends it updates. Otherwise an early
+# update would fall back to update_mirror.py, and could be covered up by the
+# old regions. A socket left over from last time would look like it's ready,
+# so it's removed first. If the compositor doesn't come up, we carry on after
+# 30 seconds anyway - the updates fall back to update_mirror.py.
+SOCKET=$MIRROR_DIR/compositor.sock
+rm -f $SOCKET
+python $MIRROR_DIR/compositor.py --restore &
+COMPOSITOR_PID=$!
+for i in $(seq 300); do
+    [ -S $SOCKET ] && break
+    kill -0 $COMPOSITOR_PID 2> /dev/null || break
+    sleep 0.1
+done
 python $MIRROR_DIR/cron_launcher.py
-bash $PROJECT_DIR/command.sh
-$PROJECT_DIR/color-watch.sh cat $MIRROR_DIR/term.txt
+# The startup commands run in the background, so the mirror is displayed
+# straight away, and each region is refreshed as soon as its command finishes.
+bash $PROJECT_DIR/command.sh &
+# renderer.py displays term.txt, redrawing only the parts of the screen that
+# changed. The old way of doing this was:
+#   $PROJECT_DIR/color-watch.sh cat $MIRROR_DIR/term.txt
+python $MIRROR_DIR/renderer.py